@@ -13,8 +13,11 @@ import io
 import json
 import asyncio
 import importlib.util
+import shutil
+import sys
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, List, Optional
+from typing import Any, List, Optional, Tuple
 
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,8 +25,14 @@ from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from pathlib import Path
 
+# The PDF, upload and cache modules are shared with the curasense-ml app (curasense-ml/src);
+# see the same setup in flow.py.
+_CURASENSE_ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _CURASENSE_ML_DIR not in sys.path:
+    sys.path.append(_CURASENSE_ML_DIR)
+
 # Optional PDF/OCR libs
-# pip install pdfplumber pillow pytesseract
+# pip install pdfplumber PyPDF2 pillow pytesseract
 try:
     import pdfplumber
 except Exception:
@@ -32,10 +41,16 @@ except Exception:
 try:
     from PIL import Image
     import pytesseract
+    from src.ocr import ocr_pages
     OCR_AVAILABLE = True
 except Exception:
     OCR_AVAILABLE = False
 
+from src.boilerplate import strip_boilerplate
+from src.parse_cache import store_pages
+from src.pdf_parser import extract_pages_parallel, timed_out_pages
+from src.uploads import spool_upload
+
 # -------------------------
 # App + basic config
 # -------------------------
@@ -95,15 +110,19 @@ def append_cache(thread_id: str, text: str):
 FLOW_FILE_PATH = "flow.py"  # <-- replace if different at runtime
 CdssPipeline = None
 normalize_fn = None
+preload_models_fn = None
+models_ready_fn = None
 
 def _load_flow_module(path: str):
-    global CdssPipeline, normalize_fn
+    global CdssPipeline, normalize_fn, preload_models_fn, models_ready_fn
     try:
         spec = importlib.util.spec_from_file_location("user_flow_module", path)
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
         CdssPipeline = getattr(module, "CdssPipeline", None)
         normalize_fn = getattr(module, "normalize", None)
+        preload_models_fn = getattr(module, "preload_models", None)
+        models_ready_fn = getattr(module, "models_ready", None)
         if CdssPipeline is None:
             print("CdssPipeline not found in flow module.")
         else:
@@ -116,6 +135,23 @@ def _load_flow_module(path: str):
 # Attempt to load on startup
 _load_flow_module(FLOW_FILE_PATH)
 
+# Set by gunicorn.conf.py: the master loads the NER and scispaCy weights before forking,
+# so every worker shares one copy of them copy-on-write instead of loading its own.
+if os.getenv("PRELOAD_MODELS") == "1" and preload_models_fn:
+    preload_models_fn(warmup=False)
+
+def _warm_models():
+    try:
+        preload_models_fn()
+    except Exception as e:
+        print(f"Warning: model warm-up failed: {e}")
+
+@app.on_event("startup")
+async def warm_models():
+    """Warm the models in the background so the server accepts requests right away; see /ready."""
+    if preload_models_fn:
+        threading.Thread(target=_warm_models, name="model-warmup", daemon=True).start()
+
 def _run_pipeline_blocking(sample_text: str, tavily_api: str) -> Any:
     """Blocking call to instantiate and run the CdssPipeline; returns pipeline output/state."""
     if CdssPipeline is None:
@@ -145,47 +181,39 @@ async def run_pipeline_async(sample_text: str, tavily_api: str) -> Any:
 # -------------------------
 # PDF text extraction helper
 # -------------------------
-def extract_text_from_pdf_bytes(data: bytes) -> str:
+def extract_text_from_pdf_file(path: str, file_sha: Optional[str] = None) -> Tuple[str, List[int]]:
     """
-    Blocking extraction of text from PDF bytes.
-    - tries pdfplumber for text PDFs
-    - falls back to OCR via pytesseract if available
+    Blocking extraction of text from a spooled PDF upload.
+    Returns the text and the pages left out because their extraction timed out.
+    - classifies each page in one pdfplumber pass (page-parallel for large files):
+      text-layer pages are read directly, scanned pages are OCR'd in parallel if pytesseract is available
+    - falls back to OCR of the whole upload as an image when it is not a readable PDF
+    - strips letterheads/footers repeated across pages before returning
     """
-    # Try pdfplumber
+    # Try pdfplumber, OCRing only the pages without a text layer
     if pdfplumber:
         try:
-            text_parts = []
-            with pdfplumber.open(io.BytesIO(data)) as pdf:
-                for page in pdf.pages:
-                    t = page.extract_text()
-                    if t:
-                        text_parts.append(t)
-            joined = "\n".join(text_parts).strip()
-            if joined:
-                return joined
+            # pages are extracted in parallel across the shared PDF process pool
+            records = extract_pages_parallel(path, file_sha=file_sha)
+            if OCR_AVAILABLE:
+                # scanned pages are OCR'd on the dedicated OCR pool, not this executor
+                ocr_pages(path, records)
+                store_pages(records)
+            text_parts = [record["text"] for record in records if record["text"]]
+            return "\n".join(strip_boilerplate(text_parts)).strip(), timed_out_pages(records)
         except Exception:
             pass
 
-    # Fallback OCR
+    # Fallback OCR for uploads pdfplumber cannot open (e.g. an image sent as a report)
     if OCR_AVAILABLE:
         try:
-            text_parts = []
-            if pdfplumber:
-                with pdfplumber.open(io.BytesIO(data)) as pdf:
-                    for page in pdf.pages:
-                        # render as PIL image then OCR
-                        pil = page.to_image(resolution=200).original
-                        text_parts.append(pytesseract.image_to_string(pil))
-            else:
-                # if pdfplumber unavailable, attempt to open via PIL (rare)
-                img = Image.open(io.BytesIO(data))
-                text_parts.append(pytesseract.image_to_string(img))
-            return "\n".join(text_parts).strip()
+            with Image.open(path) as img:
+                return pytesseract.image_to_string(img).strip(), []
         except Exception:
             pass
 
     # Could not extract
-    return ""
+    return "", []
 
 # -------------------------
 # Your original endpoints (kept)
@@ -319,6 +347,14 @@ async def prelim_interrupt(request: Request):
     return StreamingResponse(_chunk_streamer(lines), media_type="text/plain")
 
 
+def _link_or_copy(source, destination):
+    """Hard-link source to destination, or copy it where links are not possible (other device, no link support)."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
 @app.post("/extractMedicalDetails")
 async def extract_medical_details_endpoint(files: List[UploadFile] = File(...), thread_id: str = Form(...)):
     """
@@ -329,27 +365,40 @@ async def extract_medical_details_endpoint(files: List[UploadFile] = File(...),
 
     # 1) read & extract text from each uploaded file (use executor for blocking IO)
     extracted_texts = []
+    timeout_notes = []
     loop = asyncio.get_running_loop()
     for upload in files:
-        raw = await upload.read()   # bytes
-        # run extraction in thread to avoid blocking event loop
-        text = await loop.run_in_executor(_executor, extract_text_from_pdf_bytes, raw)
-        extracted_texts.append(f"--- {upload.filename} ---\n{text}")
-
-        # save raw file to uploads folder for record
-        try:
-            save_dir = UPLOADS_DIR / thread_id
-            save_dir.mkdir(parents=True, exist_ok=True)
-            out_path = save_dir / upload.filename
-            out_path.write_bytes(raw)
-        except Exception:
-            pass
+        # spool the upload in chunks next to the stored uploads, so it can be linked rather than copied
+        async with spool_upload(upload, directory=str(UPLOADS_DIR)) as spooled:
+            # run extraction in thread to avoid blocking event loop
+            text, timed_out = await loop.run_in_executor(_executor, extract_text_from_pdf_file, spooled.path, spooled.sha256)
+            extracted_texts.append(f"--- {upload.filename} ---\n{text}")
+            if timed_out:
+                timeout_notes.append(f"{upload.filename} pages {', '.join(map(str, timed_out))}")
+
+            # save raw file to uploads folder for record: stored once by content hash,
+            # and linked into the thread's folder
+            try:
+                blob_path = UPLOADS_DIR / "blobs" / spooled.sha256
+                if not blob_path.exists():
+                    blob_path.parent.mkdir(parents=True, exist_ok=True)
+                    _link_or_copy(spooled.path, blob_path)
+                save_dir = UPLOADS_DIR / thread_id
+                save_dir.mkdir(parents=True, exist_ok=True)
+                out_path = save_dir / upload.filename
+                if out_path.exists():
+                    out_path.unlink()
+                _link_or_copy(blob_path, out_path)
+            except OSError as e:
+                print(f"Warning: could not save upload {upload.filename} for {thread_id}: {e!r}")
 
     combined_text = "\n\n".join(extracted_texts).strip() or " "
 
     async def streamer():
         yield f"[extractMedicalDetails] received {len(files)} file(s) for {thread_id}\n".encode()
         yield f"[extractMedicalDetails] extracted text length: {len(combined_text)} chars\n".encode()
+        if timeout_notes:
+            yield f"[extractMedicalDetails] extraction timed out, left out: {'; '.join(timeout_notes)}\n".encode()
         yield b"[extractMedicalDetails] starting pipeline...\n"
 
         # run pipeline on extracted text
@@ -442,6 +491,19 @@ async def medical_insight_report(request: Request):
 async def health():
     return JSONResponse({"ok": True})
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the models are loaded and warm in this worker, 503 until then."""
+    if models_ready_fn is None or not models_ready_fn():
+        return JSONResponse({"ready": False}, status_code=503)
+    return JSONResponse({"ready": True})
+
+@app.get("/ner-cache/stats")
+async def get_ner_cache_stats():
+    """Hit rate and size of the sentence-level NER cache in this worker."""
+    from src.hugging_face_ner import ner_cache_stats
+    return JSONResponse(ner_cache_stats())
+
 @app.get("/cache/{thread_id}")
 async def get_cache(thread_id: str):
     p = CACHE_DIR / f"{thread_id}.md"
@@ -9,33 +9,144 @@ CdssPipeline — updated to:
 """
 
 import os
+import sys
 import json
 import asyncio
 import re
+import threading
 from pydantic import BaseModel
 from crewai import Flow
 from crewai.flow.flow import listen, start, and_
 from tavily import TavilyClient
 
-from src.hugging_face_ner import process_ner_output, generate_clean_ner_report
+# Modules Mini-CDSS shares with the curasense-ml app (src/section_segmenter.py, ...) live in
+# curasense-ml/src. Neither src/ has an __init__.py, so with the parent directory on the path
+# `src` spans both; Mini-CDSS's own src/ comes first and wins for the modules it has.
+_CURASENSE_ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _CURASENSE_ML_DIR not in sys.path:
+    sys.path.append(_CURASENSE_ML_DIR)
+
+from src.hugging_face_ner import (process_ner_output, generate_clean_ner_report,
+                                  preload as preload_ner_model, is_ready as ner_model_ready)
+from src.umls_index import get_umls_index
+from src.section_segmenter import route_note
+from src.lab_engine import extract as extract_lab_results, format_result
 from src.crew.agents_and_taks import ner_validation_crew, prelim_diag_crew, report_writing_crew
 
-# Optional: scispaCy (if installed)
-try:
-    import spacy
-    from scispacy.umls_linking import UmlsEntityLinker  # type: ignore
+# Optional: scispaCy (if installed). Loaded on first use or by preload_models(),
+# so importing this module does not load any model.
+_SCI_NLP = None
+_UMLS_LINKER = None
+_SCI_LOADED = False
+_SCI_LOCK = threading.Lock()
+# Only tokenization and NER (plus the UMLS linker) are used; the rest of the pipeline is never loaded.
+SCI_EXCLUDE = ["tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+# Documents per nlp.pipe batch.
+SCI_BATCH_SIZE = 8
+# Parts of a combined input run as separate docs: blank lines, and the
+# "--- filename ---" lines /extractMedicalDetails puts before each file.
+_DOCUMENT_BREAK = re.compile(r"\n\s*\n|^--- .+ ---$", re.MULTILINE)
+
+
+def _add_umls_linker(nlp):
+    """Attach the UMLS entity linker; returns it, or None if it is not available."""
     try:
-        _SCI_NLP = spacy.load("en_ner_bc5cdr_md")
+        import scispacy.linking  # noqa: F401  (registers the "scispacy_linker" factory)
+        return nlp.add_pipe("scispacy_linker", config={"resolve_abbreviations": True, "linker_name": "umls"})
     except Exception:
-        _SCI_NLP = spacy.load("en_core_sci_sm")
+        pass
     try:
-        _UMLS_LINKER = UmlsEntityLinker(resolve_abbreviations=True)
-        _SCI_NLP.add_pipe(_UMLS_LINKER)
+        # scispaCy releases for spaCy 2
+        from scispacy.umls_linking import UmlsEntityLinker  # type: ignore
+        linker = UmlsEntityLinker(resolve_abbreviations=True)
+        nlp.add_pipe(linker)
+        return linker
     except Exception:
-        _UMLS_LINKER = None
-except Exception:
-    _SCI_NLP = None
-    _UMLS_LINKER = None
+        return None
+
+
+def get_sci_nlp():
+    """Return the scispaCy pipeline, loading it once per process; None if scispaCy is not installed."""
+    global _SCI_NLP, _UMLS_LINKER, _SCI_LOADED
+    if not _SCI_LOADED:
+        with _SCI_LOCK:
+            if not _SCI_LOADED:
+                try:
+                    import spacy
+                    try:
+                        nlp = spacy.load("en_ner_bc5cdr_md", exclude=SCI_EXCLUDE)
+                    except Exception:
+                        nlp = spacy.load("en_core_sci_sm", exclude=SCI_EXCLUDE)
+                    # With a memory-mapped concept index (UMLS_INDEX_DIR) the linker's
+                    # in-memory knowledge base is not loaded at all
+                    _UMLS_LINKER = None if get_umls_index() else _add_umls_linker(nlp)
+                    _SCI_NLP = nlp
+                except Exception:
+                    _SCI_NLP = None
+                    _UMLS_LINKER = None
+                _SCI_LOADED = True
+    return _SCI_NLP
+
+
+def _split_documents(text: str):
+    """Yield (start, part) for each uploaded file and paragraph of a combined input."""
+    last = 0
+    for match in list(_DOCUMENT_BREAK.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        part = text[last:end]
+        if part.strip():
+            start = last + len(part) - len(part.lstrip())
+            yield start, part.strip()
+        last = match.end() if match else end
+
+
+def sci_entities(text: str):
+    """
+    scispaCy entities of text, with the best UMLS concept of each when the linker is loaded.
+    The parts of the text are run through nlp.pipe together rather than as one doc.
+    Entities are linked with the memory-mapped index in UMLS_INDEX_DIR when it is set.
+
+    Returns:
+        list: {"text", "label", "start", "end", "cui", "link_score"} with offsets into text.
+    """
+    nlp = get_sci_nlp()
+    umls_index = get_umls_index()
+    parts = list(_split_documents(text))
+    entities = []
+    for (offset, _), doc in zip(parts, nlp.pipe((part for _, part in parts), batch_size=SCI_BATCH_SIZE)):
+        for ent in doc.ents:
+            if umls_index is not None:
+                linked = umls_index.link(ent.text)
+            else:
+                # spaCy 3 linker: ent._.kb_ents; spaCy 2 UmlsEntityLinker: ent._.umls_ents
+                linked = getattr(ent._, "kb_ents", None) or getattr(ent._, "umls_ents", None) or []
+            best = linked[0] if len(linked) > 0 else None
+            entities.append({
+                "text": ent.text,
+                "label": ent.label_,
+                "start": offset + ent.start_char,
+                "end": offset + ent.end_char,
+                "cui": best[0] if best else None,
+                "link_score": float(best[1]) if best else None,
+            })
+    return entities
+
+
+def preload_models(warmup: bool = True):
+    """
+    Load the scispaCy pipeline and the HF NER model ahead of the first pipeline run.
+    Called with warmup=False in a server process that forks workers afterwards
+    (see gunicorn.conf.py), and with warmup=True in each worker.
+    """
+    nlp = get_sci_nlp()
+    if warmup and nlp is not None:
+        sci_entities("Patient has fever and cough.")
+    preload_ner_model(warmup=warmup)
+
+
+def models_ready() -> bool:
+    """True once preload_models(warmup=True) has finished in this process."""
+    return ner_model_ready()
 
 
 # -------------------------
@@ -66,19 +177,27 @@ def normalize(val):
 # -------------------------
 # Helpers: parsing lab/vital values
 # -------------------------
+def parse_lab_values(text):
+    """
+    Numeric lab and vital values in text, in canonical units (see src.lab_engine).
+    Returns dict like: {"RBS": 350.0, "HbA1c": 10.5, "BP_systolic": 140.0, "BP_diastolic": 90.0, "Creatinine": 1.4}
+    """
+    return {key: result.value for key, result in extract_lab_results(text).items()}
+
+
 def parse_lab_values_from_postner(post_ner):
     """
-    Extract numeric lab values (Random blood sugar, HbA1c, BP) from structured post_ner or raw text.
-    Returns dict like: {"RBS": 350.0, "HbA1c": 10.5, "BP_systolic":140, "BP_diastolic":90}
+    Extract numeric lab values from structured post_ner or raw text; see parse_lab_values.
+    The pipeline parses the note once in its first step, so it only needs this for
+    post_ner dicts that did not come from a CdssPipeline run.
     """
-    results = {}
     text_source = ""
 
     # Prefer explicit structured fields
     if isinstance(post_ner, dict):
         # If NERValidationOutput contains a field with raw_text or sample_text, prefer it
         for candidate in ("raw_text", "sample_text", "text", "report", "raw_report"):
-            val = post_ner.get(candidate) if isinstance(post_ner, dict) else None
+            val = post_ner.get(candidate)
             if val:
                 text_source = str(val)
                 break
@@ -89,63 +208,20 @@ def parse_lab_values_from_postner(post_ner):
         except Exception:
             text_source = str(post_ner)
 
-    # Normalize spacing
-    text_source = re.sub(r"\s+", " ", text_source)
-
-    # Random blood sugar (e.g., "350 mg/dl")
-    m = re.search(r"(?:random\s*blood\s*sugar[:\s]*)?([0-9]{2,4}(?:\.[0-9]+)?)\s*(mg\/dl|mg dl|mgdl)?", text_source, re.IGNORECASE)
-    if m:
-        try:
-            # Heuristic: if mg/dl unit present or nearby keywords present
-            unit = m.group(2)
-            val = float(m.group(1))
-            # To avoid capturing other numeric values (age etc.) confirm presence of sugar/blood nearby
-            context_window = text_source[max(0, m.start()-40): m.end()+40].lower()
-            if ("sugar" in context_window) or ("mg/dl" in (unit or "").lower()) or ("random" in context_window):
-                results["RBS"] = val
-        except Exception:
-            pass
-
-    # HbA1c e.g. "HbA1c 10.5" or "10.5%"
-    m2 = re.search(r"(hb[a\-]?1c|hba1c)[^\d]{0,6}([0-9]{1,2}(?:\.[0-9]+)?)\s*%?", text_source, re.IGNORECASE)
-    if m2:
-        try:
-            results["HbA1c"] = float(m2.group(2))
-        except Exception:
-            pass
-    else:
-        # sometimes HbA1c appears as "10.5%" standalone
-        m2b = re.search(r"([0-9]{1,2}(?:\.[0-9]+)?)\s*%", text_source)
-        if m2b:
-            # only accept if nearby "hba1c" or "A1c" mention exists in surrounding text
-            span = text_source[max(0, m2b.start()-40): m2b.end()+40].lower()
-            if "hba1c" in span or "a1c" in span:
-                try:
-                    results["HbA1c"] = float(m2b.group(1))
-                except Exception:
-                    pass
-
-    # Blood pressure e.g. "140/90 mmHg"
-    m3 = re.search(r"([0-9]{2,3})\s*\/\s*([0-9]{2,3})\s*(mmhg)?", text_source, re.IGNORECASE)
-    if m3:
-        try:
-            results["BP_systolic"] = int(m3.group(1))
-            results["BP_diastolic"] = int(m3.group(2))
-        except Exception:
-            pass
-
-    return results
+    return parse_lab_values(text_source)
 
 
 # -------------------------
 # Deterministic prelim diagnosis (fallback)
 # -------------------------
-def rule_based_prelim_diagnoses(post_ner_normalized, min_count=3):
+def rule_based_prelim_diagnoses(post_ner_normalized, min_count=3, labs=None):
     """
     Return a list of dicts: {preliminary_diagnosis, confidence, reasoning, recommendations}
+    labs: values already parsed by parse_lab_values; parsed from post_ner_normalized if None.
     """
     diagnoses = []
-    labs = parse_lab_values_from_postner(post_ner_normalized)
+    if labs is None:
+        labs = parse_lab_values_from_postner(post_ner_normalized)
 
     # collect symptoms
     symptoms = []
@@ -269,37 +345,31 @@ class CdssPipeline(Flow):
     # --------------------------------------------------------
     @start()
     def initial_hugging_face_ner_report(self):
+        # Vitals and labs are parsed by regex; NER only runs on the history-like sections
+        routed = route_note(self.sample_text)
+        self.state["regex_vitals"] = routed.vitals
+        self.state["regex_labs"] = routed.labs
+        # One scan of the note serves the rule-based diagnoses, the report and its red flags
+        # (route_note has already scanned it, so this is a memo hit)
+        self.state["lab_results"] = extract_lab_results(self.sample_text)
+        structured = {"vital_signs": routed.vitals, "laboratory_values": routed.labs}
+
         # Use scispaCy if present, else HF functions
-        if _SCI_NLP:
+        if get_sci_nlp():
             try:
-                doc = _SCI_NLP(self.sample_text)
-                ents = []
-                for ent in doc.ents:
-                    umls_ents = getattr(ent._, "umls_ents", []) or []
-                    best = umls_ents[0] if len(umls_ents) > 0 else None
-                    cui = best[0] if best else None
-                    score = best[1] if best else None
-                    ents.append({
-                        "text": ent.text,
-                        "label": ent.label_,
-                        "start": ent.start_char,
-                        "end": ent.end_char,
-                        "cui": cui,
-                        "link_score": float(score) if score is not None else None
-                    })
-                report = {"entities": ents, "sample_text": self.sample_text}
-                return {"report": report, "sample_text": self.sample_text}
+                ents = sci_entities(routed.ner_text) if routed.ner_text else []
+                report = {"entities": ents, **structured}
+                return {"report": report, "sample_text": self.sample_text, "residual": routed.residual}
             except Exception:
                 # fallback to HF
                 pass
 
-        tagged_tokens, unique_tags = process_ner_output(self.sample_text)
+        tagged_tokens, unique_tags = process_ner_output(routed.ner_text) if routed.ner_text else ([], [])
         report = generate_clean_ner_report(tagged_tokens, unique_tags)
         if not isinstance(report, dict):
-            report = {"raw_report": report, "sample_text": self.sample_text}
-        else:
-            report["sample_text"] = self.sample_text
-        return {"report": report, "sample_text": self.sample_text}
+            report = {"raw_report": report}
+        report.update(structured)
+        return {"report": report, "sample_text": self.sample_text, "residual": routed.residual}
 
     # --------------------------------------------------------
     # 2. NER Validation (use crew if available; fallback to raw)
@@ -310,7 +380,9 @@ class CdssPipeline(Flow):
         sample_text = report_dict["sample_text"]
 
         try:
-            result = ner_validation_crew.kickoff(inputs={"input_text": sample_text, "ner_output": report})
+            # The crew only needs the text the regexes did not account for
+            input_text = report_dict.get("residual") or sample_text
+            result = ner_validation_crew.kickoff(inputs={"input_text": input_text, "ner_output": report})
             parsed = normalize(result)
         except Exception as e:
             # fallback: keep HF output but normalize keys into expected structure
@@ -321,6 +393,10 @@ class CdssPipeline(Flow):
             else:
                 parsed["raw_report"] = report
             parsed["sample_text"] = sample_text
+        if isinstance(parsed, dict):
+            # Regex-parsed values fill in what the crew did not report; the crew's own values stay
+            parsed["vital_signs"] = {**self.state["regex_vitals"], **(parsed.get("vital_signs") or {})}
+            parsed["laboratory_values"] = {**self.state["regex_labs"], **(parsed.get("laboratory_values") or {})}
 
         self.state["post_ner_report"] = parsed
         return parsed
@@ -344,7 +420,8 @@ class CdssPipeline(Flow):
             print("Warning: prelim_diag_crew failed — using rule-based fallback. Error:", repr(e))
 
         # Deterministic fallback
-        fallback = rule_based_prelim_diagnoses(post_ner_norm, min_count=3)
+        labs = {key: result.value for key, result in self.state["lab_results"].items()}
+        fallback = rule_based_prelim_diagnoses(post_ner_norm, min_count=3, labs=labs)
         self.state["prelim_report"] = fallback
         return fallback
 
@@ -519,16 +596,14 @@ class CdssPipeline(Flow):
                 if m:
                     presenting_complaint = (m.group(0) or presenting_complaint).strip()
 
-            # Extract labs/vitals heuristically if still empty
-            labs_parsed = parse_lab_values_from_postner(post_ner)
-            if labs_parsed:
-                if "RBS" in labs_parsed and "Random blood sugar" not in lab_values:
-                    lab_values["Random blood sugar"] = f"{labs_parsed['RBS']} mg/dl"
-                if "HbA1c" in labs_parsed and "HbA1c" not in lab_values:
-                    lab_values["HbA1c"] = f"{labs_parsed['HbA1c']}%"
-
-                if "BP_systolic" in labs_parsed and "BP_diastolic" in labs_parsed and "Blood pressure" not in vital_signs:
-                    vital_signs["Blood pressure"] = f"{labs_parsed['BP_systolic']}/{labs_parsed['BP_diastolic']} mmHg"
+        # Fill labs/vitals the structured output missed from the note's lab scan
+        lab_results = self.state.get("lab_results") or {}
+        for result in lab_results.values():
+            if result.category == "lab" and result.label not in lab_values:
+                lab_values[result.label] = format_result(result)
+        if "BP_systolic" in lab_results and "BP_diastolic" in lab_results and "Blood pressure" not in vital_signs:
+            vital_signs["Blood pressure"] = (f"{lab_results['BP_systolic'].value:g}/"
+                                             f"{lab_results['BP_diastolic'].value:g} mmHg")
 
         # Normalize lists to "Not Provided" if empty
         if not history:
@@ -620,7 +695,7 @@ class CdssPipeline(Flow):
                 md_lines.append("")
         # Red flags detection
         red_flags = []
-        labs_for_flags = parse_lab_values_from_postner(post_ner)
+        labs_for_flags = {key: result.value for key, result in lab_results.items()}
         if labs_for_flags.get("RBS") and labs_for_flags.get("RBS") >= 400:
             red_flags.append("Severely elevated blood glucose (RBS >= 400 mg/dl). Consider urgent escalation.")
         if labs_for_flags.get("BP_systolic") and labs_for_flags.get("BP_systolic") >= 180:
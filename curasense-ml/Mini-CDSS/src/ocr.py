@@ -0,0 +1,183 @@
+"""
+OCR for scanned PDF pages.
+
+Pages are rendered one at a time (pdfium is not thread-safe) and handed to a
+dedicated pool of OCR threads; tesseract runs as a subprocess, so the threads
+OCR pages truly in parallel. Pages are first OCR'd at a low resolution and only
+re-rendered at a higher one when tesseract's confidence is poor. Results are
+cached per page image, so a page seen before is not OCR'd again.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pdfplumber
+import pytesseract
+
+from src.pdf_parser import image_boxes, open_pdf_source
+
+# Render resolutions: every page starts at LOW_RESOLUTION, and is redone at
+# HIGH_RESOLUTION when its mean word confidence is below MIN_CONFIDENCE (0-100).
+LOW_RESOLUTION = 150
+HIGH_RESOLUTION = 300
+MIN_CONFIDENCE = 70.0
+# OCR threads; each runs one tesseract process at a time.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 2))
+# Page images whose OCR text is kept in memory.
+MAX_CACHED_PAGES = 512
+
+# Several tesseract processes run side by side; stop each from also spreading over every core.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+_ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+
+_ocr_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_ocr_cache_lock = threading.Lock()
+
+
+def image_hash(image) -> str:
+    """Content hash of a rendered page image, used as the OCR cache key."""
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _cache_get(key: str) -> Optional[Tuple[str, float]]:
+    with _ocr_cache_lock:
+        if key in _ocr_cache:
+            _ocr_cache.move_to_end(key)
+            return _ocr_cache[key]
+    return None
+
+
+def _cache_put(key: str, text: str, confidence: float):
+    with _ocr_cache_lock:
+        _ocr_cache[key] = (text, confidence)
+        _ocr_cache.move_to_end(key)
+        while len(_ocr_cache) > MAX_CACHED_PAGES:
+            _ocr_cache.popitem(last=False)
+
+
+def ocr_image(image) -> Tuple[str, float]:
+    """
+    OCR one image in a single tesseract run.
+
+    Returns:
+        tuple: (text, mean word confidence 0-100; 0 when no words were found)
+    """
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if confidence < 0 or not word.strip():
+            continue
+        confidences.append(confidence)
+        lines.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(word)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+
+def _ocr_cached(key: str, image) -> Tuple[str, float]:
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    text, confidence = ocr_image(image)
+    _cache_put(key, text, confidence)
+    return text, confidence
+
+
+def _ocr_task(key: str, image) -> Tuple[str, float, float]:
+    """Pool task: cached OCR of one image, plus the seconds it took."""
+    started = time.perf_counter()
+    text, confidence = _ocr_cached(key, image)
+    return text, confidence, time.perf_counter() - started
+
+
+def _render(region, resolution: int):
+    return region.to_image(resolution=resolution).original
+
+
+def ocr_page(page) -> str:
+    """
+    Synchronous OCR of a pdfplumber page or cropped region, for use as the `ocr`
+    hook of src.pdf_parser. Uses the same adaptive resolution and cache as ocr_pages.
+    """
+    image = _render(page, LOW_RESOLUTION)
+    text, confidence = _ocr_cached(image_hash(image), image)
+    if confidence < MIN_CONFIDENCE:
+        image = _render(page, HIGH_RESOLUTION)
+        text, _ = _ocr_cached(image_hash(image), image)
+    return text
+
+
+def ocr_pages(source, records: List[Dict]) -> List[Dict]:
+    """
+    OCR the scanned and mixed pages of a PDF whose text layer was already extracted
+    (records from src.pdf_parser.extract_pages_parallel), filling in their text.
+
+    Scanned pages are OCR'd whole; on mixed pages only the image regions are,
+    and their text is appended to the text layer. Each record's engine and
+    seconds are updated to include the OCR work.
+
+    Args:
+        source: Raw bytes or path of the PDF
+        records: Per-page records, updated in place
+
+    Returns:
+        list: The same records
+    """
+    # Pages OCR'd before (e.g. served from the parse cache) already have their engine set
+    pending = [record for record in records
+               if record["kind"] in ("scanned", "mixed") and record["engine"] in ("none", "pdfplumber")]
+    if not pending:
+        return records
+
+    with open_pdf_source(source) as stream, pdfplumber.open(stream) as pdf:
+        # First pass: render every region at low resolution and OCR them all in parallel.
+        regions = []    # (record, region)
+        futures = []
+        for record in pending:
+            started = time.perf_counter()
+            page = pdf.pages[record["page_no"] - 1]
+            page_regions = [page] if record["kind"] == "scanned" else [page.crop(box) for box in image_boxes(page)]
+            for region in page_regions:
+                image = _render(region, LOW_RESOLUTION)
+                regions.append((record, region))
+                futures.append(_ocr_pool.submit(_ocr_task, image_hash(image), image))
+            record["seconds"] += time.perf_counter() - started
+        results = [future.result() for future in futures]
+
+        # Second pass: redo only the regions tesseract was unsure about, at high resolution.
+        retry = [i for i, (_, confidence, _) in enumerate(results) if confidence < MIN_CONFIDENCE]
+        retry_futures = []
+        for i in retry:
+            started = time.perf_counter()
+            image = _render(regions[i][1], HIGH_RESOLUTION)
+            regions[i][0]["seconds"] += time.perf_counter() - started
+            retry_futures.append(_ocr_pool.submit(_ocr_task, image_hash(image), image))
+        for i, future in zip(retry, retry_futures):
+            text, confidence, seconds = future.result()
+            regions[i][0]["seconds"] += seconds
+            if confidence >= results[i][1]:
+                results[i] = (text, confidence, results[i][2])
+
+    for (record, _), (_, _, seconds) in zip(regions, results):
+        record["seconds"] += seconds
+    for record in pending:
+        ocr_text = "\n".join(text for (owner, _), (text, _, _) in zip(regions, results) if owner is record and text)
+        if record["kind"] == "scanned":
+            record["text"] = ocr_text
+            record["engine"] = "ocr"
+        else:
+            record["text"] = "\n".join(part for part in (record["text"], ocr_text) if part)
+            record["engine"] = "pdfplumber+ocr"
+        record["seconds"] = round(record["seconds"], 4)
+        # Changed since it was cached; store it again
+        record["cached"] = False
+    return records
@@ -0,0 +1,228 @@
+"""
+Compact, memory-mapped UMLS concept index for entity linking.
+
+Replaces scispaCy's in-memory UmlsEntityLinker knowledge base and TF-IDF
+index. Concept names and character 3-gram postings are stored in flat numpy
+files that every process maps read-only, so N workers share one copy through
+the page cache and only the pages a lookup touches become resident.
+
+Build once (needs scispaCy for its UMLS knowledge base, or a knowledge base
+jsonl file with concept_id / canonical_name / aliases per line):
+
+    python -m src.umls_index build models/umls-index [--kb-jsonl umls_kb.jsonl]
+
+then point UMLS_INDEX_DIR at the directory.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import zlib
+from array import array
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+UMLS_INDEX_DIR = os.getenv("UMLS_INDEX_DIR")
+# Names are matched on character n-grams of this length, hashed into HASH_BUCKETS buckets.
+NGRAM = 3
+HASH_BUCKETS = 1 << 21
+# n-grams found in more names than this carry little signal and are skipped at lookup,
+# which keeps every lookup to a bounded number of postings.
+MAX_POSTINGS = 50000
+# Same default as scispaCy's linker.
+DEFAULT_THRESHOLD = 0.7
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(name: str) -> str:
+    return _WHITESPACE.sub(" ", name.lower()).strip()
+
+
+def _grams(name: str) -> np.ndarray:
+    """Sorted unique hashed n-grams of a normalized name, padded so word edges count."""
+    padded = f" {name} "
+    hashes = {zlib.crc32(padded[i:i + NGRAM].encode("utf-8")) % HASH_BUCKETS
+              for i in range(max(1, len(padded) - NGRAM + 1))}
+    return np.array(sorted(hashes), dtype=np.int64)
+
+
+def iter_scispacy_concepts(kb_jsonl: Optional[str] = None) -> Iterator[Tuple[str, str, List[str]]]:
+    """
+    (cui, canonical name, aliases) for every concept, from a knowledge base jsonl
+    file or, by default, from scispaCy's UMLS knowledge base.
+    """
+    if kb_jsonl:
+        with open(kb_jsonl, "r", encoding="utf-8") as f:
+            for line in f:
+                concept = json.loads(line)
+                yield concept["concept_id"], concept["canonical_name"], concept.get("aliases", [])
+        return
+    from scispacy.linking_utils import UmlsKnowledgeBase  # type: ignore
+
+    for cui, entity in UmlsKnowledgeBase().cui_to_entity.items():
+        yield cui, entity.canonical_name, list(entity.aliases)
+
+
+def build_index(concepts: Iterable[Tuple[str, str, List[str]]], output_dir: str) -> int:
+    """
+    Write the index files for the given concepts to output_dir.
+
+    Returns:
+        int: Number of concepts indexed.
+    """
+    cuis = []
+    cui_name_offsets = array("q", [0])
+    name_blob = bytearray()
+    name_offsets = array("q", [0])
+    name_cui = array("i")
+    name_gram_counts = array("i")
+    posting_grams = array("q")
+    posting_names = array("i")
+
+    for cui, canonical, aliases in concepts:
+        seen = set()
+        for name in [canonical, *aliases]:
+            normalized = _normalize(name)
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            name_id = len(name_cui)
+            grams = _grams(normalized)
+            name_blob += name.strip().encode("utf-8")
+            name_offsets.append(len(name_blob))
+            name_cui.append(len(cuis))
+            name_gram_counts.append(len(grams))
+            posting_grams.extend(grams.tolist())
+            posting_names.extend([name_id] * len(grams))
+        if seen:
+            cuis.append(cui)
+            cui_name_offsets.append(len(name_cui))
+
+    # Postings grouped by n-gram bucket (CSR): names of bucket b are postings[offsets[b]:offsets[b + 1]]
+    grams = np.frombuffer(posting_grams, dtype=np.int64)
+    order = np.argsort(grams, kind="stable")
+    gram_offsets = np.zeros(HASH_BUCKETS + 1, dtype=np.int64)
+    np.cumsum(np.bincount(grams, minlength=HASH_BUCKETS), out=gram_offsets[1:])
+
+    os.makedirs(output_dir, exist_ok=True)
+    cui_array = np.array(cuis, dtype="S")
+    np.save(os.path.join(output_dir, "cuis.npy"), cui_array)
+    np.save(os.path.join(output_dir, "cui_order.npy"), np.argsort(cui_array, kind="stable"))
+    np.save(os.path.join(output_dir, "cui_name_offsets.npy"), np.frombuffer(cui_name_offsets, dtype=np.int64))
+    np.save(os.path.join(output_dir, "name_offsets.npy"), np.frombuffer(name_offsets, dtype=np.int64))
+    np.save(os.path.join(output_dir, "name_cui.npy"), np.frombuffer(name_cui, dtype=np.int32))
+    np.save(os.path.join(output_dir, "name_gram_counts.npy"), np.frombuffer(name_gram_counts, dtype=np.int32))
+    np.save(os.path.join(output_dir, "gram_offsets.npy"), gram_offsets)
+    np.save(os.path.join(output_dir, "postings.npy"), np.frombuffer(posting_names, dtype=np.int32)[order])
+    with open(os.path.join(output_dir, "names.bin"), "wb") as f:
+        f.write(name_blob)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"ngram": NGRAM, "hash_buckets": HASH_BUCKETS, "concepts": len(cuis), "names": len(name_cui)}, f)
+    return len(cuis)
+
+
+class UmlsIndex:
+    """Read-only view of an index built by build_index; every array is memory-mapped."""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["ngram"] != NGRAM or meta["hash_buckets"] != HASH_BUCKETS:
+            raise ValueError(f"UMLS index in {directory} was built with different n-gram settings; rebuild it")
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.cuis = load("cuis")
+        self.cui_order = load("cui_order")
+        self.cui_name_offsets = load("cui_name_offsets")
+        self.name_offsets = load("name_offsets")
+        self.name_cui = load("name_cui")
+        self.name_gram_counts = load("name_gram_counts")
+        self.gram_offsets = load("gram_offsets")
+        self.postings = load("postings")
+        self.names_blob = np.memmap(os.path.join(directory, "names.bin"), dtype=np.uint8, mode="r")
+
+    def _name(self, name_id: int) -> str:
+        return bytes(self.names_blob[self.name_offsets[name_id]:self.name_offsets[name_id + 1]]).decode("utf-8")
+
+    def names(self, cui: str) -> List[str]:
+        """Canonical name first, then aliases, of a CUI; empty if it is not indexed."""
+        position = int(np.searchsorted(self.cuis, cui.encode(), sorter=self.cui_order))
+        if position >= len(self.cuis) or self.cuis[self.cui_order[position]] != cui.encode():
+            return []
+        index = int(self.cui_order[position])
+        return [self._name(i) for i in range(self.cui_name_offsets[index], self.cui_name_offsets[index + 1])]
+
+    def link(self, mention: str, k: int = 1, threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[str, float]]:
+        """
+        Concepts whose names best match the mention on character n-grams.
+
+        Returns:
+            list: Up to k (cui, score) pairs with score >= threshold, best first.
+            The score is the cosine similarity of the n-gram sets (0-1).
+        """
+        grams = _grams(_normalize(mention))
+        starts, ends = self.gram_offsets[grams], self.gram_offsets[grams + 1]
+        informative = (ends - starts) <= MAX_POSTINGS
+        if not informative.any():
+            return []
+        candidates = np.concatenate([self.postings[start:end]
+                                     for start, end in zip(starts[informative], ends[informative])])
+        if len(candidates) == 0:
+            return []
+        name_ids, overlap = np.unique(candidates, return_counts=True)
+        scores = overlap / np.sqrt(len(grams) * self.name_gram_counts[name_ids])
+
+        results, seen = [], set()
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] < threshold or len(results) == k:
+                break
+            cui_index = int(self.name_cui[name_ids[i]])
+            if cui_index not in seen:
+                seen.add(cui_index)
+                results.append((self.cuis[cui_index].decode(), float(scores[i])))
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_umls_index() -> Optional[UmlsIndex]:
+    """The index in UMLS_INDEX_DIR, opened once per process; None if UMLS_INDEX_DIR is not set."""
+    global _index
+    if _index is None and UMLS_INDEX_DIR:
+        with _index_lock:
+            if _index is None:
+                _index = UmlsIndex(UMLS_INDEX_DIR)
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build = subcommands.add_parser("build", help="build an index directory")
+    build.add_argument("output_dir")
+    build.add_argument("--kb-jsonl", help="knowledge base jsonl to read instead of scispaCy's UMLS one")
+    lookup = subcommands.add_parser("link", help="link a mention with an existing index")
+    lookup.add_argument("index_dir")
+    lookup.add_argument("mention")
+    lookup.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_index(iter_scispacy_concepts(args.kb_jsonl), args.output_dir)
+        print(f"Indexed {count} concepts in {args.output_dir}")
+    else:
+        index = UmlsIndex(args.index_dir)
+        for cui, score in index.link(args.mention, k=args.k, threshold=0.0):
+            names = index.names(cui)
+            print(f"{cui}\t{score:.3f}\t{names[0] if names else ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import os
 import asyncio
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, HTTPException, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,6 +9,7 @@ from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from groq import Groq
+from src.uploads import spool_upload
 
 load_dotenv()
 
@@ -35,6 +37,22 @@ def get_pdf_parser():
     from src.pdf_parser import process_pdf_file
     return process_pdf_file
 
+def preload_models(warmup: bool = True):
+    """Load (and optionally warm up) the NER model before the first request."""
+    from src.hugging_face_ner import preload
+    preload(warmup=warmup)
+
+def _warm_models():
+    try:
+        preload_models()
+    except Exception as e:
+        print(f"Warning: model warm-up failed: {e}")
+
+# Set by gunicorn.conf.py: the master loads the weights before forking, so every
+# worker shares one copy of them copy-on-write instead of loading its own.
+if os.getenv("PRELOAD_MODELS") == "1":
+    preload_models(warmup=False)
+
 # Initialize the FastAPI app
 app = FastAPI()
 
@@ -50,6 +68,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def warm_models():
+    """Warm the models in the background so the server accepts requests right away; see /ready."""
+    threading.Thread(target=_warm_models, name="model-warmup", daemon=True).start()
+
 # Input/Output Models
 class InputText(BaseModel):
     text: str
@@ -168,12 +191,12 @@ async def diagnose_pdf(file: UploadFile = File(...)):
                 "error": "Only PDF files are supported"
             }
         
-        # Read file content
-        file_content = await file.read()
-        
-        # Lazy load PDF parser and extract text (synchronous call)
-        process_pdf_file = get_pdf_parser()
-        pdf_result = process_pdf_file(file_content)
+        # Spool the upload to its own temp file and extract text from it off the event loop
+        async with spool_upload(file) as spooled:
+            # Lazy load PDF parser
+            process_pdf_file = get_pdf_parser()
+            loop = asyncio.get_event_loop()
+            pdf_result = await loop.run_in_executor(executor, process_pdf_file, spooled.path, spooled.sha256)
         
         if pdf_result["status"] == "error":
             return {
@@ -212,14 +235,35 @@ async def diagnose_pdf(file: UploadFile = File(...)):
         
         return {
             "status": "success",
-            "report": report
+            "report": report,
+            # pages left out of the report because their extraction took too long
+            "timed_out_pages": pdf_result.get("timed_out_pages", [])
         }
+    except HTTPException:
+        # e.g. 413 for uploads over the size limit
+        raise
     except Exception as e:
         return {
             "status": "error",
             "error": str(e)
         }
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the models are loaded and warm in this worker, 503 until then.
+    """
+    from src.hugging_face_ner import is_ready
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="Models are loading")
+    return {"status": "ready"}
+
+@app.get("/ner-cache/stats")
+async def get_ner_cache_stats():
+    """Hit rate and size of the sentence-level NER cache in this worker."""
+    from src.hugging_face_ner import ner_cache_stats
+    return ner_cache_stats()
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """
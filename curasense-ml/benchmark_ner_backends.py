@@ -0,0 +1,139 @@
+"""
+Compare the PyTorch and int8 ONNX backends of the Medical-NER model.
+
+    python benchmark_ner_backends.py --export      # writes models/medical-ner-onnx (once)
+    python benchmark_ner_backends.py [--fixtures texts.json] [--runs 5] [--min-f1 0.95]
+
+Each backend runs in its own process, so load time and memory are measured
+cleanly. Entities found by the ONNX backend are scored against the PyTorch
+ones on the fixture set; the script exits non-zero if their F1 is below --min-f1.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+FIXTURE_TEXTS = [
+    "A 54-year-old male presented with chest pain radiating to the left arm for 2 hours, "
+    "associated with sweating. ECG showed ST elevation in leads II, III and aVF.",
+    "Patient is a known case of type 2 diabetes mellitus and hypertension on metformin 500 mg "
+    "twice daily and amlodipine 5 mg once daily. HbA1c 8.9%.",
+    "Complains of fever with chills for 5 days, headache and body ache. Platelet count 85,000/cumm, "
+    "NS1 antigen positive. Suspected dengue fever.",
+    "CT scan of the brain showed an acute infarct in the left middle cerebral artery territory. "
+    "Started on aspirin 150 mg and atorvastatin 40 mg.",
+    "Hemoglobin 9.2 g/dL, MCV 68 fL, serum ferritin 8 ng/mL suggestive of iron deficiency anemia. "
+    "Advised oral ferrous sulfate 325 mg daily.",
+    # Long enough to be split into several windows
+    " ".join([
+        "The patient reports progressive shortness of breath on exertion, orthopnea and bilateral pedal edema.",
+        "Echocardiography revealed an ejection fraction of 30% with global hypokinesia.",
+        "Serum creatinine 1.8 mg/dL and NT-proBNP 4500 pg/mL.",
+        "Managed with intravenous furosemide 40 mg twice daily and started on sacubitril-valsartan.",
+    ] * 12),
+]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss / (1024 * 1024)
+        except ImportError:
+            return None
+
+
+def _run_backend(backend, texts, runs):
+    """Load one backend in a fresh process and time it on the fixture texts."""
+    os.environ["NER_BACKEND"] = backend
+    started = time.perf_counter()
+    from src import hugging_face_ner as ner
+    ner.load_ner_model()
+    load_seconds = time.perf_counter() - started
+    rss_after_load = _peak_rss_mb()
+
+    # First pass doubles as warm-up
+    entities = ner.extract_entities_batch(texts)
+    latencies = []
+    for _ in range(runs):
+        for text in texts:
+            started = time.perf_counter()
+            ner.extract_entities_batch([text])
+            latencies.append(time.perf_counter() - started)
+
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "rss_after_load_mb": rss_after_load,
+        "peak_rss_mb": _peak_rss_mb(),
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))] * 1000,
+        "entities": [[(e["label"], e["start"], e["end"]) for e in text_entities] for text_entities in entities],
+    }
+
+
+def _in_subprocess(backend, texts, runs):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_backend, (backend, texts, runs))
+
+
+def entity_f1(reference, candidate):
+    """Micro-averaged precision/recall/F1 of candidate entity spans against reference ones."""
+    true_positives = false_positives = false_negatives = 0
+    for expected, found in zip(reference, candidate):
+        expected, found = set(map(tuple, expected)), set(map(tuple, found))
+        true_positives += len(expected & found)
+        false_positives += len(found - expected)
+        false_negatives += len(expected - found)
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 1.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--export", action="store_true", help="export and quantize the ONNX model, then exit")
+    parser.add_argument("--fixtures", help="JSON file with a list of texts to use instead of the built-in set")
+    parser.add_argument("--runs", type=int, default=5, help="timed passes over the fixture set per backend")
+    parser.add_argument("--min-f1", type=float, default=0.95, help="minimum entity F1 of ONNX against PyTorch")
+    args = parser.parse_args()
+
+    if args.export:
+        os.environ["NER_BACKEND"] = "pytorch"
+        from src.hugging_face_ner import export_onnx_model
+        print(f"Quantized model written to {export_onnx_model()}")
+        return 0
+
+    texts = FIXTURE_TEXTS
+    if args.fixtures:
+        with open(args.fixtures, "r", encoding="utf-8") as f:
+            texts = json.load(f)
+
+    results = {backend: _in_subprocess(backend, texts, args.runs) for backend in ("pytorch", "onnx")}
+
+    print(f"{'backend':<10}{'load s':>9}{'RSS loaded MB':>15}{'peak RSS MB':>13}{'mean ms':>10}{'p95 ms':>10}")
+    for result in results.values():
+        print(f"{result['backend']:<10}{result['load_seconds']:>9.2f}"
+              f"{result['rss_after_load_mb'] or float('nan'):>15.0f}{result['peak_rss_mb'] or float('nan'):>13.0f}"
+              f"{result['mean_ms']:>10.1f}{result['p95_ms']:>10.1f}")
+
+    precision, recall, f1 = entity_f1(results["pytorch"]["entities"], results["onnx"]["entities"])
+    print(f"\nONNX vs PyTorch entities on {len(texts)} texts: "
+          f"precision {precision:.3f}, recall {recall:.3f}, F1 {f1:.3f}")
+    if f1 < args.min_f1:
+        print(f"Parity check failed: F1 {f1:.3f} < {args.min_f1}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ from crewai.flow.flow import listen, start, and_
 from tavily import TavilyClient
 
 from src.hugging_face_ner import process_ner_output, generate_clean_ner_report
+from src.section_segmenter import route_note
 from src.crew.agents_and_taks import ner_validation_crew, prelim_diag_crew, report_writing_crew
 
 
@@ -68,10 +69,18 @@ class CdssPipeline(Flow):
     @start()
     def initial_hugging_face_ner_report(self):
 
-        tagged_tokens, unique_tags = process_ner_output(self.sample_text)
+        # Vitals and labs are parsed by regex; NER only runs on the history-like sections
+        routed = route_note(self.sample_text)
+        self.state["regex_vitals"] = routed.vitals
+        self.state["regex_labs"] = routed.labs
+
+        tagged_tokens, unique_tags = process_ner_output(routed.ner_text) if routed.ner_text else ([], [])
         report = generate_clean_ner_report(tagged_tokens, unique_tags)
+        report["vital_signs"] = routed.vitals
+        report["laboratory_values"] = routed.labs
 
-        return {"report": report, "sample_text": self.sample_text}
+        # The validation crew only needs the text the regexes did not account for
+        return {"report": report, "sample_text": routed.residual or self.sample_text}
 
 
     # --------------------------------------------------------
@@ -88,6 +97,10 @@ class CdssPipeline(Flow):
         )
 
         parsed = normalize(result)
+        if isinstance(parsed, dict):
+            # Regex-parsed values fill in what the crew did not report; the crew's own values stay
+            parsed["vital_signs"] = {**self.state["regex_vitals"], **(parsed.get("vital_signs") or {})}
+            parsed["laboratory_values"] = {**self.state["regex_labs"], **(parsed.get("laboratory_values") or {})}
 
         self.state["post_ner_report"] = parsed
         return parsed
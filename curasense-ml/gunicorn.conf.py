@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for serving app.py with several uvicorn workers:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master with PRELOAD_MODELS=1, which loads the
+NER weights there; workers are forked from it and share those pages
+copy-on-write instead of each loading its own copy. Each worker then warms the
+model on startup, and GET /ready returns 200 once it has.
+"""
+
+import gc
+import os
+
+os.environ.setdefault("PRELOAD_MODELS", "1")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Pipelines run for minutes; don't let gunicorn kill a busy worker.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "600"))
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach: a collection in
+    # a worker would otherwise write to the shared objects and copy their pages.
+    gc.freeze()
@@ -1,110 +1,413 @@
-from transformers import AutoTokenizer, AutoModelForTokenClassification
+from transformers import AutoConfig, AutoTokenizer, AutoModelForTokenClassification
 import torch
+import numpy as np
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
 
+from src.ner_cache import SentenceCache, cached_entities
 
-tokenizer = AutoTokenizer.from_pretrained("Clinical-AI-Apollo/Medical-NER")
-model = AutoModelForTokenClassification.from_pretrained("Clinical-AI-Apollo/Medical-NER")
 
+MODEL_NAME = "Clinical-AI-Apollo/Medical-NER"
+# "pytorch" (full precision) or "onnx" (int8-quantized export made by export_onnx_model)
+NER_BACKEND = os.getenv("NER_BACKEND", "pytorch").lower()
+ONNX_MODEL_DIR = os.getenv("NER_ONNX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                        "models", "medical-ner-onnx"))
+ONNX_MODEL_FILE = "model.int8.onnx"
 
-def process_ner_output(text: str, max_length: int = 512) -> list:
+# Sliding-window settings: texts longer than WINDOW_TOKENS are split into windows
+# overlapping by STRIDE_TOKENS, so entities near a window edge are seen in full.
+WINDOW_TOKENS = 512
+STRIDE_TOKENS = 128
+# Windows run through the model per forward pass, padded only to the longest among them.
+MAX_WINDOWS_PER_BATCH = 16
+
+# Micro-batching: concurrent requests arriving within BATCH_WAIT_MS of each other
+# share forward passes, up to MAX_BATCH_TEXTS texts per batch.
+BATCH_WAIT_MS = float(os.getenv("NER_BATCH_WAIT_MS", "5"))
+MAX_BATCH_TEXTS = int(os.getenv("NER_MAX_BATCH_TEXTS", "32"))
+# Intra-op threads for the forward pass; defaults to one per physical core.
+NER_THREADS = int(os.getenv("NER_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+torch.set_num_threads(NER_THREADS)
+
+
+class _OnnxTokenClassifier:
     """
-    Process text using a pretrained NER model and tokenizer, returning meaningful predictions.
-    
+    Stand-in for the PyTorch model that runs the int8 ONNX export with onnxruntime.
+    Only the model config is loaded from the hub, not the full-precision weights.
+    """
+
+    def __init__(self, model_dir: str):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = NER_THREADS
+        self.session = ort.InferenceSession(os.path.join(model_dir, ONNX_MODEL_FILE), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.config = AutoConfig.from_pretrained(MODEL_NAME)
+
+    def logits(self, batch: Dict[str, np.ndarray]) -> np.ndarray:
+        inputs = {name: value.astype(np.int64) for name, value in batch.items() if name in self.input_names}
+        return self.session.run(["logits"], inputs)[0]
+
+
+def load_model(backend: str = NER_BACKEND):
+    """Load the NER model for the given backend ("pytorch" or "onnx")."""
+    if backend == "onnx":
+        return _OnnxTokenClassifier(ONNX_MODEL_DIR)
+    torch_model = AutoModelForTokenClassification.from_pretrained(MODEL_NAME)
+    torch_model.eval()
+    return torch_model
+
+
+# Loaded on first use or by preload(), not at import: importing this module (e.g. via flow.py)
+# costs nothing, and a server that preloads before forking its workers shares one copy.
+tokenizer = None
+model = None
+_load_lock = threading.Lock()
+_ready = threading.Event()
+
+# Label id -> entity type index (-1 for "O") and whether it is a B- tag,
+# so BIO decoding is array lookups rather than string handling per token.
+_ENTITY_TYPES: List[str] = []
+_TYPE_OF_LABEL = None
+_IS_BEGIN_LABEL = None
+
+
+def load_ner_model():
+    """
+    Load the tokenizer and model once per process (thread-safe).
+
+    Returns:
+        tuple: (tokenizer, model)
+    """
+    global tokenizer, model, _ENTITY_TYPES, _TYPE_OF_LABEL, _IS_BEGIN_LABEL
+    if model is None:
+        with _load_lock:
+            if model is None:
+                loaded_tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+                loaded_model = load_model(NER_BACKEND)
+                id2label = loaded_model.config.id2label
+                _ENTITY_TYPES = sorted({label[2:] for label in id2label.values() if label[:2] in ("B-", "I-")})
+                _TYPE_OF_LABEL = np.array([
+                    _ENTITY_TYPES.index(id2label[i][2:]) if id2label[i][:2] in ("B-", "I-") else -1
+                    for i in range(len(id2label))
+                ])
+                _IS_BEGIN_LABEL = np.array([id2label[i].startswith("B-") for i in range(len(id2label))])
+                tokenizer = loaded_tokenizer
+                model = loaded_model
+    return tokenizer, model
+
+
+def preload(warmup: bool = True):
+    """
+    Load the model ahead of the first request and mark the module ready.
+
     Parameters:
-        text (str): Input text to analyze.
-        model: Pretrained Hugging Face model for NER.
-        tokenizer: Corresponding tokenizer for the model.
-        max_length (int): Maximum sequence length for the tokenizer.
+        warmup (bool): Also run one short forward pass. Leave this off in a
+            process that forks workers afterwards: thread pools started by a
+            forward pass do not survive fork.
+    """
+    if not warmup and NER_BACKEND == "onnx":
+        # An onnxruntime session starts its thread pool when created, so it is built after the fork.
+        return
+    load_ner_model()
+    if warmup:
+        extract_entities_batch(["Patient has fever and cough."])
+        _ready.set()
+
+
+def is_ready() -> bool:
+    """True once preload() has loaded and warmed up the model in this process."""
+    return _ready.is_set()
+
+
+def _logits(batch: Dict[str, np.ndarray]) -> np.ndarray:
+    """Run one padded batch through whichever backend is loaded."""
+    if isinstance(model, _OnnxTokenClassifier):
+        return model.logits(batch)
+    with torch.inference_mode():
+        return model(**{name: torch.from_numpy(value) for name, value in batch.items()}).logits.numpy()
+
+
+def export_onnx_model(output_dir: str = ONNX_MODEL_DIR) -> str:
+    """
+    Export the PyTorch model to ONNX and quantize its weights to int8
+    (dynamic quantization), for serving with NER_BACKEND=onnx.
 
     Returns:
-        list: A list of tuples in the format (token, label), excluding 'O' labels.
+        str: Path of the quantized model.
     """
-    # Tokenize the text
-    encoding = tokenizer(
-        text,
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    int8_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    load_ner_model()
+    torch_model = model if not isinstance(model, _OnnxTokenClassifier) else load_model("pytorch")
+
+    sample = tokenizer(["Patient has type 2 diabetes mellitus."], return_tensors="pt")
+    torch.onnx.export(
+        torch_model,
+        (sample["input_ids"], sample["attention_mask"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch", 1: "sequence"},
+        },
+        opset_version=14,
+    )
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def _encode_windows(texts: List[str], max_length: int, stride: int):
+    """Tokenize texts into overlapping windows, unpadded, with character offsets."""
+    return tokenizer(
+        texts,
         truncation=True,
-        padding="max_length",
         max_length=max_length,
-        return_tensors="pt"
+        stride=stride,
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True,
     )
-    
-    # Get logits from the model
-    output = model(**encoding)
-    logits = output.logits
-    
-    # Predict label indices
-    predicted_label_indices = torch.argmax(logits, dim=2)
-    
-    # Map label indices to label names
-    label_map = model.config.id2label
-    predicted_labels = [label_map[idx.item()] for idx in predicted_label_indices[0]]
-    
-    # Decode tokens
-    tokens = tokenizer.convert_ids_to_tokens(encoding["input_ids"][0])
-    
-    # Combine tokens and labels
-    result = list(zip(tokens, predicted_labels))
-    
-    # Filter out non-entity tokens ('O' labels)
-    filtered_result = [
-        (token.lstrip("▁"), label)  # Remove leading underscores from tokens
-        for token, label in result if label != "O"
-    ]
+
+
+def _predict_windows(encoding) -> List[np.ndarray]:
+    """
+    Predicted label ids for every window. Windows are grouped by length so each
+    forward pass pads as little as possible.
+    """
+    order = sorted(range(len(encoding["input_ids"])), key=lambda i: len(encoding["input_ids"][i]))
+    predictions: List[Optional[np.ndarray]] = [None] * len(order)
+    for start in range(0, len(order), MAX_WINDOWS_PER_BATCH):
+        chunk = order[start:start + MAX_WINDOWS_PER_BATCH]
+        batch = tokenizer.pad(
+            [{"input_ids": encoding["input_ids"][i], "attention_mask": encoding["attention_mask"][i]} for i in chunk],
+            padding="longest",
+            return_tensors="np",
+        )
+        label_ids = _logits(dict(batch)).argmax(axis=2)
+        for row, i in enumerate(chunk):
+            predictions[i] = label_ids[row, :len(encoding["input_ids"][i])]
+    return predictions
+
+
+def _merge_windows(encoding, predictions, window_indices: List[int], stride: int):
+    """
+    Merge the windows of one text into a single label per token. Consecutive
+    windows share `stride` tokens; each window keeps its half of the overlap,
+    so every token is labelled by the window that gives it the most context.
+
+    Returns:
+        tuple: numpy arrays (starts, ends, word_ids, label_ids) in text order.
+    """
+    starts, ends, words, labels = [], [], [], []
+    last = len(window_indices) - 1
+    for position, i in enumerate(window_indices):
+        offsets = np.asarray(encoding["offset_mapping"][i]).reshape(-1, 2)
+        content = np.flatnonzero(offsets[:, 1] > offsets[:, 0])
+        trim_start = stride - stride // 2 if position > 0 else 0
+        trim_end = stride // 2 if position < last else 0
+        keep = content[trim_start:len(content) - trim_end]
+        word_ids = np.array([-1 if w is None else w for w in encoding.word_ids(i)])
+        starts.append(offsets[keep, 0])
+        ends.append(offsets[keep, 1])
+        words.append(word_ids[keep])
+        labels.append(predictions[i][keep])
+    if not starts:
+        empty = np.array([], dtype=int)
+        return empty, empty, empty, empty
+    return np.concatenate(starts), np.concatenate(ends), np.concatenate(words), np.concatenate(labels)
+
+
+def _decode_entities(text: str, starts, ends, word_ids, label_ids) -> List[Dict]:
+    """
+    Turn BIO-tagged tokens into entity spans over the original text. Entity
+    boundaries are found with array operations over all tokens at once: a token
+    continues the previous entity on an I- tag of the same type, or on a B- tag
+    within the same word.
+    """
+    if len(label_ids) == 0:
+        return []
+    types = _TYPE_OF_LABEL[label_ids]
+    begins = _IS_BEGIN_LABEL[label_ids]
+    previous_types = np.concatenate(([-1], types[:-1]))
+    previous_words = np.concatenate(([-2], word_ids[:-1]))
+
+    continues = (types >= 0) & (types == previous_types) & (~begins | (word_ids == previous_words))
+    opens = (types >= 0) & ~continues
+    closes = (types >= 0) & ~np.concatenate((continues[1:], [False]))
+
+    entities = []
+    for first, last in zip(np.flatnonzero(opens), np.flatnonzero(closes)):
+        raw = text[starts[first]:ends[last]]
+        stripped = raw.strip()
+        if stripped:
+            start = int(starts[first]) + (len(raw) - len(raw.lstrip()))
+            entities.append({"label": _ENTITY_TYPES[types[first]], "start": start,
+                             "end": start + len(stripped), "text": stripped})
+    return entities
+
+
+def extract_entities_batch(texts: List[str], max_length: int = WINDOW_TOKENS,
+                           stride: int = STRIDE_TOKENS) -> List[List[Dict]]:
+    """
+    Run the NER model over several texts at once. Each text is split into
+    overlapping windows, all windows are run together, and entities are rebuilt
+    from the tokenizer's offset mapping as exact character spans.
+
+    Parameters:
+        texts (list): Input texts.
+        max_length (int): Tokens per window.
+        stride (int): Tokens shared by consecutive windows of a text.
+
+    Returns:
+        list: For each text, a list of {"label", "start", "end", "text"} entities.
+    """
+    if not texts:
+        return []
+    load_ner_model()
+    encoding = _encode_windows(texts, max_length, stride)
+    predictions = _predict_windows(encoding)
+
+    windows_per_text: List[List[int]] = [[] for _ in texts]
+    for i, text_index in enumerate(encoding["overflow_to_sample_mapping"]):
+        windows_per_text[text_index].append(i)
+
+    return [_decode_entities(text, *_merge_windows(encoding, predictions, windows, stride))
+            for text, windows in zip(texts, windows_per_text)]
+
+
+class _NerBatcher:
+    """
+    In-process micro-batching queue. Callers on any thread submit a text and
+    wait on a Future; a single worker thread collects whatever arrives within
+    BATCH_WAIT_MS and runs it through extract_entities_batch together, so
+    concurrent pipelines share forward passes instead of queueing for the model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def _ensure_worker(self):
+        # Started on first use, and again in a forked child, where the parent's thread does not exist.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name="ner-batcher", daemon=True).start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, requests: "queue.Queue"):
+        while True:
+            batch = [requests.get()]
+            deadline = time.monotonic() + BATCH_WAIT_MS / 1000.0
+            while len(batch) < MAX_BATCH_TEXTS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Requests with different window settings are batched separately
+            groups: Dict[Tuple[int, int], list] = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for (max_length, stride), items in groups.items():
+                try:
+                    results = extract_entities_batch([text for text, _, _ in items], max_length, stride)
+                except Exception as e:
+                    for _, _, future in items:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future), entities in zip(items, results):
+                    future.set_result(entities)
+
+    def submit(self, text: str, max_length: int = WINDOW_TOKENS, stride: int = STRIDE_TOKENS) -> Future:
+        future = Future()
+        self._ensure_worker().put((text, (max_length, stride), future))
+        return future
+
+
+_batcher = _NerBatcher()
+# Results per normalized sentence, so resubmitted text only runs the sentences that changed.
+_sentence_cache = SentenceCache()
+
+
+def _run_sentences(sentences: List[str], max_length: int, stride: int) -> List[List[Dict]]:
+    # All sentences go to the batcher at once, so they share forward passes.
+    futures = [_batcher.submit(sentence, max_length=max_length, stride=stride) for sentence in sentences]
+    return [future.result() for future in futures]
+
+
+def extract_entities(text: str, max_length: int = WINDOW_TOKENS, stride: int = STRIDE_TOKENS) -> List[Dict]:
+    """
+    Entities of a single text; see extract_entities_batch. The text is run
+    sentence by sentence through a per-process cache, and sentences not seen
+    before are queued for the shared micro-batcher, so concurrent callers are
+    batched together.
+    """
+    return cached_entities(text, _sentence_cache,
+                           lambda sentences: _run_sentences(sentences, max_length, stride),
+                           NER_BACKEND, max_length, stride)
+
+
+def ner_cache_stats() -> Dict:
+    """Hit/miss counts and size of the sentence cache in this process."""
+    return _sentence_cache.stats()
+
+
+def process_ner_output(text: str, max_length: int = WINDOW_TOKENS, stride: int = STRIDE_TOKENS) -> tuple:
+    """
+    Process text using a pretrained NER model and tokenizer, returning meaningful predictions.
+    Text is run sentence by sentence, reusing cached results for sentences seen before;
+    long sentences are processed in overlapping windows, so no part of the text is dropped.
+
+    Parameters:
+        text (str): Input text to analyze.
+        max_length (int): Tokens per window.
+        stride (int): Tokens shared by consecutive windows.
+
+    Returns:
+        tuple: (entities, unique_tags) where entities are {"label", "start", "end", "text"}
+        spans over the input text and unique_tags lists the entity labels found, in order.
+    """
+    entities = extract_entities(text, max_length=max_length, stride=stride)
 
     unique_tags = []
+    for entity in entities:
+        if entity["label"] not in unique_tags:
+            unique_tags.append(entity["label"])
 
-    for entry in predicted_labels:
-        if entry[0]=="B" and entry not in unique_tags:
-            unique_tags.append(entry[2:])
-    
-    return filtered_result,unique_tags
+    return entities, unique_tags
 
-def generate_clean_ner_report(tagged_tokens, unique_tags):
+def generate_clean_ner_report(entities, unique_tags):
     """
-    Generate a clean NER report based on tagged tokens and unique tags.
-    
+    Generate a clean NER report based on extracted entities and unique tags.
+
     Parameters:
-        tagged_tokens (list): List of tuples with tokens and labels.
+        entities (list): Entity spans from process_ner_output.
         unique_tags (list): List of unique entity tags.
 
     Returns:
         dict: A report in the format {tag: [relevant details]}.
     """
     # Initialize report with all unique tags except unwanted ones
-    unwanted_tokens = {'[CLS]', '[SEP]'}
     report = {tag: [] for tag in unique_tags if tag != "SEVERITY"}
 
-    current_entity = []
-    current_label = None
-
-    for token, tag in tagged_tokens:
-        # Remove underscores and filter unwanted tokens
-        token = token.replace('▁', '')
-        if token in unwanted_tokens:
-            continue
-
-        if tag.startswith("B-"):
-            # Save the previous entity if it exists
-            if current_entity:
-                report[current_label].append(" ".join(current_entity))
-            # Start a new entity
-            current_entity = [token]
-            current_label = tag[2:]  # Remove the "B-" prefix
-        elif tag.startswith("I-") and current_label == tag[2:]:
-            # Continue the current entity if the label matches
-            current_entity.append(token)
-        else:
-            # Save the previous entity and reset if the tag doesn't match
-            if current_entity:
-                report[current_label].append(" ".join(current_entity))
-            current_entity = []
-            current_label = None
-
-    # Add the last entity if any
-    if current_entity:
-        report[current_label].append(" ".join(current_entity))
+    for entity in entities:
+        if entity["label"] in report:
+            report[entity["label"]].append(entity["text"])
 
     return report
-
-
-
@@ -0,0 +1,206 @@
+"""
+Content-addressed parse cache for PDF pages.
+
+Extracted pages are stored once, keyed by a hash of what the page draws (its
+content stream, fonts, images and size), so a re-upload of the same file, or of
+a file with only a few pages changed, only parses the pages not seen before.
+Each file's list of page hashes is also kept under the sha256 of its bytes, so
+an identical re-upload does not even need its pages hashed. Entries hold patient
+text, so they expire after PARSE_CACHE_TTL_SECONDS and the directory is capped
+at PARSE_CACHE_MAX_MB.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+import PyPDF2
+from PyPDF2.generic import IndirectObject
+
+# Bump when extraction changes, so pages cached by an older parser are not reused.
+PARSER_VERSION = "pdfplumber-routed-1"
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", ".parse_cache")
+# Entries hold extracted patient text: they expire like the vector DBs (15 minutes),
+# and the oldest are removed first once the directory outgrows the cap.
+PARSE_CACHE_TTL_SECONDS = int(os.getenv("PARSE_CACHE_TTL_SECONDS", str(15 * 60)))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Writes prune the directory at most this often.
+PRUNE_INTERVAL_SECONDS = 60
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def file_digest(source) -> str:
+    """sha256 of an upload, given its bytes or a path (read in chunks)."""
+    if isinstance(source, (str, os.PathLike)):
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    return hashlib.sha256(source).hexdigest()
+
+
+def _hash_object(obj, digest, seen: Dict) -> None:
+    """
+    Feed a PDF object and everything it references into digest: dictionary keys
+    and values, arrays, and the raw (still encoded) bytes of streams such as font
+    programs, ToUnicode maps and images. Object numbers are left out; an object
+    reached a second time is recorded by the order it was first reached in.
+    """
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref in seen:
+            digest.update(f"@{seen[ref]}".encode())
+            return
+        seen[ref] = len(seen)
+        obj = obj.get_object()
+    if isinstance(obj, dict):
+        digest.update(b"<<")
+        for key in sorted(obj):
+            # /Parent leads back up the page tree, out of this page
+            if key == "/Parent":
+                continue
+            digest.update(str(key).encode())
+            _hash_object(dict.__getitem__(obj, key), digest, seen)
+        digest.update(b">>")
+        data = getattr(obj, "_data", None)
+        if data:
+            digest.update(data if isinstance(data, bytes) else str(data).encode())
+    elif isinstance(obj, list):
+        digest.update(b"[")
+        for item in obj:
+            _hash_object(item, digest, seen)
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode())
+
+
+def page_hash(page) -> str:
+    """
+    Hash of what a PyPDF2 page draws: its content stream, its size and rotation,
+    and its whole resource tree (fonts with their encodings, ToUnicode maps and
+    embedded programs, images, form XObjects). Object numbers are left out, so
+    the same page in a regenerated file hashes the same.
+    """
+    digest = hashlib.sha256(PARSER_VERSION.encode())
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    digest.update(repr([float(x) for x in page.mediabox]).encode())
+    digest.update(repr(page.get("/Rotate", 0)).encode())
+    resources = dict.get(page, "/Resources")
+    if resources is not None:
+        _hash_object(resources, digest, {})
+    return digest.hexdigest()
+
+
+def _path(kind: str, key: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, kind, key[:2], f"{key}.json")
+
+
+def _read(kind: str, key: str) -> Optional[Dict]:
+    """The entry under key, or None if there is none or it has expired."""
+    path = _path(kind, key)
+    try:
+        if time.time() - os.path.getmtime(path) > PARSE_CACHE_TTL_SECONDS:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(kind: str, key: str, value: Dict):
+    _maybe_prune()
+    path = _path(kind, key)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    # Write then rename, so concurrent readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def prune_cache(now: Optional[float] = None):
+    """Remove expired entries, then the oldest ones while the directory is over PARSE_CACHE_MAX_BYTES."""
+    now = now or time.time()
+    entries = []
+    for root, _, names in os.walk(PARSE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > PARSE_CACHE_TTL_SECONDS:
+                    os.remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= PARSE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _maybe_prune():
+    global _last_prune
+    now = time.time()
+    with _prune_lock:
+        if now - _last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        _last_prune = now
+    prune_cache(now)
+
+
+def clear_cache():
+    """Remove the whole cache directory, e.g. at startup."""
+    shutil.rmtree(PARSE_CACHE_DIR, ignore_errors=True)
+
+
+def file_page_hashes(file_sha: str, pdf_path: str) -> List[str]:
+    """
+    Page hashes of a file, read from the file's manifest when this exact file was
+    seen before, and otherwise computed with PyPDF2 and recorded.
+    """
+    manifest = _read("files", file_sha)
+    if manifest is not None:
+        return manifest["pages"]
+    hashes = [page_hash(page) for page in PyPDF2.PdfReader(pdf_path).pages]
+    _write("files", file_sha, {"pages": hashes})
+    return hashes
+
+
+def load_pages(hashes: List[str]) -> List[Optional[Dict]]:
+    """The cached page record for each hash, or None for pages still to be parsed."""
+    records = []
+    for page_no, key in enumerate(hashes, start=1):
+        record = _read("pages", key)
+        if record is not None:
+            record.update(page_no=page_no, page_hash=key, seconds=0.0, cached=True)
+        records.append(record)
+    return records
+
+
+def store_pages(records: List[Dict]):
+    """
+    Store freshly extracted page records under their page_hash. Cached records,
+    and pages that timed out, are skipped.
+    """
+    for record in records:
+        if record.get("cached") or record.get("engine") == "timeout" or not record.get("page_hash"):
+            continue
+        _write("pages", record["page_hash"],
+               {key: value for key, value in record.items()
+                if key not in ("page_no", "page_hash", "seconds", "cached")})
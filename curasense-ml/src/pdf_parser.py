@@ -4,9 +4,184 @@ Extracts text content from PDF files for medical diagnosis processing.
 """
 
 import io
+import os
+import mmap
+import time
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import PyPDF2
 import pdfplumber
-from typing import Optional
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.parse_cache import file_digest, file_page_hashes, load_pages, store_pages
+
+
+# Page-parallel extraction settings
+PARALLEL_MIN_PAGES = 16        # smaller PDFs are faster to parse in-process
+PAGES_PER_TASK = 8             # pages handed to a worker at a time
+PAGE_TIMEOUT_SECONDS = 10.0    # per-page budget before a page range is given up on
+MAX_PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 2))
+
+# Page classification thresholds
+TEXT_LAYER_MIN_CHARS = 20      # pages with fewer characters have no usable text layer
+MIXED_IMAGE_COVERAGE = 0.3     # text pages with images over this share of the page are "mixed"
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+@contextmanager
+def open_pdf_source(source):
+    """
+    Give the parsers a seekable stream over the PDF without copying it.
+    
+    Args:
+        source: Raw bytes, a path to a PDF on disk (memory-mapped), or a file-like object
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        # BytesIO shares the initial buffer until written to
+        yield io.BytesIO(source)
+    else:
+        yield source
+
+
+def iter_pdf_pages(source, engine: str = "pdfplumber", start: int = 0, stop: Optional[int] = None,
+                   stop_when: Optional[Callable[[int, str], bool]] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Lazily yield the text of each page, so callers can start on page 1 while later
+    pages are still being parsed. Only one page's parsed layout is held at a time.
+    
+    Args:
+        source: Raw bytes, a path to a PDF on disk, or a file-like object
+        engine: "pdfplumber" or "pypdf2"
+        start: Index of the first page to read (0-based)
+        stop: Index after the last page to read; None reads to the end
+        stop_when: Optional hook called with (page_no, text) after each page;
+            returning True ends the iteration early
+        
+    Yields:
+        tuple: (page_no, text), page_no being 1-based
+    """
+    with open_pdf_source(source) as stream:
+        if engine == "pdfplumber":
+            with pdfplumber.open(stream) as pdf:
+                pages = pdf.pages[start:stop]
+                for page_no, page in enumerate(pages, start=start + 1):
+                    text = page.extract_text() or ""
+                    # Drop the page's cached chars/objects before moving on
+                    page.flush_cache()
+                    yield page_no, text
+                    if stop_when and stop_when(page_no, text):
+                        return
+        else:
+            pdf_reader = PyPDF2.PdfReader(stream)
+            # Like the pdfplumber slice, a stop past the last page reads to the end.
+            last_page = len(pdf_reader.pages) if stop is None else min(stop, len(pdf_reader.pages))
+            for page_no in range(start + 1, last_page + 1):
+                text = pdf_reader.pages[page_no - 1].extract_text() or ""
+                yield page_no, text
+                if stop_when and stop_when(page_no, text):
+                    return
+
+
+def image_boxes(page) -> List[Tuple[float, float, float, float]]:
+    """Bounding boxes of the page's images, clipped to the page."""
+    boxes = []
+    for image in page.images:
+        x0, top = max(image["x0"], 0), max(image["top"], 0)
+        x1, bottom = min(image["x1"], page.width), min(image["bottom"], page.height)
+        if x1 > x0 and bottom > top:
+            boxes.append((x0, top, x1, bottom))
+    return boxes
+
+
+def classify_page(page) -> str:
+    """
+    Cheap pre-scan of a pdfplumber page from its character and image objects,
+    without extracting any text.
+    
+    Returns:
+        str: "text" (usable text layer), "scanned" (images only) or "mixed"
+        (a text layer plus images covering a large share of the page)
+    """
+    boxes = image_boxes(page)
+    if len(page.chars) < TEXT_LAYER_MIN_CHARS:
+        return "scanned" if boxes else "text"
+    page_area = float(page.width * page.height) or 1.0
+    coverage = sum((x1 - x0) * (bottom - top) for x0, top, x1, bottom in boxes) / page_area
+    return "mixed" if coverage >= MIXED_IMAGE_COVERAGE else "text"
+
+
+def extract_routed_page(page, page_no: int, ocr: Optional[Callable] = None) -> Dict:
+    """
+    Classify a page and extract it with the fastest adequate engine: the text layer
+    for text pages, OCR for scanned pages, and both (OCR on the image regions only)
+    for mixed pages. Without an `ocr` callable, scanned pages come back empty.
+    
+    Args:
+        page: An open pdfplumber page
+        page_no: 1-based page number
+        ocr: Optional callable taking a pdfplumber page (or cropped region) and returning its text
+        
+    Returns:
+        dict: {"page_no", "kind", "engine", "seconds", "text"}
+    """
+    started = time.perf_counter()
+    kind = classify_page(page)
+    if kind == "scanned":
+        engine = "ocr" if ocr else "none"
+        text = (ocr(page) or "") if ocr else ""
+    else:
+        engine = "pdfplumber"
+        text = page.extract_text() or ""
+        if kind == "mixed" and ocr:
+            engine = "pdfplumber+ocr"
+            ocr_parts = [ocr(page.crop(box)) for box in image_boxes(page)]
+            text = "\n".join([text] + [part for part in ocr_parts if part])
+    # Drop the page's cached chars/objects before moving on
+    page.flush_cache()
+    return {
+        "page_no": page_no,
+        "kind": kind,
+        "engine": engine,
+        "seconds": round(time.perf_counter() - started, 4),
+        "text": text,
+    }
+
+
+def iter_routed_pages(source, start: int = 0, stop: Optional[int] = None, ocr: Optional[Callable] = None,
+                      stop_when: Optional[Callable[[int, str], bool]] = None) -> Iterator[Dict]:
+    """
+    Like iter_pdf_pages, but each page is classified and routed to its own engine
+    within a single pdfplumber open of the file.
+    
+    Yields:
+        dict: One extract_routed_page record per page
+    """
+    with open_pdf_source(source) as stream:
+        with pdfplumber.open(stream) as pdf:
+            for page_no, page in enumerate(pdf.pages[start:stop], start=start + 1):
+                record = extract_routed_page(page, page_no, ocr=ocr)
+                yield record
+                if stop_when and stop_when(page_no, record["text"]):
+                    return
+
+
+def page_timings(records: List[Dict]) -> List[Dict]:
+    """The per-page records without their text, for logging and API responses."""
+    return [{key: value for key, value in record.items() if key not in ("text", "page_hash")} for record in records]
+
+
+def timed_out_pages(records: List[Dict]) -> List[int]:
+    """Page numbers (1-based) that were given up on by extract_pages_parallel."""
+    return [record["page_no"] for record in records if record["engine"] == "timeout"]
 
 
 def extract_text_pypdf2(pdf_file) -> str:
@@ -14,20 +189,13 @@ def extract_text_pypdf2(pdf_file) -> str:
     Extract text from PDF using PyPDF2.
     
     Args:
-        pdf_file: File-like object or bytes of the PDF
+        pdf_file: File-like object, path or bytes of the PDF
         
     Returns:
         str: Extracted text content
     """
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n"
-        
-        return text.strip()
+        return "\n".join(text for _, text in iter_pdf_pages(pdf_file, engine="pypdf2")).strip()
     except Exception as e:
         raise Exception(f"PyPDF2 extraction failed: {str(e)}")
 
@@ -37,20 +205,13 @@ def extract_text_pdfplumber(pdf_file) -> str:
     Extract text from PDF using pdfplumber (more accurate for complex layouts).
     
     Args:
-        pdf_file: File-like object or bytes of the PDF
+        pdf_file: File-like object, path or bytes of the PDF
         
     Returns:
         str: Extracted text content
     """
     try:
-        with pdfplumber.open(pdf_file) as pdf:
-            text = ""
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        
-        return text.strip()
+        return "\n".join(text for _, text in iter_pdf_pages(pdf_file, engine="pdfplumber") if text).strip()
     except Exception as e:
         raise Exception(f"pdfplumber extraction failed: {str(e)}")
 
@@ -59,6 +220,10 @@ def extract_text_from_pdf(pdf_file, method: str = "pdfplumber") -> str:
     """
     Main function to extract text from PDF with fallback mechanism.
     
+    With pdfplumber, every page is classified and routed in a single pass (see
+    iter_routed_pages). PyPDF2 is only used when pdfplumber cannot read the file, or
+    when text-layer pages came back empty; scanned pages have nothing for it to find.
+    
     Args:
         pdf_file: File-like object or bytes of the PDF
         method: Preferred extraction method ("pdfplumber" or "pypdf2")
@@ -74,11 +239,14 @@ def extract_text_from_pdf(pdf_file, method: str = "pdfplumber") -> str:
         pdf_file.seek(0)
     
     # Try preferred method first
+    scanned_only = False
     try:
         if method == "pdfplumber":
-            text = extract_text_pdfplumber(pdf_file)
+            records = list(iter_routed_pages(pdf_file))
+            text = "\n".join(record["text"] for record in records if record["text"]).strip()
             if text:
                 return text
+            scanned_only = bool(records) and all(record["kind"] == "scanned" for record in records)
         else:
             text = extract_text_pypdf2(pdf_file)
             if text:
@@ -86,6 +254,9 @@ def extract_text_from_pdf(pdf_file, method: str = "pdfplumber") -> str:
     except Exception as primary_error:
         print(f"Primary method ({method}) failed: {primary_error}")
     
+    if scanned_only:
+        raise Exception("No text could be extracted from the PDF: its pages are scanned images")
+    
     # Reset file pointer for fallback
     if hasattr(pdf_file, 'seek'):
         pdf_file.seek(0)
@@ -106,6 +277,122 @@ def extract_text_from_pdf(pdf_file, method: str = "pdfplumber") -> str:
         raise Exception(f"Both extraction methods failed. Last error: {fallback_error}")
 
 
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared process pool used for page-parallel extraction.
+    Workers are started once and reused, so later uploads skip the start-up cost.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=MAX_PDF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pdf_pool
+
+
+def _reset_pdf_pool(terminate: bool = False):
+    """
+    Drop the shared pool; the next upload starts a fresh one. With terminate, workers
+    still running (e.g. stuck on a page that timed out) are killed, since cancelling
+    their futures does not stop them.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+    if pool is None:
+        return
+    workers = list((pool._processes or {}).values()) if terminate else []
+    pool.shutdown(wait=False, cancel_futures=True)
+    for worker in workers:
+        worker.terminate()
+
+
+def _extract_pages(pdf_path: str, indices: List[int], ocr: Optional[Callable] = None) -> List[Dict]:
+    """
+    Classify and extract the given pages (0-based indices) in one open. Runs inside a pool worker.
+    """
+    with open_pdf_source(pdf_path) as stream:
+        with pdfplumber.open(stream) as pdf:
+            return [extract_routed_page(pdf.pages[i], i + 1, ocr=ocr) for i in indices]
+
+
+def extract_pages_parallel(source, ocr: Optional[Callable] = None, file_sha: Optional[str] = None) -> List[Dict]:
+    """
+    Extract every page, splitting the pages across the shared process pool.
+    Each page is routed to its own engine (see extract_routed_page).
+    
+    Pages already in the parse cache (src.parse_cache) are not parsed again, so
+    a re-upload, or a re-upload with a few pages changed, only extracts the new pages.
+    
+    Args:
+        source: Raw bytes of the PDF, or the path of a spooled upload
+        ocr: Optional OCR callable for scanned/mixed pages; must be a module-level
+            function so it can be sent to the workers
+        file_sha: sha256 of the file when already known (e.g. from spool_upload)
+        
+    Returns:
+        list: One record per page, in page order, each with its "page_hash". Pages
+        served from the cache have "cached" set. Pages not extracted by the file's
+        deadline come back empty with engine "timeout".
+    """
+    file_sha = file_sha or file_digest(source)
+    # Workers open the file from disk rather than each receiving a copy of the bytes.
+    owns_file = not isinstance(source, (str, os.PathLike))
+    if owns_file:
+        fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    else:
+        pdf_path = os.fspath(source)
+    try:
+        if owns_file:
+            with os.fdopen(fd, "wb") as f:
+                f.write(source)
+
+        hashes = file_page_hashes(file_sha, pdf_path)
+        records = load_pages(hashes)
+        missing = [i for i, record in enumerate(records) if record is None]
+        if not missing:
+            return records
+
+        if len(missing) < PARALLEL_MIN_PAGES:
+            fresh = _extract_pages(pdf_path, missing, ocr)
+        else:
+            pool = get_pdf_pool()
+            tasks = [missing[i:i + PAGES_PER_TASK] for i in range(0, len(missing), PAGES_PER_TASK)]
+            futures = [pool.submit(_extract_pages, pdf_path, indices, ocr) for indices in tasks]
+            # One deadline for the whole file, not one per task: tasks run MAX_PDF_WORKERS at a time.
+            rounds = -(-len(tasks) // MAX_PDF_WORKERS)
+            deadline = time.monotonic() + PAGE_TIMEOUT_SECONDS * PAGES_PER_TASK * rounds
+
+            fresh = []
+            timed_out = False
+            for indices, future in zip(tasks, futures):
+                try:
+                    fresh.extend(future.result(timeout=max(0.0, deadline - time.monotonic())))
+                except FutureTimeoutError:
+                    timed_out = True
+                    print(f"Page extraction timed out for pages {indices[0] + 1}-{indices[-1] + 1}")
+                    fresh.extend({"page_no": i + 1, "kind": "unknown", "engine": "timeout",
+                                  "seconds": PAGE_TIMEOUT_SECONDS, "text": ""}
+                                 for i in indices)
+                except BrokenProcessPool:
+                    _reset_pdf_pool()
+                    raise
+            if timed_out:
+                # The workers on the timed-out pages are still busy; replace them so later uploads don't queue behind them.
+                _reset_pdf_pool(terminate=True)
+
+        for record in fresh:
+            record["page_hash"] = hashes[record["page_no"] - 1]
+            records[record["page_no"] - 1] = record
+        store_pages(fresh)
+        return records
+    finally:
+        if owns_file:
+            os.remove(pdf_path)
+
+
 def validate_pdf_content(text: str) -> tuple[bool, Optional[str]]:
     """
     Validate that the extracted text is suitable for medical analysis.
@@ -128,22 +415,45 @@ def validate_pdf_content(text: str) -> tuple[bool, Optional[str]]:
     return True, None
 
 
-def process_pdf_file(file_content: bytes) -> dict:
+def process_pdf_file(file_content, file_sha: Optional[str] = None) -> dict:
     """
     Process uploaded PDF file and extract text (synchronous version).
     
     Args:
-        file_content: Raw bytes of the uploaded PDF file
+        file_content: Raw bytes of the uploaded PDF file, or the path of a spooled upload
+        file_sha: sha256 of the file when already known
         
     Returns:
-        dict: Contains 'text' and 'status' keys
+        dict: Contains 'text' and 'status' keys, plus 'pages' (per-page kind,
+        engine and timing) when the page-parallel extractor was used and
+        'timed_out_pages', the pages left out because they took too long
     """
     try:
-        # Create file-like object from bytes
-        pdf_file = io.BytesIO(file_content)
+        # Extract pages in parallel, falling back to the sequential extractors
+        pages = []
+        timed_out = []
+        try:
+            records = extract_pages_parallel(file_content, file_sha=file_sha)
+            pages = page_timings(records)
+            timed_out = timed_out_pages(records)
+            text = "\n".join(record["text"] for record in records if record["text"]).strip()
+        except Exception as parallel_error:
+            print(f"Parallel extraction failed: {parallel_error}")
+            text = ""
         
-        # Extract text
-        text = extract_text_from_pdf(pdf_file)
+        if not text and timed_out:
+            # The sequential extractors have no time limit and would hang on the same pages
+            return {
+                "status": "error",
+                "error": f"Text extraction timed out for pages {', '.join(map(str, timed_out))}",
+                "text": None,
+                "timed_out_pages": timed_out
+            }
+
+        if not text:
+            # Paths are memory-mapped by the extractors; bytes are wrapped in a stream
+            pdf_file = file_content if isinstance(file_content, (str, os.PathLike)) else io.BytesIO(file_content)
+            text = extract_text_from_pdf(pdf_file)
         
         # Validate content
         is_valid, error_msg = validate_pdf_content(text)
@@ -158,7 +468,9 @@ def process_pdf_file(file_content: bytes) -> dict:
         return {
             "status": "success",
             "text": text,
-            "error": None
+            "error": None,
+            "pages": pages,
+            "timed_out_pages": timed_out
         }
         
     except Exception as e:
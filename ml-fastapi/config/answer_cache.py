@@ -0,0 +1,75 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import chromadb.utils.embedding_functions as embedding_functions
+
+# Cosine similarity above which two questions on the same collection share an answer.
+SIMILARITY_THRESHOLD = float(os.getenv("RAG_CACHE_SIMILARITY", "0.92"))
+# Oldest answers are dropped first once a collection holds this many.
+MAX_ENTRIES_PER_COLLECTION = 64
+
+# collection_name -> [(unit question embedding, question, answer)]
+_entries: Dict[str, List[Tuple[np.ndarray, str, str]]] = {}
+# collection_name -> generation, bumped on every (re-)ingestion or deletion
+_generations: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def embed_question(question: str, gemini_api: str) -> List[float]:
+    """
+    Embed a user question with the same Gemini embedding function used for the collection.
+    """
+    google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=gemini_api)
+    return [float(x) for x in google_ef([question])[0]]
+
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def current_generation(collection_name: str) -> int:
+    with _lock:
+        return _generations.get(collection_name, 0)
+
+
+def lookup_answer(collection_name: str, embedding: List[float]) -> Optional[str]:
+    """
+    Return the stored answer of the most similar previous question on this collection,
+    or None if no previous question is within SIMILARITY_THRESHOLD.
+    """
+    with _lock:
+        entries = list(_entries.get(collection_name, []))
+    if not entries:
+        return None
+
+    matrix = np.stack([entry[0] for entry in entries])
+    scores = matrix @ _unit(embedding)
+    best = int(np.argmax(scores))
+    if scores[best] >= SIMILARITY_THRESHOLD:
+        return entries[best][2]
+    return None
+
+
+def store_answer(collection_name: str, generation: int, embedding: List[float], question: str, answer: str) -> bool:
+    """
+    Remember an answer for a question. The answer is discarded (False returned) if the
+    collection was re-ingested since `generation` was read, as it may describe old documents.
+    """
+    with _lock:
+        if _generations.get(collection_name, 0) != generation:
+            return False
+        entries = _entries.setdefault(collection_name, [])
+        entries.append((_unit(embedding), question, answer))
+        del entries[:-MAX_ENTRIES_PER_COLLECTION]
+    return True
+
+
+def invalidate_collection(collection_name: str):
+    """Drop every cached answer for a collection, e.g. when it is re-ingested or deleted."""
+    with _lock:
+        _entries.pop(collection_name, None)
+        _generations[collection_name] = _generations.get(collection_name, 0) + 1
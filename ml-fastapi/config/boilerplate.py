@@ -0,0 +1,120 @@
+import re
+from typing import Dict, List, Set, Tuple
+
+# A line is treated as boilerplate once it shows up at the same edge position on at
+# least this share of a document's pages (and on at least two pages).
+MIN_PAGE_SHARE = 0.5
+# Headers and footers live at the edges of a page; lines further in are never stripped,
+# so repeated test rows in the body of a report are kept.
+EDGE_LINES = 3
+
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+# Numbers that change from page to page of the same header or footer: page numbers,
+# dates and times. Only their digits are masked; other numbers, such as results, are kept.
+_VARYING_NUMBERS = re.compile(
+    r"page\s*\d+(?:\s*(?:of|/)\s*\d+)?"
+    r"|^[\W_]*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?[\W_]*$"
+    r"|\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}"
+    r"|\d{1,2}[-\s](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[-\s,]*\d{2,4}"
+    r"|\d{1,2}:\d{2}(?::\d{2})?",
+)
+# "HBsAg: Non Reactive", "Impression: No growth"; a label followed by its value.
+_LABEL_VALUE = re.compile(r"^[^:]*[a-z][^:]*:\s*\S", re.IGNORECASE)
+
+
+def normalize_line(line: str) -> str:
+    """
+    Normalize a line so that repeated headers/footers compare equal across pages,
+    e.g. "Page 1 of 4" and "Page 2 of 4" both become "page # of #". Only page
+    numbers, dates and times are masked; "Hemoglobin 10.2" and "Hemoglobin 11.0" differ.
+    """
+    line = _SPACES.sub(" ", line).strip().lower()
+    return _VARYING_NUMBERS.sub(lambda match: _DIGITS.sub("#", match.group()), line)
+
+
+def _carries_value(line: str) -> bool:
+    """
+    True if the line may hold a result: a `label: value` line such as "HBsAg: Non Reactive",
+    or a number that is not a page number, date or time, e.g. "WBC 8000". Such lines are
+    never stripped, however often they repeat: a stable result on daily reports looks like a footer.
+    """
+    return bool(_LABEL_VALUE.match(line.strip())) or any(ch.isdigit() for ch in normalize_line(line))
+
+
+def _page_lines(text: str) -> List[str]:
+    return [line for line in text.splitlines() if line.strip()]
+
+
+def _edge_positions(total: int) -> Dict[int, Tuple[str, int]]:
+    """
+    Edge position of each line index within EDGE_LINES of the top or bottom of a page:
+    ("top", 0) is the first line, ("bottom", 0) the last.
+    """
+    positions = {total - 1 - i: ("bottom", i) for i in range(min(EDGE_LINES, total))}
+    positions.update({i: ("top", i) for i in range(min(EDGE_LINES, total))})
+    return positions
+
+
+def learn_boilerplate(pages: List[str]) -> Set[Tuple[Tuple[str, int], str]]:
+    """
+    Learn the lines repeated at the same edge position across the pages of one document.
+
+    Parameters:
+        pages (list): Text of each page, in order.
+
+    Returns:
+        set: (position, normalized line) pairs that should be stripped.
+    """
+    if len(pages) < 2:
+        return set()
+
+    page_counts: Dict[Tuple[Tuple[str, int], str], int] = {}
+    for text in pages:
+        lines = _page_lines(text)
+        for index, position in _edge_positions(len(lines)).items():
+            if not _carries_value(lines[index]):
+                entry = (position, normalize_line(lines[index]))
+                page_counts[entry] = page_counts.get(entry, 0) + 1
+
+    threshold = max(2, int(len(pages) * MIN_PAGE_SHARE + 0.5))
+    return {entry for entry, count in page_counts.items() if count >= threshold}
+
+
+def strip_boilerplate(pages: List[str]) -> List[str]:
+    """
+    Remove letterheads, addresses, page numbers and legal footers repeated at the
+    same place on the pages of a single document. Nothing is learnt across documents,
+    so a single-page report is returned as is.
+
+    Parameters:
+        pages (list): Text of each page, in order.
+
+    Returns:
+        list: Cleaned text of each page, same length and order as the input.
+    """
+    boilerplate = learn_boilerplate(pages)
+    if not boilerplate:
+        return list(pages)
+
+    cleaned = []
+    for text in pages:
+        lines = _page_lines(text)
+        stripped = {index for index, position in _edge_positions(len(lines)).items()
+                    if (position, normalize_line(lines[index])) in boilerplate}
+        cleaned.append("\n".join(line for i, line in enumerate(lines) if i not in stripped))
+    return cleaned
+
+
+def strip_boilerplate_from_documents(documents: List) -> List:
+    """
+    Strip boilerplate from the LangChain documents of ONE uploaded file in place.
+    Documents left empty after stripping are dropped.
+    """
+    cleaned = strip_boilerplate([doc.page_content for doc in documents])
+    kept = []
+    for doc, text in zip(documents, cleaned):
+        if text.strip():
+            doc.page_content = text
+            kept.append(doc)
+    return kept
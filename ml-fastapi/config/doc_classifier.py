@@ -0,0 +1,119 @@
+import re
+from typing import Dict, List, Optional
+
+# Weighted keyword patterns per document type, compiled once at import.
+DOC_TYPE_PATTERNS = {
+    "lab_report": [
+        (r"\breference (?:range|interval)s?\b|\bbiological ref", 3),
+        (r"\b(?:pathology|laboratory|lab report|sample (?:collected|received))\b", 2),
+        (r"\b(?:ha?emoglobin|wbc|rbc|platelets?|creatinine|glucose|cholesterol|tsh|hba1c|bilirubin|urea|sgpt|sgot)\b", 1),
+        (r"\b(?:mg/dl|g/dl|mmol/l|iu/l|u/l|cells/cumm|µiu/ml|ng/ml)\b", 1),
+    ],
+    "pathology_report": [
+        (r"\b(?:histopatholog\w*|cytolog\w*|biopsy|fnac|frozen section|immunohistochemi\w*|ihc)\b", 3),
+        (r"\b(?:gross (?:description|examination)|microscopic (?:description|examination)|specimen)\b", 2),
+        (r"\b(?:carcinoma|adenoma|neoplas\w*|malignan\w*|dysplasia|metaplasia|granuloma\w*|margins?|grade)\b", 1),
+    ],
+    "prescription": [
+        (r"\b(?:rx|prescription|prescribed)\b|℞", 3),
+        (r"\b(?:tab|tablet|cap|capsule|syp|syrup|inj|injection)s?\b\.?", 1),
+        (r"\b(?:od|bd|bid|tds|tid|qid|hs|sos|once daily|twice daily|after food|before food)\b"
+         r"|\b[01½]\s*-\s*[01½]\s*-\s*[01½]\b", 1),
+        (r"\b\d+(?:\.\d+)?\s?(?:mg|mcg|ml|iu|units?)\b", 1),
+        # Common drugs by name or by class suffix
+        (r"\b(?:paracetamol|acetaminophen|ibuprofen|aspirin|insulin|cetirizine|dolo|crocin|prednisolone|dexamethasone|hydrocortisone)\b"
+         r"|\b[a-z]+(?:cillin|mycin|floxacin|cycline|prazole|tidine|olol|pril|sartan|dipine|statin|formin|gliptin|gliflozin|azole|vir|mab)\b", 1),
+    ],
+    "discharge_summary": [
+        (r"\bdischarge summary\b", 5),
+        (r"\bdate of (?:admission|discharge)\b|\b(?:admitted|discharged) on\b", 2),
+        (r"\b(?:hospital course|course in (?:the )?hospital|condition (?:at|on) discharge|discharge medications?)\b", 2),
+        (r"\b(?:final diagnosis|chief complaints?|history of present illness)\b", 1),
+    ],
+    "imaging_report": [
+        (r"\b(?:x-?ray|radiograph|ct scan|hrct|mri|ultrasound|usg|sonography|mammogra\w*|echocardiogra\w*|doppler)\b", 3),
+        (r"\b(?:impression|radiologist|technique)\b", 2),
+        (r"\b(?:contrast|axial|sagittal|coronal|lesion|opacity|echogenic\w*)\b", 1),
+    ],
+}
+# General clinical vocabulary; keeps a medical document that matches no specific type well from being dropped.
+MEDICAL_PATTERNS = [
+    (r"\b(?:patient|pt|diagnosis|dx|clinical|symptoms?|treatment|history|physician|doctor|dr|hospital|clinic|opd)\b", 1),
+    (r"\b(?:blood pressure|pulse|temperature|bp|mmhg|bpm|spo2|rr|temp)\b", 1),
+    # Clinical note shorthand: complains of, history of, on examination, known case of, ...
+    (r"(?<!\w)(?:c/o|h/o|o/e|k/c/o|s/p|f/u|r/v|adv)(?!\w)", 2),
+]
+# Positive evidence that a document is not medical; only this gets a file dropped.
+NON_MEDICAL_PATTERNS = [
+    (r"\b(?:invoice|receipt|bill to|amount due|gst(?:in)?|tax|subtotal|payment|bank statement|account (?:no|number)|ifsc)\b", 1),
+    (r"\b(?:resume|curriculum vitae|work experience|skills|objective|education)\b", 1),
+    (r"\b(?:agreement|hereby|terms and conditions|lease|tenant|landlord)\b", 1),
+    (r"\b(?:syllabus|assignment|chapter|exercise|abstract|references)\b", 1),
+]
+# A document reaches a type, or counts as medical, with at least this score.
+MIN_MEDICAL_SCORE = 3
+# A document with no medical evidence is dropped only with at least this much non-medical evidence.
+MIN_NON_MEDICAL_SCORE = 3
+# Clinical free text that matches no specific type is extracted like a discharge summary.
+CLINICAL_FALLBACK_TYPE = "discharge_summary"
+# Each pattern counts at most this many matches, so one repeated word can't decide the type.
+MAX_HITS_PER_PATTERN = 3
+# Only the start of the document (its first few pages) is classified.
+CLASSIFY_CHARS = 4000
+CLASSIFY_PAGES = 3
+# Below this much extracted text (e.g. a scanned PDF) the document is left unclassified.
+MIN_CLASSIFY_CHARS = 200
+
+_COMPILED = {
+    doc_type: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in patterns]
+    for doc_type, patterns in DOC_TYPE_PATTERNS.items()
+}
+_COMPILED_MEDICAL = [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in MEDICAL_PATTERNS]
+_COMPILED_NON_MEDICAL = [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in NON_MEDICAL_PATTERNS]
+
+
+def _score(text: str, patterns) -> int:
+    return sum(weight * min(len(pattern.findall(text)), MAX_HITS_PER_PATTERN) for pattern, weight in patterns)
+
+
+def document_scores(text: str) -> Dict[str, int]:
+    """Keyword score of the text for each document type."""
+    text = text[:CLASSIFY_CHARS]
+    return {doc_type: _score(text, patterns) for doc_type, patterns in _COMPILED.items()}
+
+
+def classify_document(first_page: str) -> Optional[str]:
+    """
+    Classify a document from the text of its first page(s).
+
+    Returns:
+        Optional[str]: "lab_report", "pathology_report", "prescription", "discharge_summary",
+        "imaging_report", "non_medical" when the text is clearly something else (an invoice,
+        a CV, ...), or None when there is too little evidence either way; such files take
+        the untyped path rather than being dropped.
+    """
+    text = first_page[:CLASSIFY_CHARS]
+    scores = document_scores(text)
+    doc_type, best = max(scores.items(), key=lambda item: item[1])
+    if best >= MIN_MEDICAL_SCORE:
+        return doc_type
+    medical = _score(text, _COMPILED_MEDICAL)
+    if medical >= MIN_MEDICAL_SCORE:
+        return doc_type if best > 0 else CLINICAL_FALLBACK_TYPE
+    if best + medical == 0 and _score(text, _COMPILED_NON_MEDICAL) >= MIN_NON_MEDICAL_SCORE:
+        return "non_medical"
+    return None
+
+
+def classify_pages(page_texts: List[str]) -> Optional[str]:
+    """
+    Classify a document from the text of its first CLASSIFY_PAGES pages.
+
+    Returns:
+        Optional[str]: as classify_document; also None when the pages hold too little text
+        to judge (scanned or image-only PDFs).
+    """
+    text = "\n".join(page_texts[:CLASSIFY_PAGES])
+    if len("".join(text.split())) < MIN_CLASSIFY_CHARS:
+        return None
+    return classify_document(text)
@@ -1,4 +1,4 @@
-from typing import Optional, TypedDict
+from typing import List, Optional, TypedDict
 from pydantic import BaseModel
 
 
@@ -26,6 +26,12 @@ class RagChat(BaseModel):
     thread_id: str
     question: str
     gemini: Optional[str]  
+    speculative: Optional[bool] = False ## Draft the answer while relevance is still being checked
+
+class RagBatchChat(BaseModel):
+    thread_id: str
+    questions: List[str]
+    gemini: Optional[str] = None
     
 class VisionInput(BaseModel):
     thread_id: str
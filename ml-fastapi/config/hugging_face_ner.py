@@ -1,5 +1,25 @@
 from huggingface_hub import InferenceClient
 import os
+import threading
+from bisect import bisect_right
+from typing import Dict, List
+
+import numpy as np
+
+from .ner_cache import SentenceCache, cached_entities
+
+NER_MODEL = "blaze999/Medical-NER"
+# "remote" (hosted Inference API) or "local" (the same model on this machine's CPU;
+# needs transformers and torch installed).
+NER_BACKEND = os.getenv("NER_BACKEND", "remote").lower()
+# Entities whose score is at or below this are dropped.
+MIN_ENTITY_SCORE = 0.8
+# Windows per forward pass with the local backend.
+LOCAL_BATCH_SIZE = 16
+# Local backend sliding windows: sentences longer than LOCAL_WINDOW_TOKENS are split into
+# windows overlapping by LOCAL_STRIDE_TOKENS rather than truncated, as in curasense-ml.
+LOCAL_WINDOW_TOKENS = 512
+LOCAL_STRIDE_TOKENS = 128
 
 # from transformers import AutoTokenizer, AutoModelForTokenClassification
 # import torch
@@ -110,30 +130,209 @@ import os
 #     return report
 
 
-def ner_extractor(input_text):
+# Results per normalized sentence, so resubmitted or re-run text only sends the sentences that changed.
+_sentence_cache = SentenceCache()
+
+
+def _remote_sentences(sentences: List[str]) -> List[List[Dict]]:
+    """
+    Run sentences through the hosted model in a single call, joined by newlines,
+    and split the entities back per sentence with offsets into that sentence.
+    """
     client = InferenceClient(
-	provider="hf-inference",
-	api_key=os.environ["HF_TOKEN"]
+        provider="hf-inference",
+        api_key=os.environ["HF_TOKEN"]
     )
+    starts, position = [], 0
+    for sentence in sentences:
+        starts.append(position)
+        position += len(sentence) + 1
 
     result = client.token_classification(
-        model="blaze999/Medical-NER",
-        text=input_text
-        
+        model=NER_MODEL,
+        text="\n".join(sentences)
     )
-    
-    entity_groups = set()
 
+    per_sentence = [[] for _ in sentences]
     for entry in result:
-        if entry.score>0.8:
-            entity_groups.add(entry.entity_group)
-        
-    
-    entity_dict = {key: [] for key in entity_groups}
+        index = bisect_right(starts, entry.start) - 1
+        start = entry.start - starts[index]
+        per_sentence[index].append({
+            "entity_group": entry.entity_group,
+            "word": entry.word,
+            "score": float(entry.score),
+            "start": start,
+            "end": max(start + 1, min(entry.end - starts[index], len(sentences[index]))),
+        })
+    return per_sentence
 
-    for entry in result:
-        if entry.score>0.8:
-            entity_dict[entry.entity_group].append(entry.word)
 
-    return entity_dict
+_local_model = None
+_local_lock = threading.Lock()
+
+
+def _load_local_model():
+    """
+    Load the tokenizer and model once, with label id lookup arrays for decoding.
+
+    Returns:
+        tuple: (tokenizer, model, entity_types, type_of_label, is_begin_label)
+    """
+    global _local_model
+    if _local_model is None:
+        with _local_lock:
+            if _local_model is None:
+                from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+                tokenizer = AutoTokenizer.from_pretrained(NER_MODEL)
+                model = AutoModelForTokenClassification.from_pretrained(NER_MODEL)
+                model.eval()
+                id2label = [model.config.id2label[i] for i in range(len(model.config.id2label))]
+                entity_types = sorted({label[2:] for label in id2label if label[:2] in ("B-", "I-")})
+                type_of_label = np.array([entity_types.index(label[2:]) if label[:2] in ("B-", "I-") else -1
+                                          for label in id2label])
+                is_begin_label = np.array([label.startswith("B-") for label in id2label])
+                _local_model = (tokenizer, model, entity_types, type_of_label, is_begin_label)
+    return _local_model
+
+
+def _group_tokens(sentence: str, offsets, word_ids, label_ids, token_scores) -> List[Dict]:
+    """
+    Group BIO-tagged tokens of one sentence into entities, the way the Inference
+    API's "simple" aggregation does, with array operations over all tokens: a
+    token continues the previous entity on an I- tag of the same type, or on a
+    B- tag inside the same word. An entity's score is the mean of its tokens'.
+    """
+    _, _, entity_types, type_of_label, is_begin_label = _load_local_model()
+    content = offsets[:, 1] > offsets[:, 0]
+    offsets, word_ids = offsets[content], word_ids[content]
+    label_ids, token_scores = label_ids[content], token_scores[content]
+    if len(label_ids) == 0:
+        return []
+
+    types = type_of_label[label_ids]
+    begins = is_begin_label[label_ids]
+    previous_types = np.concatenate(([-1], types[:-1]))
+    previous_words = np.concatenate(([-2], word_ids[:-1]))
+    continues = (types >= 0) & (types == previous_types) & (~begins | (word_ids == previous_words))
+    opens = (types >= 0) & ~continues
+    closes = (types >= 0) & ~np.concatenate((continues[1:], [False]))
+    if not opens.any():
+        return []
+
+    in_entity = types >= 0
+    entity_ids = (np.cumsum(opens) - 1)[in_entity]
+    scores = np.bincount(entity_ids, weights=token_scores[in_entity]) / np.bincount(entity_ids)
+
+    return [{
+        "entity_group": entity_types[types[first]],
+        "word": sentence[offsets[first, 0]:offsets[last, 1]].strip(),
+        "score": float(score),
+        "start": int(offsets[first, 0]),
+        "end": int(offsets[last, 1]),
+    } for first, last, score in zip(np.flatnonzero(opens), np.flatnonzero(closes), scores)]
+
+
+def _merge_windows(encoding, labels, scores, window_indices: List[int]):
+    """
+    Merge the windows of one sentence into a single label and score per token.
+    Consecutive windows share LOCAL_STRIDE_TOKENS tokens; each keeps its half of the
+    overlap, so every token is labelled by the window that gives it the most context.
+
+    Returns:
+        tuple: numpy arrays (offsets, word_ids, label_ids, token_scores) in text order.
+    """
+    stride = LOCAL_STRIDE_TOKENS
+    offsets, words, label_ids, token_scores = [], [], [], []
+    last = len(window_indices) - 1
+    for position, i in enumerate(window_indices):
+        window_offsets = np.asarray(encoding["offset_mapping"][i]).reshape(-1, 2)
+        content = np.flatnonzero(window_offsets[:, 1] > window_offsets[:, 0])
+        trim_start = stride - stride // 2 if position > 0 else 0
+        trim_end = stride // 2 if position < last else 0
+        keep = content[trim_start:len(content) - trim_end]
+        word_ids = np.array([-1 if w is None else w for w in encoding.word_ids(i)])
+        offsets.append(window_offsets[keep])
+        words.append(word_ids[keep])
+        label_ids.append(labels[i][keep])
+        token_scores.append(scores[i][keep])
+    if not offsets:
+        empty = np.array([], dtype=int)
+        return np.empty((0, 2), dtype=int), empty, empty, np.array([])
+    return np.concatenate(offsets), np.concatenate(words), np.concatenate(label_ids), np.concatenate(token_scores)
+
+
+def _local_sentences(sentences: List[str]) -> List[List[Dict]]:
+    """
+    Run sentences through the model on CPU. Long sentences are split into overlapping
+    windows instead of being truncated, so no part of the text is dropped. Windows are
+    sorted by length and run LOCAL_BATCH_SIZE at a time, so each batch pads as little as possible.
+    """
+    import torch
+
+    tokenizer, model, _, _, _ = _load_local_model()
+    encoding = tokenizer(sentences, truncation=True, max_length=LOCAL_WINDOW_TOKENS, stride=LOCAL_STRIDE_TOKENS,
+                         return_overflowing_tokens=True, return_offsets_mapping=True)
+    order = sorted(range(len(encoding["input_ids"])), key=lambda i: len(encoding["input_ids"][i]))
+    labels: List[np.ndarray] = [None] * len(order)
+    scores: List[np.ndarray] = [None] * len(order)
+    for start in range(0, len(order), LOCAL_BATCH_SIZE):
+        chunk = order[start:start + LOCAL_BATCH_SIZE]
+        batch = tokenizer.pad(
+            [{"input_ids": encoding["input_ids"][i], "attention_mask": encoding["attention_mask"][i]} for i in chunk],
+            padding="longest",
+            return_tensors="np",
+        )
+        with torch.inference_mode():
+            logits = model(input_ids=torch.from_numpy(batch["input_ids"]),
+                           attention_mask=torch.from_numpy(batch["attention_mask"])).logits.numpy()
+        probabilities = np.exp(logits - logits.max(axis=2, keepdims=True))
+        probabilities /= probabilities.sum(axis=2, keepdims=True)
+        for row, i in enumerate(chunk):
+            length = len(encoding["input_ids"][i])
+            labels[i] = probabilities[row, :length].argmax(axis=1)
+            scores[i] = probabilities[row, :length].max(axis=1)
+
+    windows_per_sentence: List[List[int]] = [[] for _ in sentences]
+    for i, sentence_index in enumerate(encoding["overflow_to_sample_mapping"]):
+        windows_per_sentence[sentence_index].append(i)
+    return [_group_tokens(sentence, *_merge_windows(encoding, labels, scores, windows))
+            for sentence, windows in zip(sentences, windows_per_sentence)]
+
+
+_BACKENDS = {
+    "remote": _remote_sentences,
+    "local": _local_sentences,
+}
+
+
+def ner_extractor(input_text):
+    """
+    Medical entities of the text, grouped by type: {entity_group: [words]}.
+    Runs on the backend chosen by NER_BACKEND, through the sentence cache, and on
+    the other backend if that one fails.
+    """
+    run_sentences = _BACKENDS.get(NER_BACKEND)
+    if run_sentences is None:
+        raise ValueError(f"Unknown NER_BACKEND {NER_BACKEND!r}; expected one of {sorted(_BACKENDS)}")
+    try:
+        entities = cached_entities(input_text, _sentence_cache, run_sentences, NER_BACKEND, NER_MODEL)
+    except Exception as e:
+        fallback = next(name for name in _BACKENDS if name != NER_BACKEND)
+        print(f"NER extraction failed on the {NER_BACKEND} backend, retrying on {fallback}: {e!r}")
+        entities = cached_entities(input_text, _sentence_cache, _BACKENDS[fallback], fallback, NER_MODEL)
+    if not entities:
+        return {}
+
+    # Threshold and group in one pass over arrays rather than per entry
+    groups = np.array([entry["entity_group"] for entry in entities])
+    words = np.array([entry["word"] for entry in entities], dtype=object)
+    keep = np.array([entry["score"] for entry in entities]) > MIN_ENTITY_SCORE
+    labels, first_seen, group_ids = np.unique(groups[keep], return_index=True, return_inverse=True)
+    kept_words = words[keep]
+    return {str(labels[i]): kept_words[group_ids == i].tolist() for i in np.argsort(first_seen)}
+
 
+def ner_cache_stats() -> Dict:
+    """Hit/miss counts and size of the sentence cache in this process."""
+    return _sentence_cache.stats()
@@ -0,0 +1,323 @@
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+Conversion = Union[float, Callable[[float], float]]
+
+
+class Analyte(NamedTuple):
+    label: str                                   # display name
+    category: str                                # "lab" or "vital"
+    aliases: Tuple[str, ...]                     # lower-case names as written in notes
+    unit: str                                    # canonical unit values are reported in
+    conversions: Dict[str, Conversion]           # other unit -> factor (or function) to the canonical one
+    low: Optional[float]                         # adult reference range, in the canonical unit
+    high: Optional[float]
+    guess: Optional[Tuple[str, float, str]] = None  # ("<" or ">", threshold, unit) assumed when none is written
+
+
+class LabResult(NamedTuple):
+    key: str
+    label: str
+    category: str
+    value: float            # in the canonical unit
+    unit: str
+    low: Optional[float]
+    high: Optional[float]
+    flag: str               # "HIGH", "LOW" or "" (in range, or no range)
+    raw: str                # matched text
+    start: int
+    end: int
+
+
+_GLUCOSE_MMOL = {"mmol/L": 18.016}
+_CHOLESTEROL_MMOL = {"mmol/L": 38.67}
+_COUNT_UNITS = {"x10^9/L": 1000.0, "x10^3/µL": 1000.0, "lakh/µL": 100000.0}
+
+# key -> analyte. Keys of the glucose, HbA1c and blood pressure entries are the ones
+# the Mini-CDSS rules have always used (RBS, HbA1c, BP_systolic, BP_diastolic).
+ANALYTES: Dict[str, Analyte] = {
+    # Diabetes
+    "RBS": Analyte("Random blood sugar", "lab",
+                   ("random blood sugar", "random blood glucose", "random glucose", "rbs", "grbs",
+                    "blood sugar", "blood glucose", "glucose", "sugar"),
+                   "mg/dL", _GLUCOSE_MMOL, 70, 140, ("<", 35, "mmol/L")),
+    "FBS": Analyte("Fasting blood sugar", "lab",
+                   ("fasting blood sugar", "fasting blood glucose", "fasting plasma glucose", "fasting glucose",
+                    "fbs", "fpg"),
+                   "mg/dL", _GLUCOSE_MMOL, 70, 100, ("<", 35, "mmol/L")),
+    "PPBS": Analyte("Post-prandial blood sugar", "lab",
+                    ("post prandial blood sugar", "postprandial blood sugar", "post-prandial blood sugar",
+                     "post prandial glucose", "ppbs", "pp sugar", "2 hr pp"),
+                    "mg/dL", _GLUCOSE_MMOL, 70, 140, ("<", 35, "mmol/L")),
+    "HbA1c": Analyte("HbA1c", "lab", ("hba1c", "hb a1c", "hb-a1c", "glycated haemoglobin", "glycated hemoglobin",
+                                      "glycosylated hemoglobin", "a1c"),
+                     "%", {"mmol/mol": lambda v: v * 0.0915 + 2.15}, 4.0, 5.6, (">", 20, "mmol/mol")),
+    # Blood counts
+    "Hemoglobin": Analyte("Hemoglobin", "lab", ("haemoglobin", "hemoglobin", "hgb", "hb"),
+                          "g/dL", {"g/L": 0.1, "mmol/L": 1.611}, 12.0, 17.5, (">", 25, "g/L")),
+    "WBC": Analyte("WBC count", "lab",
+                   ("total leucocyte count", "total leukocyte count", "total wbc count", "white blood cells",
+                    "white blood cell count", "white cell count", "wbc count", "wbc", "tlc"),
+                   "/µL", _COUNT_UNITS, 4000, 11000, ("<", 100, "x10^9/L")),
+    "Platelets": Analyte("Platelet count", "lab", ("platelet count", "platelets", "platelet", "plt"),
+                         "/µL", _COUNT_UNITS, 150000, 450000, ("<", 1000, "x10^3/µL")),
+    "RBC": Analyte("RBC count", "lab", ("red blood cells", "rbc count", "rbc"),
+                   "million/µL", {"x10^12/L": 1.0}, 4.2, 5.9),
+    "Hematocrit": Analyte("Hematocrit", "lab", ("haematocrit", "hematocrit", "hct", "pcv"), "%", {}, 36, 52),
+    "MCV": Analyte("MCV", "lab", ("mean corpuscular volume", "mcv"), "fL", {}, 80, 100),
+    "ESR": Analyte("ESR", "lab", ("erythrocyte sedimentation rate", "esr"), "mm/hr", {}, 0, 20),
+    # Kidney function and electrolytes
+    "Creatinine": Analyte("Serum creatinine", "lab", ("serum creatinine", "s. creatinine", "creatinine", "creat"),
+                          "mg/dL", {"µmol/L": 1 / 88.4}, 0.6, 1.3, (">", 20, "µmol/L")),
+    "Urea": Analyte("Blood urea", "lab", ("blood urea", "serum urea", "urea"),
+                    "mg/dL", {"mmol/L": 6.006}, 15, 45),
+    "BUN": Analyte("BUN", "lab", ("blood urea nitrogen", "bun"), "mg/dL", {"mmol/L": 2.801}, 7, 20),
+    "eGFR": Analyte("eGFR", "lab", ("egfr",), "mL/min/1.73m²", {"mL/min": 1.0}, 90, None),
+    "Uric acid": Analyte("Uric acid", "lab", ("serum uric acid", "uric acid"),
+                         "mg/dL", {"µmol/L": 1 / 59.48}, 3.5, 7.2),
+    "Sodium": Analyte("Sodium", "lab", ("serum sodium", "sodium", "na+", "na"),
+                      "mmol/L", {"mEq/L": 1.0}, 135, 145),
+    "Potassium": Analyte("Potassium", "lab", ("serum potassium", "potassium", "k+", "k"),
+                         "mmol/L", {"mEq/L": 1.0}, 3.5, 5.1),
+    "Chloride": Analyte("Chloride", "lab", ("serum chloride", "chloride", "cl-"), "mmol/L", {"mEq/L": 1.0}, 98, 107),
+    "Bicarbonate": Analyte("Bicarbonate", "lab", ("bicarbonate", "hco3", "hco3-"), "mmol/L", {"mEq/L": 1.0}, 22, 29),
+    "Calcium": Analyte("Calcium", "lab", ("serum calcium", "calcium"),
+                       "mg/dL", {"mmol/L": 4.008}, 8.5, 10.5, ("<", 4, "mmol/L")),
+    # Lipids
+    "Total cholesterol": Analyte("Total cholesterol", "lab",
+                                 ("total cholesterol", "serum cholesterol", "cholesterol"),
+                                 "mg/dL", _CHOLESTEROL_MMOL, None, 200, ("<", 20, "mmol/L")),
+    "LDL": Analyte("LDL cholesterol", "lab", ("ldl cholesterol", "ldl-c", "ldl"),
+                   "mg/dL", _CHOLESTEROL_MMOL, None, 100, ("<", 20, "mmol/L")),
+    "HDL": Analyte("HDL cholesterol", "lab", ("hdl cholesterol", "hdl-c", "hdl"),
+                   "mg/dL", _CHOLESTEROL_MMOL, 40, None, ("<", 5, "mmol/L")),
+    "Triglycerides": Analyte("Triglycerides", "lab", ("triglycerides", "triglyceride", "tg"),
+                             "mg/dL", {"mmol/L": 88.57}, None, 150, ("<", 15, "mmol/L")),
+    # Liver function
+    "ALT": Analyte("ALT (SGPT)", "lab", ("alanine aminotransferase", "sgpt", "alt"), "U/L", {"IU/L": 1.0}, 7, 56),
+    "AST": Analyte("AST (SGOT)", "lab", ("aspartate aminotransferase", "sgot", "ast"), "U/L", {"IU/L": 1.0}, 10, 40),
+    "ALP": Analyte("Alkaline phosphatase", "lab", ("alkaline phosphatase", "alp"), "U/L", {"IU/L": 1.0}, 44, 147),
+    "Bilirubin": Analyte("Total bilirubin", "lab", ("total bilirubin", "serum bilirubin", "bilirubin"),
+                         "mg/dL", {"µmol/L": 1 / 17.1}, 0.1, 1.2, (">", 5, "µmol/L")),
+    "Albumin": Analyte("Albumin", "lab", ("serum albumin", "albumin"),
+                       "g/dL", {"g/L": 0.1}, 3.5, 5.0, (">", 10, "g/L")),
+    # Thyroid, inflammation, cardiac, others
+    "TSH": Analyte("TSH", "lab", ("thyroid stimulating hormone", "tsh"), "mIU/L", {"µIU/mL": 1.0}, 0.4, 4.0),
+    "FT4": Analyte("Free T4", "lab", ("free t4", "ft4", "free thyroxine"), "ng/dL", {"pmol/L": 1 / 12.87}, 0.8, 1.8),
+    "CRP": Analyte("CRP", "lab", ("c-reactive protein", "c reactive protein", "crp"), "mg/L", {"mg/dL": 10.0}, None, 10),
+    "Troponin": Analyte("Troponin I", "lab", ("troponin i", "troponin-i", "trop i", "troponin"),
+                        "ng/mL", {"ng/L": 0.001, "pg/mL": 0.001}, None, 0.04),
+    "INR": Analyte("INR", "lab", ("inr",), "", {}, 0.8, 1.2),
+    "Ferritin": Analyte("Ferritin", "lab", ("serum ferritin", "ferritin"), "ng/mL", {"µg/L": 1.0}, 30, 400),
+    "Vitamin D": Analyte("Vitamin D", "lab", ("25-oh vitamin d", "vitamin d3", "vitamin d", "vit d"),
+                         "ng/mL", {"nmol/L": 0.4}, 30, 100),
+    "Vitamin B12": Analyte("Vitamin B12", "lab", ("vitamin b12", "vit b12", "b12"),
+                           "pg/mL", {"pmol/L": 1.355}, 200, 900),
+    # Vital signs
+    "Pulse": Analyte("Pulse", "vital", ("pulse rate", "heart rate", "pulse", "hr"), "bpm", {"/min": 1.0}, 60, 100),
+    "Respiratory rate": Analyte("Respiratory rate", "vital", ("respiratory rate", "resp rate", "rr"),
+                                "/min", {}, 12, 20),
+    "Temperature": Analyte("Temperature", "vital", ("temperature", "temp"),
+                           "°C", {"°F": lambda v: (v - 32) * 5 / 9}, 36.1, 37.5, (">", 50, "°F")),
+    "SpO2": Analyte("SpO2", "vital", ("oxygen saturation", "o2 saturation", "o2 sat", "spo2", "sp o2", "saturation"),
+                    "%", {}, 95, None),
+    "Weight": Analyte("Weight", "vital", ("body weight", "weight", "wt"), "kg", {"lb": 0.4536}, None, None),
+}
+BLOOD_PRESSURE = {
+    "BP_systolic": Analyte("Systolic BP", "vital", (), "mmHg", {}, 90, 139),
+    "BP_diastolic": Analyte("Diastolic BP", "vital", (), "mmHg", {}, 60, 89),
+}
+# Values outside these bounds (canonical unit) are not measurements of the analyte,
+# e.g. "Vit D 60000 IU weekly" is a dose; such matches are dropped, not flagged.
+PLAUSIBLE_RANGES = {
+    "RBS": (10, 2000), "FBS": (10, 2000), "PPBS": (10, 2000), "HbA1c": (2, 25),
+    "Hemoglobin": (2, 25), "WBC": (100, 500000), "Platelets": (1000, 2000000), "RBC": (0.5, 10),
+    "Hematocrit": (5, 80), "MCV": (40, 150), "ESR": (0, 200),
+    "Creatinine": (0.1, 30), "Urea": (2, 500), "BUN": (1, 300), "eGFR": (1, 200), "Uric acid": (0.5, 30),
+    "Sodium": (90, 200), "Potassium": (1, 10), "Chloride": (60, 150), "Bicarbonate": (2, 60), "Calcium": (2, 20),
+    "Total cholesterol": (30, 1000), "LDL": (5, 700), "HDL": (5, 200), "Triglycerides": (10, 10000),
+    "ALT": (1, 20000), "AST": (1, 20000), "ALP": (5, 5000), "Bilirubin": (0, 50), "Albumin": (0.5, 7),
+    "TSH": (0, 200), "FT4": (0.05, 10), "CRP": (0, 600), "Troponin": (0, 500), "INR": (0.5, 15),
+    "Ferritin": (1, 100000), "Vitamin D": (1, 200), "Vitamin B12": (20, 5000),
+    "Pulse": (20, 250), "Respiratory rate": (4, 80), "Temperature": (30, 45), "SpO2": (40, 100),
+    "Weight": (0.5, 400), "BP_systolic": (50, 300), "BP_diastolic": (20, 200),
+}
+# Names that are also ordinary words or letters ("Vitamin K", "sugar free", "HR department"):
+# they only count when followed by ":" / "=" or when the value carries a unit.
+STRICT_ALIASES = frozenset({"k", "na", "hb", "hr", "rr", "tg", "wt", "sugar", "saturation"})
+
+# Units as written -> canonical spelling. Keys are lower-case with spaces removed.
+UNIT_ALIASES = {
+    "mg/dl": "mg/dL", "mg%": "mg/dL", "mgdl": "mg/dL", "g/dl": "g/dL", "gm/dl": "g/dL", "gm%": "g/dL", "g%": "g/dL",
+    "g/l": "g/L", "mmol/l": "mmol/L", "mmol/mol": "mmol/mol", "µmol/l": "µmol/L", "umol/l": "µmol/L",
+    "μmol/l": "µmol/L", "meq/l": "mEq/L", "iu/l": "IU/L", "u/l": "U/L", "%": "%",
+    "/cumm": "/µL", "cells/cumm": "/µL", "/mm3": "/µL", "/µl": "/µL", "/ul": "/µL", "cells/µl": "/µL",
+    "x10^9/l": "x10^9/L", "×10^9/l": "x10^9/L", "10^9/l": "x10^9/L",
+    "x10^3/µl": "x10^3/µL", "x10^3/ul": "x10^3/µL", "10^3/µl": "x10^3/µL", "10^3/ul": "x10^3/µL",
+    "lakh/cumm": "lakh/µL", "lakhs/cumm": "lakh/µL", "lakh/µl": "lakh/µL", "lakhs": "lakh/µL", "lakh": "lakh/µL",
+    "million/cumm": "million/µL", "million/µl": "million/µL", "mill/cumm": "million/µL", "x10^12/l": "x10^12/L",
+    "fl": "fL", "mm/hr": "mm/hr", "mm/1sthr": "mm/hr", "mg/l": "mg/L", "ng/ml": "ng/mL", "ng/l": "ng/L",
+    "pg/ml": "pg/mL", "ng/dl": "ng/dL", "pmol/l": "pmol/L", "nmol/l": "nmol/L", "µg/l": "µg/L", "ug/l": "µg/L",
+    "miu/l": "mIU/L", "µiu/ml": "µIU/mL", "uiu/ml": "µIU/mL", "μiu/ml": "µIU/mL",
+    "ml/min/1.73m2": "mL/min/1.73m²", "ml/min/1.73m²": "mL/min/1.73m²", "ml/min": "mL/min",
+    "bpm": "bpm", "beats/min": "bpm", "/min": "/min", "breaths/min": "/min", "cpm": "/min",
+    "°c": "°C", "c": "°C", "°f": "°F", "f": "°F", "kg": "kg", "kgs": "kg", "lb": "lb", "lbs": "lb", "mmhg": "mmHg",
+}
+
+# Thousands and lakh separators are accepted: "11,200", "2,50,000".
+NUMBER_PATTERN = r"\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+
+
+def _alias_pattern(alias: str) -> str:
+    return r"\s*".join(re.escape(word) for word in alias.split())
+
+
+_ALIAS_TO_KEY = {alias: key for key, analyte in ANALYTES.items() for alias in analyte.aliases}
+# Longest names first, so "hba1c" wins over "hb" and "blood urea nitrogen" over "blood urea".
+_ALIASES = "|".join(_alias_pattern(alias) for alias in sorted(_ALIAS_TO_KEY, key=len, reverse=True))
+_UNIT_PATTERN = "|".join(
+    r"\s*".join(re.escape(ch) for ch in unit) if unit in ("c", "f") else re.escape(unit).replace(r"\ ", r"\s*")
+    for unit in sorted(UNIT_ALIASES, key=len, reverse=True)
+)
+# The text between a name and its value may not cross a "," or ";" (the next entry of a list).
+_SCAN = re.compile(
+    r"(?<![A-Za-z0-9])(?:"
+    r"(?:b\.?p\.?|blood\s+pressure)(?![A-Za-z])[^\d\n,;]{0,15}"
+    r"(?P<systolic>\d{2,3})\s*/\s*(?P<diastolic>\d{2,3})(?:\s*mm\s*hg)?"
+    rf"|(?P<alias>{_ALIASES})(?![A-Za-z])(?P<gap>[^\d\n<>,;]{{0,20}}?)"
+    rf"(?P<value>[<>]=?\s*(?:{NUMBER_PATTERN})|{NUMBER_PATTERN})"
+    rf"(?:\s*(?P<unit>{_UNIT_PATTERN})(?![A-Za-z]))?"
+    r")",
+    re.IGNORECASE,
+)
+_ANOTHER_NAME = re.compile(rf"(?<![A-Za-z0-9])(?:{_ALIASES}|b\.?p\.?)(?![A-Za-z])", re.IGNORECASE)
+# A number followed by one of these is a dose, a multiple or a duration, not a result:
+# "10 mg given", "3x ULN", "for 2 weeks", "12/03/2024".
+_NOT_A_RESULT = re.compile(
+    r"\s*(?:[x×*]|/\s*\d|(?:times|mg|mcg|µg|ug|g|iu|units?|tabs?|tablets?|caps?|ml|doses?|days?|weeks?|wks?"
+    r"|months?|years?|yrs?|hours?|hrs?|mins?)(?![A-Za-z]))",
+    re.IGNORECASE,
+)
+
+
+def parse_number(text: str) -> Optional[float]:
+    """A number written with optional thousands/lakh separators, e.g. "2,50,000"; None if text is not one."""
+    text = text.strip()
+    if not re.fullmatch(NUMBER_PATTERN, text):
+        return None
+    return float(text.replace(",", ""))
+
+
+def range_flag(value: float, low: Optional[float], high: Optional[float]) -> str:
+    """"LOW" below low, "HIGH" above high, "" otherwise; either bound may be None."""
+    if low is not None and value < low:
+        return "LOW"
+    if high is not None and value > high:
+        return "HIGH"
+    return ""
+
+
+def _result(key: str, analyte: Analyte, value: float, match) -> LabResult:
+    return LabResult(key, analyte.label, analyte.category, round(value, 2), analyte.unit,
+                     analyte.low, analyte.high, range_flag(value, analyte.low, analyte.high),
+                     match.group(0), match.start(), match.end())
+
+
+def _plausible(key: str, value: float) -> bool:
+    low, high = PLAUSIBLE_RANGES[key]
+    return low <= value <= high
+
+
+def _to_canonical(key: str, analyte: Analyte, value: float, unit: Optional[str]) -> Optional[float]:
+    """
+    value converted to the analyte's canonical unit; None if the unit does not
+    apply to it or the result is not a plausible value of the analyte.
+    """
+    if unit is None and analyte.guess:
+        operator, threshold, guessed = analyte.guess
+        if (value < threshold) if operator == "<" else (value > threshold):
+            unit = guessed
+    if unit is None or unit == analyte.unit:
+        converted = value
+    else:
+        conversion = analyte.conversions.get(unit)
+        if conversion is None:
+            return None
+        converted = conversion(value) if callable(conversion) else value * conversion
+    return converted if _plausible(key, converted) else None
+
+
+def analyte_key(name: str) -> Optional[str]:
+    """Key of the analyte a test name such as "Serum Creatinine" or "Haemoglobin (Hb)" refers to; None if unknown."""
+    for candidate in (name, name.split("(")[0]):
+        key = _ALIAS_TO_KEY.get(" ".join(candidate.lower().split()))
+        if key:
+            return key
+    return None
+
+
+def to_canonical(key: str, value: float, unit: str = "") -> Optional[float]:
+    """
+    value of analyte key, with unit as written ("mmol/l", "cells/cumm", "" for
+    none), in the analyte's canonical unit. None if the unit is unknown or does
+    not apply, or the value is not plausible.
+    """
+    canonical_unit = UNIT_ALIASES.get("".join(unit.lower().split())) if unit.strip() else None
+    if unit.strip() and canonical_unit is None:
+        return None
+    return _to_canonical(key, ANALYTES[key], value, canonical_unit)
+
+
+def _parse(match, text: str) -> List[LabResult]:
+    """Results of one _SCAN match; empty if the match is not a lab value after all."""
+    if match.group("systolic"):
+        systolic, diastolic = float(match.group("systolic")), float(match.group("diastolic"))
+        if not (_plausible("BP_systolic", systolic) and _plausible("BP_diastolic", diastolic)):
+            return []
+        return [_result("BP_systolic", BLOOD_PRESSURE["BP_systolic"], systolic, match),
+                _result("BP_diastolic", BLOOD_PRESSURE["BP_diastolic"], diastolic, match)]
+
+    alias = " ".join(match.group("alias").lower().split())
+    gap, raw_unit = match.group("gap"), match.group("unit")
+    if _ANOTHER_NAME.search(gap):
+        return []
+    if alias in STRICT_ALIASES and not raw_unit and not gap.strip().startswith((":", "=")):
+        return []
+    if not raw_unit and _NOT_A_RESULT.match(text, match.end()):
+        return []
+    key = _ALIAS_TO_KEY[alias]
+    analyte = ANALYTES[key]
+    unit = UNIT_ALIASES.get("".join(raw_unit.lower().split())) if raw_unit else None
+    value = _to_canonical(key, analyte, parse_number(match.group("value").lstrip("<>=")), unit)
+    return [] if value is None else [_result(key, analyte, value, match)]
+
+
+@lru_cache(maxsize=256)
+def scan(text: str) -> Tuple[LabResult, ...]:
+    """
+    Every lab value and vital sign in text, in order of appearance. Memoized
+    per text, so repeated calls on the same note cost a dictionary lookup.
+    """
+    results = []
+    position = 0
+    while (match := _SCAN.search(text, position)) is not None:
+        found = _parse(match, text)
+        results.extend(found)
+        # A rejected match may have swallowed the next name ("Hb not done WBC 8000"); look again right after its start
+        position = match.end() if found else match.start() + 1
+    return tuple(results)
+
+
+def extract(text: str) -> Dict[str, LabResult]:
+    """First result per analyte key in text; see scan."""
+    found: Dict[str, LabResult] = {}
+    for result in scan(text):
+        found.setdefault(result.key, result)
+    return found
+
+
+def format_result(result: LabResult) -> str:
+    """Value with unit, and the flag when out of range, e.g. "350 mg/dL (HIGH)"."""
+    text = f"{result.value:g} {result.unit}".strip()
+    return f"{text} ({result.flag})" if result.flag else text
@@ -0,0 +1,205 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pdfplumber
+
+from .lab_engine import ANALYTES, NUMBER_PATTERN, analyte_key, parse_number, range_flag, to_canonical
+from .uploads import mapped
+
+# Header keywords for each lab table column, checked in this order.
+COLUMN_KEYWORDS = {
+    "range": ("reference", "ref.", "range", "normal", "interval", "limits"),
+    "unit": ("unit",),
+    "flag": ("flag", "status", "interpretation", "h/l"),
+    "value": ("result", "value", "observed", "reading"),
+    "test": ("test", "investigation", "parameter", "analyte", "examination", "description", "name"),
+}
+# Files with at least this many parsed rows are treated as lab reports.
+MIN_LAB_ROWS = 5
+# Text outside the tables up to this size is not worth an LLM call.
+MAX_RESIDUAL_CHARS = 400
+
+# Numbers may carry thousands and lakh separators ("11,200", "1,50,000"); see lab_engine.
+_NUMBER = rf"[-+]?(?:{NUMBER_PATTERN})"
+_VALUE = re.compile(rf"^\s*[<>]?=?\s*({_NUMBER})\s*(.*)$")
+# A unit printed in the value cell, e.g. "g/dL", "cells/cumm", "x10^9/L", "%"
+_UNIT = re.compile(r"(?=.*[A-Za-z%µμ])[A-Za-z%µμ/][\w/%^.µμ]*")
+_BETWEEN = re.compile(rf"({_NUMBER})\s*(?:-|–|to)\s*({_NUMBER})")
+_BELOW = re.compile(rf"(?:<=?|up\s*to|less\s+than|below)\s*({_NUMBER})", re.IGNORECASE)
+_ABOVE = re.compile(rf"(?:>=?|more\s+than|greater\s+than|above)\s*({_NUMBER})", re.IGNORECASE)
+_QUALITATIVE = re.compile(r"^(positive|negative|reactive|non[- ]?reactive|present|absent|detected|not detected|nil|trace)$",
+                          re.IGNORECASE)
+_HIGH_FLAG = re.compile(r"^\s*(h|high|\*h|↑|critical high)\s*$", re.IGNORECASE)
+_LOW_FLAG = re.compile(r"^\s*(l|low|\*l|↓|critical low)\s*$", re.IGNORECASE)
+
+
+def _clean(cell) -> str:
+    return " ".join(str(cell).split()) if cell else ""
+
+
+def _header_columns(row: List[str]) -> Optional[Dict[str, int]]:
+    """Map column roles to indices if the row looks like a lab table header."""
+    columns: Dict[str, int] = {}
+    for index, cell in enumerate(row):
+        label = cell.lower()
+        if not label or len(label) > 40:
+            continue
+        for role, keywords in COLUMN_KEYWORDS.items():
+            if role not in columns and any(keyword in label for keyword in keywords):
+                columns[role] = index
+                break
+    return columns if "test" in columns and "value" in columns else None
+
+
+def _number(text: str) -> float:
+    sign = -1.0 if text.startswith("-") else 1.0
+    return sign * parse_number(text.lstrip("+-"))
+
+
+def parse_range(text: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Parse a reference range such as "12 - 16", "< 200" or "Up to 5.0" into (low, high).
+    (None, None) if there is no range, or more than one band, as in
+    "Desirable: <200 Borderline: 200-239" or "M: 13-17 F: 12-15".
+    """
+    between = list(_BETWEEN.finditer(text))
+    rest = _BETWEEN.sub(" ", text)
+    below, above = list(_BELOW.finditer(rest)), list(_ABOVE.finditer(rest))
+    if len(between) + len(below) + len(above) != 1:
+        return None, None
+    if between:
+        return _number(between[0].group(1)), _number(between[0].group(2))
+    if below:
+        return None, _number(below[0].group(1))
+    return _number(above[0].group(1)), None
+
+
+def _flag(value: Optional[float], low: Optional[float], high: Optional[float], reported: str) -> str:
+    if _HIGH_FLAG.match(reported):
+        return "HIGH"
+    if _LOW_FLAG.match(reported):
+        return "LOW"
+    if value is None:
+        return ""
+    return range_flag(value, low, high)
+
+
+def _default_flag(test: str, value: float, unit: str) -> str:
+    """Flag against lab_engine's adult reference range, for tests printed without one."""
+    key = analyte_key(test)
+    canonical = to_canonical(key, value, unit) if key else None
+    if canonical is None:
+        return ""
+    return range_flag(canonical, ANALYTES[key].low, ANALYTES[key].high)
+
+
+def _parse_row(row: List[str], columns: Dict[str, int]) -> Optional[Dict]:
+    cell = lambda role: row[columns[role]] if role in columns and columns[role] < len(row) else ""
+    test, raw_value = cell("test"), cell("value")
+    if not test or not raw_value or test.lower() == raw_value.lower():
+        return None
+
+    unit = cell("unit")
+    value = None
+    if match := _VALUE.match(raw_value):
+        value = _number(match.group(1))
+        # Units and flags printed in the value cell, e.g. "13.2 g/dL", "9.8 L"; anything
+        # else means the cell is not a single result ("12/03/2024", "11 200 repeat")
+        trailing = match.group(2).split()
+        if trailing and (_HIGH_FLAG.match(trailing[-1]) or _LOW_FLAG.match(trailing[-1])):
+            trailing = trailing[:-1]
+        trailing = " ".join(trailing)
+        if trailing and not _UNIT.fullmatch(trailing):
+            return None
+        unit = unit or trailing
+    elif not _QUALITATIVE.match(raw_value):
+        return None
+
+    reference = cell("range")
+    low, high = parse_range(reference)
+    # A flag printed next to the value, e.g. "9.8 L"
+    reported = cell("flag") or (raw_value.split()[-1] if len(raw_value.split()) > 1 else "")
+    flag = _flag(value, low, high, reported)
+    # A printed range this can't read (several bands, free text) is left to the LLM
+    ambiguous = bool(value is not None and reference and low is None and high is None and not flag)
+    if value is not None and not reference and not flag:
+        flag = _default_flag(test, value, unit)
+    return {
+        "test": test,
+        "value": raw_value if value is None else match.group(1),
+        "unit": unit,
+        "range": reference,
+        "flag": flag,
+        "ambiguous": ambiguous,
+    }
+
+
+def _rows_from_table(table: List[List]) -> List[Dict]:
+    rows, columns = [], None
+    for raw_row in table:
+        row = [_clean(cell) for cell in raw_row]
+        header = _header_columns(row)
+        if header:
+            columns = header
+            continue
+        if columns and (parsed := _parse_row(row, columns)):
+            rows.append(parsed)
+    return rows
+
+
+def extract_lab_rows(file_path: str) -> List[Dict]:
+    """
+    Extract lab results from a PDF's tables with pdfplumber's table finder.
+    Ruled tables are used when a page has them; otherwise columns are inferred
+    from text alignment. Only rows below a recognized header row are kept.
+
+    Returns:
+        list: {"test", "value", "unit", "range", "flag", "ambiguous"} per result,
+        flag being "HIGH", "LOW" or "" (within range or no range to compare with),
+        and ambiguous True when the printed range could not be read unambiguously.
+    """
+    rows = []
+    with mapped(file_path) as buffer, pdfplumber.open(buffer) as pdf:
+        for page in pdf.pages:
+            page_rows = [row for table in page.extract_tables() for row in _rows_from_table(table)]
+            if not page_rows:
+                page_rows = [row for table in page.extract_tables({"vertical_strategy": "text",
+                                                                   "horizontal_strategy": "text"})
+                             for row in _rows_from_table(table)]
+            rows.extend(page_rows)
+            page.flush_cache()
+    return rows
+
+
+def residual_text(page_contents: List[str], rows: List[Dict]) -> str:
+    """Page text left after dropping the lines the table rows came from."""
+    tests = [row["test"].lower() for row in rows]
+    lines = []
+    for content in page_contents:
+        for line in content.splitlines():
+            stripped = line.strip()
+            if len(stripped) < 4 or any(stripped.lower().startswith(test) for test in tests):
+                continue
+            lines.append(stripped)
+    return "\n".join(lines)
+
+
+def lab_digest(rows: List[Dict]) -> str:
+    """
+    Compact summary of lab rows: every abnormal result, every result whose
+    reference range needs interpreting, and a count of the normal ones.
+    """
+    abnormal = [row for row in rows if row["flag"]]
+    unclear = [row for row in rows if row.get("ambiguous")]
+    lines = [f"Lab results: {len(rows)} tests, {len(abnormal)} outside the reference range."]
+    for row in abnormal + unclear:
+        unit = f" {row['unit']}" if row["unit"] else ""
+        reference = f" (ref {row['range']})" if row["range"] else ""
+        status = row["flag"] or "- compare with the reference range"
+        lines.append(f"- {row['test']}: {row['value']}{unit}{reference} {status}")
+    return "\n".join(lines)
+
+
+def needs_interpretation(rows: List[Dict]) -> bool:
+    """True if any row's reference range could not be read, so its flag is for the LLM to decide."""
+    return any(row.get("ambiguous") for row in rows)
@@ -2,7 +2,8 @@ from langgraph.graph import START,END,StateGraph, MessagesState
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langgraph.constants import Send
-from .hugging_face_ner import  ner_extractor
+from .hugging_face_ner import ner_extractor, NER_BACKEND
+from .section_segmenter import route_note
 from .credentials import creds
 
 from langchain_groq import ChatGroq
@@ -221,6 +222,8 @@ def ner_extraction_validator(state: OverAllState):
     """Perform NER Extraction on medical data."""
     initial_summary = state["initial_summary"]
     medical_report = state.get("medical_report","")
+    # Vitals and labs are parsed by regex; the LLMs only get the rest of the note
+    routed = route_note(initial_summary)
 
     llm_gemini = ChatGoogleGenerativeAI(api_key=os.getenv("GOOGLE_API_KEY"),
                             model="gemini-2.5-flash",
@@ -229,14 +232,16 @@ def ner_extraction_validator(state: OverAllState):
 
     summarized_report = llm_gemini.invoke(
         [SystemMessage(content="Your task is to summarize all the content that is given to you. Leave no medical details out, no matter how small. Output is in text-string format and not markdown, avoid special characters.")]+ 
-        [HumanMessage(content= f"Here is the intial-report of the patient: {initial_summary} and the medical extracts (if any) drawn out {medical_report}")]
+        [HumanMessage(content= f"Here is the intial-report of the patient: {routed.residual} and the medical extracts (if any) drawn out {medical_report}")]
     )
 
     # tagged_tokens, unique_tags = process_ner_output(initial_summary+" "+medical_report)
     # report = generate_clean_ner_report(tagged_tokens, unique_tags)
     try:
         ner_report = ner_extractor(summarized_report.content)
-    except:
+    except Exception as e:
+        # The validator below still extracts entities from the summary on its own
+        print(f"NER extraction failed on the {NER_BACKEND} backend and its fallback: {e!r}")
         ner_report = ""
 
     llm_groq = ChatGroq(
@@ -255,6 +260,12 @@ def ner_extraction_validator(state: OverAllState):
         [SystemMessage(content=ner_validation_agent_sys_instruction)]+[HumanMessage(
             content=f"Validate the NER Report made by hugging face model (if any) : {ner_report}, on the input text of: {summarized_report.content}")]
         )
+    # Vitals and labs left out of the prompts come from the regex parse; they only fill in
+    # what the LLM did not report, never replace its values
+    if routed.vitals:
+        post_ner_data.vital_signs = {**routed.vitals, **(post_ner_data.vital_signs or {})}
+    if routed.labs:
+        post_ner_data.laboratory_values = {**routed.labs, **(post_ner_data.laboratory_values or {})}
 
     
     return {"post_ner_data":post_ner_data}
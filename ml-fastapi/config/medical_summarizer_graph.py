@@ -6,12 +6,20 @@ from langgraph.graph import START,END,StateGraph, MessagesState
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langgraph.constants import Send
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 
 import os
+import shutil
+import tempfile
 from .credentials import creds
+from .boilerplate import strip_boilerplate_from_documents
+from .parse_cache import load_pdf_documents
+from .uploads import UPLOAD_CHUNK_BYTES, UPLOAD_SPOOL_DIR
+from .lab_tables import (MIN_LAB_ROWS, MAX_RESIDUAL_CHARS, extract_lab_rows, lab_digest, needs_interpretation,
+                         residual_text)
+from .doc_classifier import classify_pages
 
 
 class OverAllState(TypedDict):
@@ -69,6 +77,16 @@ Brief single-paragraph summary of abnormalities, ensuring anonymity of the patie
 """
 
 
+# Added to the extraction prompt for the document type found by config.doc_classifier.
+extraction_focus = {
+    "lab_report": "The document is a lab report: focus on test values outside their reference ranges.",
+    "pathology_report": "The document is a pathology report: focus on the specimen, the microscopic findings and the final diagnosis.",
+    "prescription": "The document is a prescription: list the medications with dose and frequency, and any diagnosis noted.",
+    "discharge_summary": "The document is a discharge summary: focus on diagnoses, procedures, key investigations and discharge medications.",
+    "imaging_report": "The document is an imaging report: focus on the modality, body region, findings and impression.",
+}
+
+
 # report_template = """
 # ## Extracted Medical Report
 
@@ -82,16 +100,31 @@ def process_documents(state:OverAllState):
     return {"files": state["files"]}
 
 def should_trigger_edge_for_insights(state: OverAllState):
-    return [Send("extract medical insights", {"file":(file_id,file)}) for file_id,file in state["files"]]
+    # Every upload was dropped as non-medical
+    if not state["files"]:
+        return "draft report"
+    return [Send("extract medical insights", {"file":file}) for file in state["files"]]
 
 def extract_medical_insights(state:DocumentPages):
-    file_id,file = state["file"]
+    # files are (file_id, pages), optionally followed by lab_rows (config.lab_tables)
+    # and the document type (config.doc_classifier)
+    file_id,file,*rest = state["file"]
+    lab_rows = rest[0] if rest else []
+    doc_type = rest[1] if len(rest) > 1 else None
     page_contents=[]
 
     for entry in file:
         page_contents.append(entry.page_content)
 
-    sys_prompt = [SystemMessage(content=detail_extractor_sys_mssg)]
+    if len(lab_rows) >= MIN_LAB_ROWS:
+        # Lab values were read from the tables locally; only the text around them needs the LLM.
+        digest = lab_digest(lab_rows)
+        residual = residual_text(page_contents, lab_rows)
+        if len(residual) <= MAX_RESIDUAL_CHARS and not needs_interpretation(lab_rows):
+            return {"medical_insights":[AIMessage(content=digest)]}
+        page_contents = [digest, residual]
+
+    sys_prompt = [SystemMessage(content=detail_extractor_sys_mssg + extraction_focus.get(doc_type, ""))]
     llm_gemini = ChatGoogleGenerativeAI(api_key=os.getenv("GOOGLE_API_KEY"),
                                 model="gemini-2.5-flash",
                                 credentials=creds,
@@ -104,7 +137,9 @@ def extract_medical_insights(state:DocumentPages):
     return {"medical_insights":[response]}
 
 def draft_report(state:OverAllState):
-    medical_insights = [insight for insight in state["medical_insights"] if insight != "No Medical Details Found"]
+    medical_insights = [insight for insight in state.get("medical_insights", []) if insight != "No Medical Details Found"]
+    if not medical_insights:
+        return {"medical_report": "No medical summary"}
 
     
     sys_prompt =  [SystemMessage(content=report_builder_sys_mssg)]
@@ -168,7 +203,7 @@ builder.add_edge(START,"process files")
 builder.add_conditional_edges(
     "process files",
     should_trigger_edge_for_insights,
-    ["extract medical insights"]
+    ["extract medical insights", "draft report"]
 )
 builder.add_edge("extract medical insights","draft report")
 builder.add_edge("draft report",END)
@@ -183,15 +218,30 @@ medical_insights_graph = builder.compile(
 def trigger_medical_insights_extraction(uploaded_files, thread_id):
     thread = {"configurable": {"thread_id":thread_id}}
     files=[]
+    skipped_files=[]
     for file_id,uploaded_file in enumerate(uploaded_files):
-        with open(uploaded_file.filename, "wb") as f:
-            f.write(uploaded_file.read())
-        # Load and split the PDF into pages.
-        loader = PyPDFLoader(uploaded_file.filename)
-        pages = loader.load_and_split()
-        files.append((file_id,pages))
+        # Copy in chunks to a uniquely named temp file, so concurrent callers don't collide.
+        fd, file_path = tempfile.mkstemp(suffix=".pdf", prefix="upload_", dir=UPLOAD_SPOOL_DIR)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(uploaded_file, f, UPLOAD_CHUNK_BYTES)
+            # Load the PDF into pages (through the page cache), drop repeated headers/footers, then split.
+            pages = load_pdf_documents(file_path, source=uploaded_file.filename)
+            # Files that can't be classified confidently (doc_type None) go through the untyped path.
+            doc_type = classify_pages([page.page_content for page in pages])
+            if doc_type == "non_medical":
+                skipped_files.append(uploaded_file.filename)
+                continue
+            pages = strip_boilerplate_from_documents(pages)
+            lab_rows = extract_lab_rows(file_path) if doc_type in ("lab_report", None) else []
+        finally:
+            os.remove(file_path)
+        pages = RecursiveCharacterTextSplitter().split_documents(pages)
+        files.append((file_id,pages,lab_rows,doc_type))
 
     medical_insights_graph.invoke({"files":files}, thread)
     medical_report = medical_insights_graph.get_state(thread).values.get("medical_report")
+    if skipped_files:
+        medical_report = f"{medical_report}\n\n(skipped non-medical files: {', '.join(skipped_files)})"
 
     return medical_report
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Sentences kept per process; least recently used ones are evicted first.
+NER_CACHE_SIZE = int(os.getenv("NER_CACHE_SIZE", "4096"))
+
+# A sentence ends at ". ", "! " or "? ", at a line break, or at the end of the text.
+_SENTENCE = re.compile(r"\S.*?(?:[.!?](?=\s)|(?=\n)|$)", re.DOTALL)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """(start, end) character spans of the sentences in text, without surrounding whitespace."""
+    return [(match.start(), match.start() + len(match.group().rstrip())) for match in _SENTENCE.finditer(text)]
+
+
+def normalize_sentence(sentence: str) -> Tuple[str, List[int]]:
+    """
+    Collapse whitespace runs inside a sentence to a single space.
+
+    Returns:
+        tuple: (normalized, positions) where positions[i] is the index in the
+        original sentence of character i of the normalized one.
+    """
+    normalized, positions = [], []
+    last = 0
+    for match in _WHITESPACE.finditer(sentence):
+        normalized.append(sentence[last:match.start()])
+        positions.extend(range(last, match.start()))
+        normalized.append(" ")
+        positions.append(match.start())
+        last = match.end()
+    normalized.append(sentence[last:])
+    positions.extend(range(last, len(sentence)))
+    return "".join(normalized), positions
+
+
+def sentence_key(normalized: str, *settings) -> str:
+    """Cache key of a normalized sentence, together with any settings its result depends on."""
+    digest = hashlib.sha1(normalized.encode("utf-8"))
+    for setting in settings:
+        digest.update(f"\x00{setting}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SentenceCache:
+    """Thread-safe LRU map of sentence key -> entities, with hit/miss counters."""
+
+    def __init__(self, max_entries: int = NER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, List[Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[List[Dict]]:
+        with self._lock:
+            entities = self._entries.get(key)
+            if entities is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entities
+
+    def put(self, key: Hashable, entities: List[Dict]):
+        with self._lock:
+            self._entries[key] = entities
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict:
+        """{"hits", "misses", "hit_rate", "entries", "max_entries"} since start or the last clear()."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+def cached_entities(text: str, cache: SentenceCache,
+                    run_sentences: Callable[[List[str]], List[List[Dict]]],
+                    *settings) -> List[Dict]:
+    """
+    Entities of text, running only the sentences not already cached.
+
+    Parameters:
+        cache (SentenceCache): Cache to read and fill.
+        run_sentences (callable): Runs the model over a list of normalized
+            sentences, returning for each a list of entities with "start" and
+            "end" offsets into that sentence.
+        settings: Anything else the result depends on; part of the cache key.
+
+    Returns:
+        list: Entities of the whole text in order, with "start" and "end" offsets
+        into text and "text" set to the original characters they span.
+    """
+    sentences = []
+    for start, end in split_sentences(text):
+        normalized, positions = normalize_sentence(text[start:end])
+        sentences.append((start, normalized, positions, sentence_key(normalized, *settings)))
+
+    found: Dict[str, List[Dict]] = {}
+    missing: Dict[str, str] = {}
+    for _, normalized, _, key in sentences:
+        if key in found or key in missing:
+            continue
+        entities = cache.get(key)
+        if entities is None:
+            missing[key] = normalized
+        else:
+            found[key] = entities
+
+    if missing:
+        for key, entities in zip(missing, run_sentences(list(missing.values()))):
+            cache.put(key, entities)
+            found[key] = entities
+
+    merged = []
+    for start, _, positions, key in sentences:
+        for entity in found[key]:
+            entity_start = start + positions[entity["start"]]
+            entity_end = start + positions[entity["end"] - 1] + 1
+            merged.append({**entity, "start": entity_start, "end": entity_end,
+                           "text": text[entity_start:entity_end]})
+    return merged
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+from pypdf.generic import IndirectObject
+
+from .uploads import mapped
+
+# Bump when extraction changes, so pages cached by an older parser are not reused.
+PARSER_VERSION = "pypdf-1"
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", ".parse_cache")
+# Entries hold extracted patient text: they expire like the vector DBs (15 minutes),
+# and the oldest are removed first once the directory outgrows the cap.
+PARSE_CACHE_TTL_SECONDS = int(os.getenv("PARSE_CACHE_TTL_SECONDS", str(15 * 60)))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Writes prune the directory at most this often.
+PRUNE_INTERVAL_SECONDS = 60
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def file_digest(file_path: str) -> str:
+    """sha256 of a file on disk, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_object(obj, digest, seen: Dict) -> None:
+    """
+    Feed a PDF object and everything it references into digest: dictionary keys
+    and values, arrays, and the raw (still encoded) bytes of streams such as font
+    programs, ToUnicode maps and images. Object numbers are left out; an object
+    reached a second time is recorded by the order it was first reached in.
+    """
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref in seen:
+            digest.update(f"@{seen[ref]}".encode())
+            return
+        seen[ref] = len(seen)
+        obj = obj.get_object()
+    if isinstance(obj, dict):
+        digest.update(b"<<")
+        for key in sorted(obj):
+            # /Parent leads back up the page tree, out of this page
+            if key == "/Parent":
+                continue
+            digest.update(str(key).encode())
+            _hash_object(dict.__getitem__(obj, key), digest, seen)
+        digest.update(b">>")
+        data = getattr(obj, "_data", None)
+        if data:
+            digest.update(data if isinstance(data, bytes) else str(data).encode())
+    elif isinstance(obj, list):
+        digest.update(b"[")
+        for item in obj:
+            _hash_object(item, digest, seen)
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode())
+
+
+def page_hash(page) -> str:
+    """
+    Hash of what a pypdf page draws: its content stream, its size and rotation,
+    and its whole resource tree (fonts with their encodings, ToUnicode maps and
+    embedded programs, images, form XObjects). Object numbers are left out, so
+    the same page in a regenerated file hashes the same.
+    """
+    digest = hashlib.sha256(PARSER_VERSION.encode())
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    digest.update(repr([float(x) for x in page.mediabox]).encode())
+    digest.update(repr(page.get("/Rotate", 0)).encode())
+    resources = dict.get(page, "/Resources")
+    if resources is not None:
+        _hash_object(resources, digest, {})
+    return digest.hexdigest()
+
+
+def _path(kind: str, key: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, kind, key[:2], f"{key}.json")
+
+
+def _read(kind: str, key: str) -> Optional[Dict]:
+    """The entry under key, or None if there is none or it has expired."""
+    path = _path(kind, key)
+    try:
+        if time.time() - os.path.getmtime(path) > PARSE_CACHE_TTL_SECONDS:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(kind: str, key: str, value: Dict):
+    _maybe_prune()
+    path = _path(kind, key)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    # Write then rename, so concurrent readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def prune_cache(now: Optional[float] = None):
+    """Remove expired entries, then the oldest ones while the directory is over PARSE_CACHE_MAX_BYTES."""
+    now = now or time.time()
+    entries = []
+    for root, _, names in os.walk(PARSE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > PARSE_CACHE_TTL_SECONDS:
+                    os.remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= PARSE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _maybe_prune():
+    global _last_prune
+    now = time.time()
+    with _prune_lock:
+        if now - _last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        _last_prune = now
+    prune_cache(now)
+
+
+def clear_cache():
+    """Remove the whole cache directory, e.g. at startup."""
+    shutil.rmtree(PARSE_CACHE_DIR, ignore_errors=True)
+
+
+def load_pdf_documents(file_path: str, source: Optional[str] = None,
+                       file_sha: Optional[str] = None) -> List[Document]:
+    """
+    Load a PDF into one Document per page, like PyPDFLoader(file_path).load(),
+    through a content-addressed page cache shared by every upload endpoint.
+
+    Page texts are stored once, keyed by page hash. A re-upload of the same file
+    (matched by the sha256 of its bytes) is served without opening it, and a file
+    with a few pages changed only extracts those pages. The file is read through
+    a memory map rather than copied into memory.
+
+    Parameters:
+        source (str): Value for the "source" metadata; defaults to file_path.
+        file_sha (str): sha256 of the file when already known (e.g. from spool_upload).
+
+    Returns:
+        list: Documents with metadata {"source", "page"}, page being 0-based.
+    """
+    source = source or file_path
+    file_sha = file_sha or file_digest(file_path)
+
+    with mapped(file_path) as buffer:
+        reader = None
+        manifest = _read("files", file_sha)
+        if manifest is None:
+            reader = PdfReader(buffer)
+            hashes = [page_hash(page) for page in reader.pages]
+            _write("files", file_sha, {"pages": hashes})
+        else:
+            hashes = manifest["pages"]
+
+        documents = []
+        for index, key in enumerate(hashes):
+            cached = _read("pages", key)
+            if cached is None:
+                if reader is None:
+                    reader = PdfReader(buffer)
+                cached = {"text": reader.pages[index].extract_text() or ""}
+                _write("pages", key, cached)
+            documents.append(Document(page_content=cached["text"], metadata={"source": source, "page": index}))
+    return documents
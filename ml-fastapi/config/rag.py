@@ -1,19 +1,33 @@
-from typing import List, TypedDict,Literal
+from typing import List, TypedDict,Literal,Optional
 from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import  BaseModel, Field
 from langgraph.graph import START,END,StateGraph
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 import chromadb
 import chromadb.utils.embedding_functions as embedding_functions
 import os
+import threading
 from .credentials import creds
+from .answer_cache import embed_question, current_generation, lookup_answer, store_answer
+from .summary_index import get_summary_collection, section_filter
+
+# Drafts started alongside the relevance check (speculative mode).
+SPECULATION_WORKERS = 4
+_speculation_executor = ContextThreadPoolExecutor(max_workers=SPECULATION_WORKERS)
+# One slot per worker, held until the draft finishes: a discarded draft still runs to the end.
+_speculation_slots = threading.BoundedSemaphore(SPECULATION_WORKERS)
 
 class Query(BaseModel):
     query:str
 
 class QueryList(BaseModel):
     queries: List[Query]
+    scope: Literal["broad","specific"] = Field(
+        "specific",
+        description="'broad' if the question asks about the documents as a whole (summary, overall course), 'specific' if it asks for particular details."
+    )
 
 class Relevance(BaseModel):
     isRelevant:Literal["yes","no"]
@@ -31,6 +45,13 @@ class OverAllState(TypedDict):
     allowed_call_count:int 
     expired_call_count:int
     answer: str
+    question_embedding: Optional[List[float]]
+    cache_generation: int
+    pinned_generation: Optional[int]  # set by background precomputation: the generation it was scheduled for
+    cache_hit: bool
+    speculative_drafting: bool
+    speculative_answer: str
+    summary_hits: List[dict]
 
 frame_queries_sys_instruction="""
 You are an expert in data retrieval and query generation for vector databases.
@@ -41,6 +62,7 @@ Guidelines:
 - Avoid redundancy; each query should retrieve distinct but related information.
 - If necessary, reformulate the queries to handle ambiguous or incomplete user inputs.
 - Structure the queries to optimize retrieval efficiency in vector search.
+- Set scope to "broad" when the question is about the documents as a whole (e.g. a summary or the overall course), otherwise "specific".
 
 In case your queries were not relevant, you will be given a suggestion.
 Following is some editorial suggestion (if any): {suggestion}
@@ -88,6 +110,34 @@ Reply like a chatbot, strictly in markdown format, but ONLY markdown not in "```
 
 """
 
+def lookup_cached_answer(state: OverAllState):
+    """Serve the answer of a near-identical previous question on the same collection, if any."""
+    # A precomputation run keeps the generation it was scheduled for, so answers drawn from a
+    # collection replaced mid-run are not stored under the new generation.
+    generation = state.get("pinned_generation")
+    if generation is None:
+        generation = current_generation(state["collection_path"])
+    try:
+        embedding = embed_question(state["question"], state["gemini_api"])
+    except Exception as e:
+        print(f"Answer cache skipped, question embedding failed: {e}")
+        return {"question_embedding": None, "cache_generation": generation, "cache_hit": False, "summary_hits": []}
+
+    cached_answer = lookup_answer(state["collection_path"], embedding)
+    if cached_answer is None:
+        return {"question_embedding": embedding, "cache_generation": generation, "cache_hit": False, "summary_hits": []}
+
+    return {"question_embedding": embedding,
+            "cache_generation": generation,
+            "cache_hit": True,
+            "answer": cached_answer,
+            "summary_hits": []}
+
+def should_trigger_edge_for_cache(state: OverAllState):
+    if state["cache_hit"]:
+        return END
+    return "frame queries"
+
 def frame_queries(state: OverAllState):
     question = state["question"]
     
@@ -121,19 +171,29 @@ def retrieve_docs(state: OverAllState):
     collection=chroma_client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=google_ef)
 
 
+    summary_hits = state.get("summary_hits") or []
+    if summary_hits:
+        # The summaries were not enough: descend into the chunks of the sections they cover.
+        results = collection.query(query_texts=queries_list,n_results=5,where=section_filter(summary_hits))
+        return {"docs_retrieved":results["documents"], "summary_hits": []}
+
+    summaries = get_summary_collection(chroma_client, COLLECTION_NAME, google_ef)
+    if summaries is not None and state["queries"].scope == "broad":
+        # Broad questions on large uploads are answered from section/document summaries first.
+        results = summaries.query(query_texts=queries_list,n_results=3)
+        hits = list({(m["source"], m["page_start"]): m for metas in results["metadatas"] for m in metas}.values())
+        return {"docs_retrieved":results["documents"], "summary_hits": hits}
+
     results = collection.query(query_texts=queries_list,n_results=5)
     docs = results["documents"]
 
     # print(f"Try Number: {state["expired_call_count"]-1}, docs lenght: {len(docs_cummulative)}")
     return {"docs_retrieved":docs}
 
-def check_relevance(state: OverAllState):
-    if not state["docs_retrieved"]:
-        return {"relevance": "no"}
-
+def relevance_of(question: str, docs) -> Literal["yes","no"]:
     sys_prompt = [SystemMessage(content=relevance_checker_sys_instruction.format(
-        question= state["question"],
-        docs = state.get("docs_retrieved","")
+        question= question,
+        docs = docs
     ))]
     llm_gemini = ChatGoogleGenerativeAI(api_key=os.getenv("GOOGLE_API_KEY"),
                                 model="gemini-2.5-flash",
@@ -146,7 +206,39 @@ def check_relevance(state: OverAllState):
         content=f"Check for relevance of the documents"
     )])
     # print(response)
-    return {"relevance":response.isRelevant}
+    return response.isRelevant
+
+def check_relevance(state: OverAllState):
+    if not state["docs_retrieved"]:
+        return {"relevance": "no", "speculative_answer": ""}
+
+    # Speculation is skipped when every worker is busy, rather than queueing the draft
+    # behind others (some possibly already discarded) and ending up slower than the plain path.
+    if not state.get("speculative_drafting") or not _speculation_slots.acquire(blocking=False):
+        return {"relevance": relevance_of(state["question"], state["docs_retrieved"]),
+                "speculative_answer": ""}
+
+    # Speculative mode: draft from the retrieved docs while relevance is being checked,
+    # so the common relevant path saves one full LLM round trip.
+    try:
+        draft = _speculation_executor.submit(generate_answer, state["question"], state["docs_retrieved"])
+    except Exception:
+        _speculation_slots.release()
+        raise
+    draft.add_done_callback(lambda _: _speculation_slots.release())
+    relevance = relevance_of(state["question"], state["docs_retrieved"])
+
+    if relevance != "yes":
+        # Not usable; the draft can't be stopped once running and is discarded when it finishes.
+        return {"relevance": relevance, "speculative_answer": ""}
+
+    try:
+        speculative_answer = draft.result()
+    except Exception as e:
+        print(f"Speculative draft failed, drafting again: {e}")
+        speculative_answer = ""
+
+    return {"relevance": relevance, "speculative_answer": speculative_answer}
 
 def should_trigger_edge_for_drafting(state: OverAllState):
     if state["relevance"]=="yes" or state["expired_call_count"]>state["allowed_call_count"]:
@@ -157,15 +249,10 @@ def should_trigger_edge_for_drafting(state: OverAllState):
     return "frame queries"
 
 
-def draft_answer(state: OverAllState):
-    # print("Drafted Answer")
-    # print(state["relevance"])
-    if state["relevance"]=="no":
-        return {"answer":"No answer can be generated, documents related to question was not there in the vector database. Please re-try with a relevant query or upload relevant documents and try again."}
-    
+def generate_answer(question: str, docs) -> str:
     sys_prompt= [SystemMessage(content=answer_generation_sys_instruction.format(
-        question = state["question"],
-        docs = state["docs_retrieved"]
+        question = question,
+        docs = docs
     ))]
     llm_gemini = ChatGoogleGenerativeAI(api_key=os.getenv("GOOGLE_API_KEY"),
                                 model="gemini-2.5-flash",
@@ -174,17 +261,45 @@ def draft_answer(state: OverAllState):
 
     response = llm_gemini.invoke(sys_prompt+[HumanMessage(content="Draft the answer")])
 
-    return {"answer":response.content}
+    return response.content
+
+# Returned instead of an answer when the retrieved documents don't cover the question.
+NO_ANSWER = "No answer can be generated, documents related to question was not there in the vector database. Please re-try with a relevant query or upload relevant documents and try again."
+
+def draft_answer(state: OverAllState):
+    # print("Drafted Answer")
+    # print(state["relevance"])
+    if state["relevance"]=="no":
+        return {"answer":NO_ANSWER}
+
+    if state.get("speculative_answer"):
+        return {"answer": state["speculative_answer"]}
+
+    return {"answer": generate_answer(state["question"], state["docs_retrieved"])}
+
+def cache_answer(state: OverAllState):
+    """Remember answers drafted from relevant documents for similar follow-up questions."""
+    if state["relevance"]=="yes" and state.get("question_embedding"):
+        store_answer(state["collection_path"], state["cache_generation"],
+                     state["question_embedding"], state["question"], state["answer"])
+    return {}
 
 
 builder = StateGraph(OverAllState)
 
+builder.add_node("lookup cached answer", lookup_cached_answer)
 builder.add_node("frame queries", frame_queries)
 builder.add_node("retrieve docs", retrieve_docs)
 builder.add_node("check relevance", check_relevance)
 builder.add_node("draft answer", draft_answer )
+builder.add_node("cache answer", cache_answer)
 
-builder.add_edge(START, "frame queries")
+builder.add_edge(START, "lookup cached answer")
+builder.add_conditional_edges(
+    "lookup cached answer",
+    should_trigger_edge_for_cache,
+    ["frame queries", END]
+)
 builder.add_edge("frame queries", "retrieve docs")
 builder.add_edge("retrieve docs","check relevance")
 builder.add_conditional_edges(
@@ -192,6 +307,7 @@ builder.add_conditional_edges(
     should_trigger_edge_for_drafting,
     ["draft answer","frame queries"]
 )
-builder.add_edge("draft answer", END)
+builder.add_edge("draft answer", "cache answer")
+builder.add_edge("cache answer", END)
 memory = MemorySaver()
 rag_graph = builder.compile(checkpointer=memory)
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from typing import Dict, List
+
+import chromadb
+import chromadb.utils.embedding_functions as embedding_functions
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import BaseModel
+
+from .credentials import creds
+from .rag import NO_ANSWER, Query, generate_answer, relevance_of
+from .answer_cache import current_generation, lookup_answer, store_answer
+
+
+class QuestionQueries(BaseModel):
+    question_index: int
+    queries: List[Query]
+
+class BatchQueryList(BaseModel):
+    questions: List[QuestionQueries]
+
+
+batch_frame_queries_sys_instruction = """
+You are an expert in data retrieval and query generation for vector databases.
+You are given a numbered list of user questions about the same set of documents. For EACH question,
+frame {max_queries} optimized queries that maximize relevant information retrieval.
+
+Guidelines:
+- Return one entry per question, using the question's number as question_index.
+- Ensure the queries are semantically diverse while staying relevant to their question.
+- Avoid redundancy; each query should retrieve distinct but related information.
+- If necessary, reformulate the queries to handle ambiguous or incomplete user inputs.
+"""
+
+
+def frame_queries_batch(questions: List[str], max_queries: int) -> List[List[str]]:
+    """
+    Frame retrieval queries for every question in one structured LLM call.
+    A question the model skipped is searched with its own text.
+    """
+    llm_gemini = ChatGoogleGenerativeAI(api_key=os.getenv("GOOGLE_API_KEY"),
+                                model="gemini-2.5-flash",
+                                credentials=creds
+                                )
+    structured_llm = llm_gemini.with_structured_output(BatchQueryList)
+
+    numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions))
+    response = structured_llm.invoke(
+        [SystemMessage(content=batch_frame_queries_sys_instruction.format(max_queries=max_queries))]
+        + [HumanMessage(content=f"User questions are as follows:\n{numbered}")]
+    )
+
+    framed: Dict[int, List[str]] = {}
+    for entry in response.questions:
+        queries = [query.query for query in entry.queries if query.query.strip()]
+        if 0 <= entry.question_index < len(questions) and queries:
+            framed[entry.question_index] = queries[:max_queries]
+
+    return [framed.get(i, [question]) for i, question in enumerate(questions)]
+
+
+def retrieve_batch(collection_name: str, gemini_api: str, queries_per_question: List[List[str]],
+                   n_results: int = 5) -> List[List[str]]:
+    """
+    Embed every query in one request, search the collection once, then fetch each
+    unique chunk a single time however many questions it serves.
+
+    Returns:
+        list: The retrieved chunk texts of each question, in question order.
+    """
+    google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=gemini_api)
+    chroma_client = chromadb.PersistentClient(path=".chroma")
+    collection = chroma_client.get_or_create_collection(name=collection_name, embedding_function=google_ef)
+
+    flat_queries = [query for queries in queries_per_question for query in queries]
+    embeddings = google_ef(flat_queries)
+    results = collection.query(query_embeddings=embeddings, n_results=n_results, include=[])
+
+    ids_per_question = []
+    offset = 0
+    for queries in queries_per_question:
+        ids = []
+        for hit_ids in results["ids"][offset:offset + len(queries)]:
+            ids.extend(chunk_id for chunk_id in hit_ids if chunk_id not in ids)
+        ids_per_question.append(ids)
+        offset += len(queries)
+
+    unique_ids = list(dict.fromkeys(chunk_id for ids in ids_per_question for chunk_id in ids))
+    if not unique_ids:
+        return [[] for _ in queries_per_question]
+    chunks = collection.get(ids=unique_ids, include=["documents"])
+    text_by_id = dict(zip(chunks["ids"], chunks["documents"]))
+
+    return [[text_by_id[chunk_id] for chunk_id in ids if chunk_id in text_by_id] for ids in ids_per_question]
+
+
+async def answer_questions(questions: List[str], collection_name: str, gemini_api: str, max_queries: int = 3):
+    """
+    Answer several questions about one upload, yielding each result as soon as it is ready.
+
+    Questions close to an earlier one on the same collection are answered from the
+    semantic answer cache straight away. The rest share a single query-framing call,
+    a single embedding request and a single retrieval pass, and are drafted concurrently.
+    Each draft runs alongside a relevance check, as in /ragSearch's speculative mode;
+    when the documents aren't relevant the standard no-answer message is returned
+    instead, and nothing is cached. A question whose drafting fails yields an error
+    result without ending the batch.
+
+    Yields:
+        dict: {"index", "question", "answer", "cached"}, plus "error" when drafting failed
+    """
+    generation = current_generation(collection_name)
+    google_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=gemini_api)
+    try:
+        question_embeddings = [[float(x) for x in e] for e in await asyncio.to_thread(google_ef, questions)]
+    except Exception as e:
+        print(f"Answer cache skipped, question embedding failed: {e}")
+        question_embeddings = [None] * len(questions)
+
+    pending = []
+    for index, question in enumerate(questions):
+        cached_answer = None
+        if question_embeddings[index] is not None:
+            cached_answer = lookup_answer(collection_name, question_embeddings[index])
+        if cached_answer is None:
+            pending.append(index)
+        else:
+            yield {"index": index, "question": question, "answer": cached_answer, "cached": True}
+
+    if not pending:
+        return
+
+    pending_questions = [questions[i] for i in pending]
+    queries_per_question = await asyncio.to_thread(frame_queries_batch, pending_questions, max_queries)
+    docs_per_question = await asyncio.to_thread(retrieve_batch, collection_name, gemini_api, queries_per_question)
+
+    async def draft(index: int, docs: List[str]):
+        result = {"index": index, "question": questions[index], "answer": NO_ANSWER, "cached": False}
+        if not docs:
+            return result
+        try:
+            answer, relevance = await asyncio.gather(asyncio.to_thread(generate_answer, questions[index], docs),
+                                                     asyncio.to_thread(relevance_of, questions[index], docs))
+        except Exception as e:
+            print(f"Batch answer failed for question {index}: {e}")
+            return {**result, "answer": None, "error": str(e)}
+        if relevance == "yes":
+            result["answer"] = answer
+            if question_embeddings[index] is not None:
+                store_answer(collection_name, generation, question_embeddings[index], questions[index], answer)
+        return result
+
+    drafts = [draft(index, docs) for index, docs in zip(pending, docs_per_question)]
+    for finished in asyncio.as_completed(drafts):
+        yield await finished
@@ -0,0 +1,174 @@
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+from .lab_engine import UNIT_ALIASES, format_result, scan
+
+# Header wording per section. A header starts a line and is followed by ":" or " -",
+# or stands on a line of its own, so the same words inside prose are not headers.
+SECTION_HEADERS = {
+    "hpi": r"history of (?:the )?present(?:ing)? illness|hpi|presenting complaints?|chief complaints?|c/o|complaints?",
+    "history": r"past (?:medical |surgical )?history|pmh|medical history|family history|social history|history",
+    "exam": r"(?:physical |general |systemic |clinical )?examination|exam|on examination|o/e|clinical findings",
+    "vitals": r"vitals?(?: signs)?|vital parameters",
+    "labs": r"lab(?:oratory|s)?(?: results| values| findings| investigations| reports?)?|investigations|blood tests?",
+    "medications": r"(?:current |home |discharge )?medications?|meds|drug history|treatment given|rx",
+    "plan": r"(?:assessment and |management )?plan|a/p|management|advice|recommendations?|follow[- ]?up",
+}
+# Sections whose text goes to NER; vitals and labs are parsed by regex and the plan
+# holds future actions, not findings.
+NER_SECTIONS = ("other", "hpi", "history", "exam", "medications")
+# Sections parsed by regex; the values a regex parses are left out of the residual text.
+REGEX_SECTIONS = ("vitals", "labs")
+
+_HEADER = re.compile(
+    r"^[ \t]*(?:#+[ \t]*)?(?:" + "|".join(f"(?P<{name}>{pattern})" for name, pattern in SECTION_HEADERS.items())
+    + r")[ \t]*(?::|-(?=\s)|(?=\n)|$)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# "Test: value unit" entries; a line may hold several, separated by "," or ";". The unit is
+# required, so dates, times and counts ("Collected on 12/03/2024 at 08:30") are not lab values.
+_LAB_ENTRY = re.compile(
+    r"(?P<test>[A-Za-z][A-Za-z0-9 ()/%.+-]{0,40}?)\s*(?::|=|-|\s)\s*"
+    r"(?P<value>[<>]?=?\s*(?:\d{1,3}(?:,\d{2,3})+|\d+)(?:\.\d+)?)"
+    r"\s*(?P<unit>%|[a-zA-Zµμ]+/[a-zA-Zµμ0-9.^]+|[a-zA-Zµμ]+)(?![\w/:])",
+)
+# Unit words that make a generic entry a lab value, besides the spellings lab_engine knows
+_LAB_UNIT_WORDS = {"iu", "u", "units", "pg", "fl", "meq", "ratio"}
+
+
+class Section(NamedTuple):
+    name: str          # key of SECTION_HEADERS, or "other" for text before the first header
+    header_start: int  # where the header line starts (== start for "other")
+    start: int         # section text is note[start:end]
+    end: int
+
+
+class RoutedNote(NamedTuple):
+    sections: Dict[str, str]   # section name -> its text, repeated sections joined
+    vitals: Dict[str, str]     # e.g. {"Blood pressure": "140/90 mmHg"}
+    labs: Dict[str, str]       # e.g. {"Hemoglobin": "9.2 g/dL"}
+    ner_text: str              # text of NER_SECTIONS
+    residual: str              # the note without the values the regexes parsed
+
+
+def segment(text: str) -> List[Section]:
+    """Split a note at its section headers; text before the first header is "other"."""
+    sections = []
+    name, header_start, start = "other", 0, 0
+    for match in _HEADER.finditer(text):
+        if start < match.start() or name != "other":
+            sections.append(Section(name, header_start, start, match.start()))
+        name, header_start, start = match.lastgroup, match.start(), match.end()
+    if start < len(text) or name != "other":
+        sections.append(Section(name, header_start, start, len(text)))
+    return [section for section in sections if section.name != "other" or text[section.start:section.end].strip()]
+
+
+def extract_vitals(text: str) -> Tuple[Dict[str, str], List[Tuple[int, int]]]:
+    """
+    Vital signs in text, in canonical units (see lab_engine).
+
+    Returns:
+        tuple: ({label: value with unit}, [(start, end) of each match]).
+    """
+    vitals, spans = {}, []
+    systolic = None
+    for result in scan(text):
+        if result.category != "vital":
+            continue
+        # scan yields the diastolic value right after the systolic one of the same reading
+        if result.key == "BP_systolic":
+            systolic = result.value
+        elif result.key == "BP_diastolic":
+            vitals["Blood pressure"] = f"{systolic:g}/{result.value:g} mmHg"
+        else:
+            vitals[result.label] = format_result(result)
+        spans.append((result.start, result.end))
+    return vitals, spans
+
+
+def extract_labs(text: str) -> Tuple[Dict[str, str], List[Tuple[int, int]]]:
+    """
+    Lab entries in text. Analytes lab_engine knows are converted to canonical
+    units and flagged against their reference range; any other "Test: value unit"
+    entry is kept as written.
+
+    Returns:
+        tuple: ({test: value with unit}, [(start, end) of each entry]).
+    """
+    labs, spans = {}, []
+    for result in scan(text):
+        if result.category == "lab":
+            labs.setdefault(result.label, format_result(result))
+            spans.append((result.start, result.end))
+    known = list(spans)
+    for match in _LAB_ENTRY.finditer(text):
+        test = match.group("test").strip(" -:")
+        unit = match.group("unit")
+        if not test or any(start < match.end() and stop > match.start() for start, stop in known):
+            continue
+        if not _is_lab_unit(unit):
+            continue
+        value = " ".join(match.group("value").split())
+        labs[test] = f"{value} {unit}".strip()
+        spans.append(match.span())
+    return labs, spans
+
+
+def _is_lab_unit(unit: str) -> bool:
+    unit = unit.lower()
+    return "/" in unit or unit == "%" or unit in UNIT_ALIASES or unit in _LAB_UNIT_WORDS
+
+
+def _unparsed_text(text: str, spans: List[Tuple[int, int]]) -> str:
+    """
+    text without the spans the regexes parsed. Whatever else a line says (a
+    reference range, a comment) is kept; lines left with only separators are dropped.
+    """
+    kept, position = [], 0
+    for start, stop in sorted(spans):
+        if start >= position:
+            kept.append(text[position:start])
+        position = max(position, stop)
+    kept.append(text[position:])
+    lines = [" ".join(line.split()).strip(" ,;") for line in "".join(kept).splitlines()]
+    return "\n".join(line for line in lines if any(ch.isalnum() for ch in line))
+
+
+def route_note(text: str) -> RoutedNote:
+    """
+    Segment a note and send each section to the cheapest adequate extractor:
+    regexes for vitals and labs, NER for history-like sections, and the LLM
+    for whatever is left (RoutedNote.residual): the other sections whole, and
+    the vitals and lab sections without the values the regexes parsed. Vital
+    signs written in prose outside a vitals section are picked up too, but
+    their text stays in the residual.
+    """
+    sections: Dict[str, List[str]] = {}
+    vitals, _ = extract_vitals(text)
+    labs: Dict[str, str] = {}
+    ner_parts, residual_parts = [], []
+
+    for section in segment(text):
+        body = text[section.start:section.end]
+        sections.setdefault(section.name, []).append(body.strip())
+        if section.name in NER_SECTIONS:
+            ner_parts.append(body.strip())
+
+        if section.name in REGEX_SECTIONS:
+            found, spans = extract_vitals(body) if section.name == "vitals" else extract_labs(body)
+            (vitals if section.name == "vitals" else labs).update(found)
+            left = _unparsed_text(body, spans)
+            if left.strip():
+                residual_parts.append(text[section.header_start:section.start] + "\n" + left.strip())
+        else:
+            residual_parts.append(text[section.header_start:section.end].strip())
+
+    return RoutedNote(
+        sections={name: "\n".join(parts) for name, parts in sections.items()},
+        vitals=vitals,
+        labs=labs,
+        ner_text="\n\n".join(part for part in ner_parts if part),
+        residual="\n\n".join(part for part in residual_parts if part),
+    )
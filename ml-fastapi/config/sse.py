@@ -0,0 +1,62 @@
+import json
+
+# Graph nodes that write reports; their LLM output is streamed to the client token by token.
+STREAMED_REPORT_NODES = {
+    "write NER report",        # ner_report_builder_node
+    "write prelim report",     # prelim_report_builder_node
+    "write best practises report",  # best_pracs_report_builder_node
+    "draft answer",            # rag draft_answer
+    "draft report",            # medical insights draft_report
+}
+
+# State fields holding a finished report, sent in one piece when a node produced it
+# without a streamed LLM call (e.g. a cached or speculatively drafted answer).
+REPORT_FIELDS = ("ner_report", "prelim_report", "best_practise_report", "answer", "medical_report")
+
+# Modes to pass to graph.stream(..., stream_mode=STREAM_MODES)
+STREAM_MODES = ["updates", "messages"]
+
+
+def token_event(node_name: str, content: str) -> str:
+    """
+    Format report text as a named SSE event. Clients listening only for plain
+    `data:` messages keep receiving just the node names.
+    """
+    return f"event: token\ndata: {json.dumps({'node': node_name, 'content': content})}\n\n"
+
+
+def answer_event(result: dict) -> str:
+    """Format one finished answer of a batch RAG request as a named SSE event."""
+    return f"event: answer\ndata: {json.dumps(result)}\n\n"
+
+
+def graph_events(stream, node_prefix: str = ""):
+    """
+    Turn a graph.stream(..., stream_mode=STREAM_MODES) iterator into SSE lines.
+
+    Yields:
+        `event: token` events with report tokens as they are generated, and the usual
+        `data: {node_prefix}{node_name}` event once each node completes.
+    """
+    streamed_nodes = set()
+    for mode, chunk in stream:
+        if mode == "messages":
+            message, metadata = chunk
+            node_name = metadata.get("langgraph_node")
+            if node_name in STREAMED_REPORT_NODES and isinstance(message.content, str) and message.content:
+                streamed_nodes.add(node_name)
+                yield token_event(node_name, message.content)
+            continue
+
+        node_name = next(iter(chunk.keys()))
+        update = chunk[node_name]
+        if node_name not in streamed_nodes and isinstance(update, dict):
+            for field in REPORT_FIELDS:
+                if isinstance(update.get(field), str) and update[field]:
+                    yield token_event(node_name, update[field])
+        yield f"data: {node_prefix}{node_name}\n\n"
+
+
+def skipped_event(filenames: list) -> str:
+    """Format the uploads that were left out as non-medical as a named SSE event."""
+    return f"event: skipped\ndata: {json.dumps(filenames)}\n\n"
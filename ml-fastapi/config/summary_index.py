@@ -0,0 +1,134 @@
+import os
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from .credentials import creds
+
+# Consecutive chunks of one file summarized together into a section node.
+SECTION_SIZE = 8
+# Files with fewer chunks than this are small enough to be answered from raw chunks alone.
+MIN_CHUNKS_FOR_SUMMARY = 16
+# Section summaries written concurrently at ingestion.
+MAX_CONCURRENT_SUMMARIES = 8
+
+section_summary_sys_instruction = """
+You are an expert in summarizing medical documents for later retrieval.
+Summarize the given consecutive pages of a patient document. Keep every diagnosis, key lab value
+(with units and whether it is abnormal), medication, procedure and date. Leave out addresses,
+boilerplate and formatting. Output plain text, at most 200 words.
+"""
+
+document_summary_sys_instruction = """
+You are an expert in summarizing medical documents for later retrieval.
+You are given the section summaries of one patient document, in order. Write an overview of the
+whole document: its type, the main diagnoses, significant abnormal findings, medications and the
+overall course. Output plain text, at most 300 words.
+"""
+
+
+def summary_collection_name(collection_name: str) -> str:
+    return f"{collection_name}_summaries"
+
+
+def get_summary_collection(chroma_client, collection_name: str, embedding_function):
+    """Return the summary collection built for `collection_name`, or None if there is none."""
+    try:
+        return chroma_client.get_collection(name=summary_collection_name(collection_name),
+                                            embedding_function=embedding_function)
+    except Exception:
+        return None
+
+
+def _sections(chunks: List) -> List[List]:
+    """Group the chunks of large files into runs of SECTION_SIZE consecutive chunks."""
+    by_source: Dict[str, List] = {}
+    for chunk in chunks:
+        by_source.setdefault(chunk.metadata["source"], []).append(chunk)
+
+    sections = []
+    for source_chunks in by_source.values():
+        if len(source_chunks) < MIN_CHUNKS_FOR_SUMMARY:
+            continue
+        for start in range(0, len(source_chunks), SECTION_SIZE):
+            sections.append(source_chunks[start:start + SECTION_SIZE])
+    return sections
+
+
+def build_summary_index(chroma_client, collection_name: str, embedding_function, chunks: List) -> bool:
+    """
+    Build the section and document levels on top of the chunk-level collection:
+    one summary per SECTION_SIZE consecutive chunks, and one per file from its sections.
+    Both levels are embedded into a separate "<collection>_summaries" collection.
+
+    Parameters:
+        chunks (list): The LangChain documents added to the chunk-level collection.
+
+    Returns:
+        bool: True if a summary collection was created, False if every file was too small.
+    """
+    sections = _sections(chunks)
+    if not sections:
+        return False
+
+    llm_gemini = ChatGoogleGenerativeAI(api_key=os.getenv("GOOGLE_API_KEY"),
+                                model="gemini-2.5-flash",
+                                credentials=creds
+                                )
+
+    section_summaries = llm_gemini.batch(
+        [[SystemMessage(content=section_summary_sys_instruction),
+          HumanMessage(content="\n\n".join(chunk.page_content for chunk in section))]
+         for section in sections],
+        config={"max_concurrency": MAX_CONCURRENT_SUMMARIES},
+    )
+
+    documents, metadatas, ids = [], [], []
+    per_source: Dict[str, List[str]] = {}
+    for i, (section, summary) in enumerate(zip(sections, section_summaries)):
+        source = section[0].metadata["source"]
+        page_start = section[0].metadata["page"]
+        page_end = section[-1].metadata["page"]
+        text = f"[Section of {os.path.basename(source)}, pages {page_start + 1}-{page_end + 1}]\n{summary.content}"
+        documents.append(text)
+        metadatas.append({"level": "section", "source": source, "page_start": page_start, "page_end": page_end})
+        ids.append(f"section_{i}")
+        per_source.setdefault(source, []).append(text)
+
+    sources = list(per_source)
+    document_summaries = llm_gemini.batch(
+        [[SystemMessage(content=document_summary_sys_instruction),
+          HumanMessage(content="\n\n".join(per_source[source]))]
+         for source in sources],
+        config={"max_concurrency": MAX_CONCURRENT_SUMMARIES},
+    )
+    for i, (source, summary) in enumerate(zip(sources, document_summaries)):
+        documents.append(f"[Overview of {os.path.basename(source)}]\n{summary.content}")
+        metadatas.append({"level": "document", "source": source, "page_start": -1, "page_end": -1})
+        ids.append(f"document_{i}")
+
+    collection = chroma_client.create_collection(name=summary_collection_name(collection_name),
+                                                 embedding_function=embedding_function)
+    collection.add(documents=documents, ids=ids, metadatas=metadatas)
+    return True
+
+
+def section_filter(nodes: List[Dict]) -> Optional[Dict]:
+    """
+    Chroma `where` filter restricting chunk-level retrieval to what the given summary
+    nodes cover (a section's pages, or a whole file), used to descend from summaries to chunks.
+    """
+    clauses = []
+    for node in nodes:
+        if node.get("level") == "section":
+            clauses.append({"$and": [{"source": node["source"]},
+                                     {"page": {"$gte": node["page_start"]}},
+                                     {"page": {"$lte": node["page_end"]}}]})
+        elif node.get("level") == "document":
+            clauses.append({"source": node["source"]})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$or": clauses}
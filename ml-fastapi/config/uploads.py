@@ -0,0 +1,69 @@
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, UploadFile
+
+# Uploads larger than this are rejected with 413.
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+# Bytes read from the request per chunk while spooling.
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Where uploads are spooled; defaults to the system temp directory.
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+class SpooledUpload(NamedTuple):
+    path: str        # uniquely named temp file holding the upload
+    filename: str    # name the client sent
+    size: int
+    sha256: str
+
+
+@asynccontextmanager
+async def spool_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                       directory: Optional[str] = UPLOAD_SPOOL_DIR):
+    """
+    Copy an upload to its own temp file chunk by chunk, hashing it on the way,
+    so the whole file is never held in memory and concurrent uploads of files
+    with the same name don't overwrite each other. The temp file is removed on exit.
+
+    Raises:
+        HTTPException: 413 if the upload is larger than max_bytes.
+    """
+    suffix = os.path.splitext(upload.filename or "")[1]
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="upload_", dir=directory)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413,
+                                        detail=f"'{upload.filename}' is larger than {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                f.write(chunk)
+        yield SpooledUpload(path=path, filename=upload.filename, size=size, sha256=digest.hexdigest())
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def mapped(path: str):
+    """
+    Read-only memory map of a spooled upload, for parsers that take a stream.
+    Pages are loaded by the OS on demand instead of being copied into the process.
+    An empty file can't be mapped; it is given as an empty stream, so parsers raise
+    their usual empty-file error.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield io.BytesIO()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
@@ -1,10 +1,17 @@
+import asyncio
 import chromadb
 import os
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 import chromadb.utils.embedding_functions as embedding_functions
 from typing import List, Tuple
 from fastapi import UploadFile
 from google.api_core.exceptions import InvalidArgument
+from .boilerplate import strip_boilerplate_from_documents
+from .parse_cache import load_pdf_documents
+from .uploads import spool_upload
+from .doc_classifier import classify_pages
+from .answer_cache import invalidate_collection
+from .summary_index import build_summary_index, summary_collection_name
 
 # Define the persist directory and collection name.
 PERSIST_DIRECTORY = ".chroma"
@@ -17,13 +24,15 @@ def delete_vector_collection(chroma_client, collection_name: str) -> Tuple[bool,
     """
     try:
         chroma_client.delete_collection(name=collection_name)
+        invalidate_collection(collection_name)
 
         return True, f"Collection '{collection_name}' deleted successfully."
         
     except Exception as e:
         return False, f"Unable to delete collection: {e}"
 
-async def create_vector_db(uploaded_files: List[UploadFile], gemini_api_key: str, thread_id: str) -> Tuple[bool, str]:
+async def create_vector_db(uploaded_files: List[UploadFile], gemini_api_key: str, thread_id: str,
+                           build_summaries: bool = False) -> Tuple[bool, str]:
     """
     Creates a new vector database from uploaded PDF files.
     Deletes the old collection (if it exists) using PersistentClient,
@@ -31,6 +40,7 @@ async def create_vector_db(uploaded_files: List[UploadFile], gemini_api_key: str
     
     Parameters:
         uploaded_files: List of Streamlit uploaded file objects.
+        build_summaries: Also build the section/document summary index for large files.
     
     Returns:
         (True, success_message) or (False, error_message)
@@ -39,34 +49,46 @@ async def create_vector_db(uploaded_files: List[UploadFile], gemini_api_key: str
         return False, "No documents uploaded! Please upload PDFs first."
 
     chroma_client = chromadb.PersistentClient(path=".chroma")
-  
+    # Answers cached for the previous upload no longer apply.
+    invalidate_collection(f"{thread_id}_{COLLECTION_NAME}")
 
     # If the persist directory exists, delete the previous collection.
     if f"{thread_id}_{COLLECTION_NAME}" in chroma_client.list_collections():
         success, msg = delete_vector_collection(chroma_client,f"{thread_id}_{COLLECTION_NAME}")
         if not success:
             return False, msg
+    if summary_collection_name(f"{thread_id}_{COLLECTION_NAME}") in chroma_client.list_collections():
+        success, msg = delete_vector_collection(chroma_client,summary_collection_name(f"{thread_id}_{COLLECTION_NAME}"))
+        if not success:
+            return False, msg
 
     try:  
         google_ef  = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=gemini_api_key)
     except InvalidArgument:
         return False, "Invalid Gemini API Key"
-    collection = chroma_client.create_collection(name=f"{thread_id}_{COLLECTION_NAME}", embedding_function=google_ef)
 
 
     # Process the uploaded files.
     cumulative_pages = []
+    skipped_files = []
     for uploaded_file in uploaded_files:
-        # Save the uploaded file temporarily.
-        file_path =  f"temp_{uploaded_file.filename}" 
-        with open(file_path, "wb") as f:
-            f.write(await uploaded_file.read())
-        # Load and split the PDF into pages.
-        loader = PyPDFLoader(file_path)
-        pages = loader.load_and_split()
-        cumulative_pages.extend(pages)
-        # Clean up the temporary file.
-        os.remove(file_path)
+        # Spool the upload to its own temp file; it is removed when the block exits.
+        async with spool_upload(uploaded_file) as spooled:
+            # Load the PDF into pages (through the page cache), drop repeated headers/footers, then split.
+            pages = load_pdf_documents(spooled.path, source=spooled.filename, file_sha=spooled.sha256)
+            # Only files with clear non-medical evidence are left out; unclassified files are embedded.
+            if classify_pages([page.page_content for page in pages]) == "non_medical":
+                skipped_files.append(spooled.filename)
+                continue
+            pages = strip_boilerplate_from_documents(pages)
+            pages = RecursiveCharacterTextSplitter().split_documents(pages)
+            cumulative_pages.extend(pages)
+
+    if not cumulative_pages:
+        return False, "No medical documents found in the upload."
+
+    # Created only once every upload has been spooled, so a rejected upload (413) leaves no empty collection behind.
+    collection = chroma_client.create_collection(name=f"{thread_id}_{COLLECTION_NAME}", embedding_function=google_ef)
 
     documents=[]
     metadatas=[]
@@ -78,6 +100,14 @@ async def create_vector_db(uploaded_files: List[UploadFile], gemini_api_key: str
         ids.append(str(i))
 
     collection.add(documents=documents,ids=ids,metadatas=metadatas)
+    # Also drop anything answered while the new documents were being added.
+    invalidate_collection(f"{thread_id}_{COLLECTION_NAME}")
+
+    skipped = f" (skipped non-medical files: {', '.join(skipped_files)})" if skipped_files else ""
+    # Summarising makes one LLM call per batch of chunks; keep it off the event loop.
+    if build_summaries and await asyncio.to_thread(build_summary_index, chroma_client, f"{thread_id}_{COLLECTION_NAME}",
+                                                   google_ef, cumulative_pages):
+        return True, f"Vector DB and summary index created and persisted{skipped}"
 
-    return True, f"Vector DB created and persisted"
+    return True, f"Vector DB created and persisted{skipped}"
 
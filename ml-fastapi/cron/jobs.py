@@ -1,14 +1,39 @@
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
 import datetime
-from .tasks import   trackVectorDBList, flushVectorDB
+import os
+from .tasks import   trackVectorDBList, flushVectorDB, precomputeCommonAnswers
+from config.parse_cache import clear_cache as flushParseCache
 
-scheduler = BackgroundScheduler()
+# Cap on answer precomputations running at once; further ones queue up.
+MAX_CONCURRENT_PRECOMPUTATIONS = int(os.getenv("RAG_PRECOMPUTE_CONCURRENCY", "2"))
+
+scheduler = BackgroundScheduler(executors={
+    "default": ThreadPoolExecutor(10),
+    "precompute": ThreadPoolExecutor(MAX_CONCURRENT_PRECOMPUTATIONS),
+})
 
 
 
 
 # Schedule the job to run once at startup
 scheduler.add_job(flushVectorDB, trigger="date", run_date=datetime.datetime.now())
+scheduler.add_job(flushParseCache, trigger="date", run_date=datetime.datetime.now())
 
 # Schedule the job to run every 30 secs
-scheduler.add_job(trackVectorDBList, 'interval', seconds=30)
\ No newline at end of file
+scheduler.add_job(trackVectorDBList, 'interval', seconds=30)
+
+
+def schedulePrecomputation(collection_name: str, gemini_api: str, generation: int):
+    """
+    Queue answer precomputation for a freshly ingested collection. A job still waiting
+    for the same collection is replaced; a running one notices the new generation and stops.
+    """
+    scheduler.add_job(
+        precomputeCommonAnswers,
+        args=[collection_name, gemini_api, generation],
+        executor="precompute",
+        id=f"precompute_{collection_name}",
+        replace_existing=True,
+        misfire_grace_time=None,
+    )
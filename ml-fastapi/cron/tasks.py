@@ -4,8 +4,18 @@ import datetime
 # import os
 
 from config.vectordb import delete_vector_collection
+from config.rag import rag_graph
+from config.answer_cache import current_generation
 from .storage import vector_db_list
 
+# Stock questions users ask right after uploading; answered ahead of time into the
+# semantic answer cache so the first interactive question is served instantly.
+COMMON_QUESTIONS = [
+    "Give a brief summary of the uploaded medical documents.",
+    "What are the abnormal values in the reports?",
+    "Which medications are mentioned in the documents?",
+]
+
 
 
 def appendVectorName(collection_name: str):
@@ -47,3 +57,39 @@ def flushVectorDB():
         
 
         
+
+
+def precomputeCommonAnswers(collection_name: str, gemini_api: str, generation: int):
+    """
+    Run COMMON_QUESTIONS through rag_graph for a freshly ingested collection.
+    The answers land in the semantic answer cache through the graph's own cache node.
+    Stops as soon as the collection is replaced or deleted (its generation changes).
+    """
+    for question_id, question in enumerate(COMMON_QUESTIONS):
+        if current_generation(collection_name) != generation:
+            print(f"Precomputation cancelled: {collection_name} was replaced.")
+            return f"Precomputation cancelled: {collection_name} was replaced."
+
+        thread_id = f"{collection_name}_precompute_{question_id}"
+        thread = {"configurable": {"thread_id": thread_id}}
+        try:
+            rag_graph.invoke({
+                "question": question,
+                "max_queries": 3,
+                "collection_path": collection_name,
+                "gemini_api": gemini_api,
+                "allowed_call_count": 2,
+                "expired_call_count": 0,
+                # Background work doesn't need the latency win; leave the speculation workers to users
+                "speculative_drafting": False,
+                "pinned_generation": generation
+            }, thread)
+        except Exception as e:
+            print(f"Precomputation failed for {collection_name}: {e}")
+            return f"Precomputation failed for {collection_name}: {e}"
+        finally:
+            # Precomputed runs are never resumed; don't keep their checkpoints in memory.
+            rag_graph.checkpointer.delete_thread(thread_id)
+
+    print(f"Precomputed {len(COMMON_QUESTIONS)} answers for {collection_name}")
+    return f"Precomputed {len(COMMON_QUESTIONS)} answers for {collection_name}"
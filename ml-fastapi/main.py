@@ -1,26 +1,37 @@
 ## FAST-API BASE APP
 from config.vectordb import create_vector_db
-from langchain_community.document_loaders import PyPDFLoader
+from config.boilerplate import strip_boilerplate_from_documents
+from config.parse_cache import load_pdf_documents
+from config.uploads import spool_upload
+from config.lab_tables import extract_lab_rows
+from config.doc_classifier import classify_pages
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form, HTTPException
 from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 import os
+import json
 import datetime
 import base64
 
 from typing import List, Optional
 
-from config.fastapi_models import Thread,GraphInput,PrelimInterrupt,APIInput,RagChat,VisionInput,VisionFeedback
+from config.fastapi_models import Thread,GraphInput,PrelimInterrupt,APIInput,RagChat,RagBatchChat,VisionInput,VisionFeedback
 from config.validate_api import validate_keys
 from config.main_graph import graph
+from config.hugging_face_ner import ner_cache_stats
 from config.rag import rag_graph
+from config.rag_batch import answer_questions
 from config.medical_summarizer_graph import medical_insights_graph
 from config.vision_graph import vision_graph
+from config.sse import graph_events, answer_event, skipped_event, STREAM_MODES
 
 
-from cron.jobs import scheduler
+from cron.jobs import scheduler, schedulePrecomputation
+from config.answer_cache import current_generation
+from config.summary_index import summary_collection_name
 from cron.tasks import appendVectorName
 
 app = FastAPI(title="Mini-CDSS API", description="Clinical Decision Support System API", version="1.0.0")
@@ -50,6 +61,11 @@ async def read_root():
 def root():
     return "PONG"
 
+@app.get("/ner-cache/stats")
+def get_ner_cache_stats():
+    """Hit rate and size of the sentence-level NER cache."""
+    return ner_cache_stats()
+
 def my_shutdown_job():
     print(f"Server shutting down at {datetime.datetime.now()}")
 
@@ -84,11 +100,11 @@ async def graphstart(input_data: GraphInput):
     # logger.debug(f'{input_data}')
     async def event_stream():
         thread = {"configurable": {"thread_id": input_data.thread_id}}
-        for event in graph.stream({"initial_summary": input_data.text, 
-                                   "diagnosis_count": input_data.diagnosis_count,
-                                   "medical_report": input_data.medical_report}, thread, stream_mode="updates"):
-            node_name = next(iter(event.keys()))
-            yield f"data: {node_name}\n\n"
+        stream = graph.stream({"initial_summary": input_data.text, 
+                               "diagnosis_count": input_data.diagnosis_count,
+                               "medical_report": input_data.medical_report}, thread, stream_mode=STREAM_MODES)
+        for event in graph_events(stream):
+            yield event
         
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
@@ -105,9 +121,8 @@ async def prelim_human_feedback(prelim_feedback: PrelimInterrupt):
     graph.update_state(thread, {"human_prelim_feedback":further_feedback}, as_node="prelim human feedback node")
 
     async def event_stream():
-        for event in graph.stream(None, thread, stream_mode="updates"):
-            node_name = next(iter(event.keys()))
-            yield f"data: {node_name}\n\n"
+        for event in graph_events(graph.stream(None, thread, stream_mode=STREAM_MODES)):
+            yield event
             # await asyncio.sleep(1)
         
     return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -157,23 +172,32 @@ async def add_files(
     thread_id: str= Form(...),
     gemini_api_key: Optional[str] = Form(None),
     files: List[UploadFile] = File(...),
+    precompute_answers: bool = Form(False),
+    build_summary_index: bool = Form(False),
 ):
     """
     Endpoint to upload PDF files and create a vector database.
     The API key for the embedding function is supplied as a form field.
+    With precompute_answers, common questions are answered in the background right after ingestion.
+    With build_summary_index, large files also get section/document summaries for broad questions.
     """
     # DEBUG: Check if files are received correctly
 
     try:
         if not gemini_api_key:
             gemini_api_key = os.environ["GOOGLE_API_KEY"] 
-        success, message = await create_vector_db(files, gemini_api_key,thread_id)
+        success, message = await create_vector_db(files, gemini_api_key,thread_id,build_summary_index)
         if not success:
             raise HTTPException(status_code=400, detail=message)
         
         # scheduler.add_job(appendVectorName, args=[f"{thread_id}_vectorDB"])
         # Directly trigger the append function
         appendVectorName(f"{thread_id}_vectorDB")
+        if build_summary_index:
+            appendVectorName(summary_collection_name(f"{thread_id}_vectorDB"))
+        if precompute_answers:
+            collection_name = f"{thread_id}_vectorDB"
+            schedulePrecomputation(collection_name, gemini_api_key, current_generation(collection_name))
         return {"success": success, "message": message}
 
     except HTTPException as http_err:
@@ -193,20 +217,48 @@ async def rag_chat(input_data: RagChat):
 
     async def event_stream():
         thread = {"configurable": {"thread_id": input_data.thread_id}}
-        for event in rag_graph.stream({
+        stream = rag_graph.stream({
             "question": input_data.question,
             "max_queries": 3,
             "collection_path": f"{input_data.thread_id}_{COLLECTION_NAME}",
             "gemini_api": gemini,
             "allowed_call_count": 2,
-            "expired_call_count": 0
-        }, thread):
-            node_name = next(iter(event.keys()))
-            yield f"data: {node_name}\n\n"
+            "expired_call_count": 0,
+            "speculative_drafting": bool(input_data.speculative)
+        }, thread, stream_mode=STREAM_MODES)
+        for event in graph_events(stream):
+            yield event
         
     return StreamingResponse(event_stream(), media_type="text/event-stream")
     
 
+@app.post("/ragBatchSearch")
+async def rag_batch_chat(input_data: RagBatchChat):
+    """
+    Answer several questions about one thread's upload in a single request.
+    Each answer is streamed as an `event: answer` SSE event as soon as it is ready.
+    """
+    if not input_data.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if not input_data.gemini:
+        gemini = os.environ["GOOGLE_API_KEY"]
+    else:
+        gemini = input_data.gemini
+
+    COLLECTION_NAME="vectorDB"
+
+    async def event_stream():
+        try:
+            async for result in answer_questions(input_data.questions,
+                                                 f"{input_data.thread_id}_{COLLECTION_NAME}",
+                                                 gemini):
+                yield answer_event(result)
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.post("/ragAnswer")
 async def rag_answer(thread: Thread):
     thread = {"configurable": {"thread_id": thread.thread_id}}
@@ -229,26 +281,36 @@ async def extract_medical_details(
     thread = {"configurable": {"thread_id":thread_id}}
     async def readFiles(files):
         extracted_files=[]
+        skipped_files=[]
         for file_id,uploaded_file in enumerate(files):
-            file_path =  f"temp_{uploaded_file.filename}" 
-            with open(file_path, "wb") as f:
-                f.write(await uploaded_file.read())
-            # Load and split the PDF into pages.
-            loader = PyPDFLoader(file_path)
-            pages = loader.load_and_split()
-            extracted_files.append((file_id,pages))
-            os.remove(file_path)
-
-        return extracted_files
+            # Spool the upload to its own temp file; it is removed when the block exits.
+            async with spool_upload(uploaded_file) as spooled:
+                # Load the PDF into pages (through the page cache), drop repeated headers/footers, then split.
+                pages = load_pdf_documents(spooled.path, source=spooled.filename, file_sha=spooled.sha256)
+                # Route by document type; files that aren't medical are dropped before any LLM call.
+                # Files that can't be classified confidently (doc_type None) go through the untyped path.
+                doc_type = classify_pages([page.page_content for page in pages])
+                if doc_type == "non_medical":
+                    skipped_files.append(uploaded_file.filename)
+                    continue
+                pages = strip_boilerplate_from_documents(pages)
+                pages = RecursiveCharacterTextSplitter().split_documents(pages)
+                # Lab tables are parsed locally so their values skip the LLM
+                lab_rows = extract_lab_rows(spooled.path) if doc_type in ("lab_report", None) else []
+                extracted_files.append((file_id,pages,lab_rows,doc_type))
+
+        return extracted_files, skipped_files
     
 
-    files = await readFiles(files)
+    files, skipped_files = await readFiles(files)
 
     async def event_stream():
         try:
-            for event in medical_insights_graph.stream({"files":files}, thread):
-                node_name = next(iter(event.keys()))
-                yield f"data: Processing node: {node_name}\n\n"
+            if skipped_files:
+                yield skipped_event(skipped_files)
+            stream = medical_insights_graph.stream({"files":files}, thread, stream_mode=STREAM_MODES)
+            for event in graph_events(stream, node_prefix="Processing node: "):
+                yield event
 
         except Exception as e:
             yield {"error": str(e)}
@@ -94,6 +94,7 @@ async function startGraph() {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let nodes = [];
+        let eventType = 'message';
 
         while (true) {
             const { done, value } = await reader.read();
@@ -103,11 +104,16 @@ async function startGraph() {
             const lines = chunk.split('\n');
             
             for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    const nodeName = line.substring(6).trim();
+                if (line.startsWith('event: ')) {
+                    eventType = line.substring(7).trim();
+                } else if (line.startsWith('data: ')) {
+                    // Report tokens arrive as "event: token" and are not node names
+                    const nodeName = eventType === 'token' ? '' : line.substring(6).trim();
                     if (nodeName) {
                         nodes.push(nodeName);
                     }
+                } else if (line === '') {
+                    eventType = 'message';
                 }
             }
         }
@@ -187,6 +193,8 @@ async function extractMedicalDetails() {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let nodes = [];
+        let skippedFiles = [];
+        let eventType = 'message';
 
         while (true) {
             const { done, value } = await reader.read();
@@ -196,16 +204,25 @@ async function extractMedicalDetails() {
             const lines = chunk.split('\n');
             
             for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    const nodeName = line.substring(6).trim();
-                    if (nodeName) {
-                        nodes.push(nodeName);
+                if (line.startsWith('event: ')) {
+                    eventType = line.substring(7).trim();
+                } else if (line.startsWith('data: ')) {
+                    const data = line.substring(6).trim();
+                    if (eventType === 'skipped') {
+                        // Files the server left out as non-medical
+                        skippedFiles.push(...JSON.parse(data));
+                    } else if (eventType === 'message' && data) {
+                        // Report tokens arrive as "event: token" and are not node names
+                        nodes.push(data);
                     }
+                } else if (line === '') {
+                    eventType = 'message';
                 }
             }
         }
 
-        showStatus('upload-status', `Extraction complete! Processed: ${nodes.join(' → ')}`, 'success');
+        const skipped = skippedFiles.length ? ` Skipped non-medical files: ${skippedFiles.join(', ')}` : '';
+        showStatus('upload-status', `Extraction complete! Processed: ${nodes.join(' → ')}${skipped}`, 'success');
     } catch (error) {
         showStatus('upload-status', `Error: ${error.message}`, 'error');
     }
@@ -241,13 +258,31 @@ async function ragSearch() {
 
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        const liveBox = document.getElementById('rag-answer');
+        let liveAnswer = '';
+        let eventType = 'message';
+        let buffer = '';
 
         while (true) {
             const { done, value } = await reader.read();
             if (done) break;
             
-            const chunk = decoder.decode(value);
-            // Just acknowledge processing
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+
+            // Show the answer as it is drafted; the final text is fetched below
+            for (const line of lines) {
+                if (line.startsWith('event: ')) {
+                    eventType = line.substring(7).trim();
+                } else if (line.startsWith('data: ') && eventType === 'token') {
+                    liveAnswer += JSON.parse(line.substring(6)).content;
+                    liveBox.innerHTML = marked.parse ? marked.parse(liveAnswer) : liveAnswer;
+                    liveBox.classList.add('show');
+                } else if (line === '') {
+                    eventType = 'message';
+                }
+            }
         }
 
         // Get the answer